@@ -0,0 +1,226 @@
+"""
+Tabelle aggregate ricalcolate dopo gli import, lette dalle viste con lookup indicizzati
+invece di scansionare lo storico manutenzioni a ogni richiesta.
+"""
+
+from django.db import connection, transaction
+
+from .models import DistribuzioneGuasti, LampioneManutenzione, RiepilogoAsset
+
+TOP_CATEGORIE = 10
+TOP_INTERVENTI = 5
+ETICHETTA_ALTRO = 'Altro (Guasti minori)'
+# arm_id ricalcolati per ogni INSERT ... SELECT del riepilogo (limite ai parametri della query)
+BATCH_RIEPILOGO = 500
+
+# Stessa normalizzazione della categoria usata in precedenza dalla CTE di dettaglio_asset
+_BASE = """
+    SELECT
+      arm_lmp_potenza_nominale AS potenza,
+      arm_altezza AS altezza,
+      COALESCE(NULLIF(TRIM(tcs_descr), ''), 'Senza categoria') AS tcs_descr
+    FROM core_lampionemanutenzione
+    WHERE tcs_descr IS NOT NULL
+"""
+
+_SQL_COMBINAZIONI = f"""
+WITH base AS ({_BASE}),
+gruppi AS (
+    SELECT potenza, altezza, tcs_descr, COUNT(*) AS n
+    FROM base
+    WHERE potenza IS NOT NULL AND altezza IS NOT NULL
+    GROUP BY potenza, altezza, tcs_descr
+)
+INSERT INTO {{tabella}} (citta, arm_lmp_potenza_nominale, arm_altezza, tcs_descr, n_eventi, prob_guasto)
+SELECT %s, potenza, altezza, tcs_descr, n,
+       CAST(n AS REAL) / SUM(n) OVER (PARTITION BY potenza, altezza)
+FROM gruppi
+"""
+
+_SQL_CITTA = f"""
+WITH base AS ({_BASE}),
+gruppi AS (
+    SELECT tcs_descr, COUNT(*) AS n
+    FROM base
+    GROUP BY tcs_descr
+)
+INSERT INTO {{tabella}} (citta, arm_lmp_potenza_nominale, arm_altezza, tcs_descr, n_eventi, prob_guasto)
+SELECT %s, NULL, NULL, tcs_descr, n, CAST(n AS REAL) / SUM(n) OVER ()
+FROM gruppi
+"""
+
+# Statistiche della dashboard in una sola query. Le due aggregazioni leggono lo
+# storico ciascuna col suo percorso: le categorie solo dall'indice manut_categoria_data,
+# gli interventi dalla tabella. Un'unica lettura raggruppata per (categoria, intervento)
+# su SQLite costa il doppio, perché ordina tre colonne di testo invece di usare l'indice.
+_SQL_DASHBOARD = """
+WITH categorie AS (
+    SELECT tcs_descr AS etichetta, COUNT(*) AS totale,
+           ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC, tcs_descr) AS posizione
+    FROM {tabella}
+    WHERE tcs_descr IS NOT NULL AND tcs_descr <> ''
+    GROUP BY tcs_descr
+),
+categorie_top AS (
+    SELECT CASE WHEN posizione <= %s THEN posizione ELSE %s + 1 END AS posizione,
+           CASE WHEN posizione <= %s THEN etichetta ELSE %s END AS etichetta,
+           totale
+    FROM categorie
+),
+interventi AS (
+    SELECT tci_descr AS etichetta, COUNT(*) AS totale,
+           ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC, tci_descr) AS posizione
+    FROM {tabella}
+    WHERE tci_id IS NOT NULL AND tci_id <> 0 AND tci_descr IS NOT NULL AND tci_descr <> ''
+    GROUP BY tci_id, tci_descr
+)
+SELECT 'categoria' AS tipo, etichetta, SUM(totale) AS totale, posizione
+FROM categorie_top
+GROUP BY posizione, etichetta
+UNION ALL
+SELECT 'intervento' AS tipo, etichetta, totale, posizione
+FROM interventi
+WHERE posizione <= %s
+ORDER BY 1, 4
+"""
+
+
+def sql_dashboard():
+    """(sql, parametri) della query delle statistiche, anche per spiega_query."""
+    tabella = connection.ops.quote_name(LampioneManutenzione._meta.db_table)
+    parametri = [TOP_CATEGORIE, TOP_CATEGORIE, TOP_CATEGORIE, ETICHETTA_ALTRO, TOP_INTERVENTI]
+    return _SQL_DASHBOARD.format(tabella=tabella), parametri
+
+
+def statistiche_manutenzioni():
+    """
+    Prime TOP_CATEGORIE categorie di guasto più "Altro" con la somma delle restanti,
+    e i TOP_INTERVENTI interventi più usati: {'categorie': [(etichetta, totale)], 'interventi': [...]}.
+    """
+    risultato = {'categorie': [], 'interventi': []}
+    with connection.cursor() as cursor:
+        cursor.execute(*sql_dashboard())
+        for tipo, etichetta, totale, _ in cursor.fetchall():
+            chiave = 'categorie' if tipo == 'categoria' else 'interventi'
+            risultato[chiave].append((etichetta, int(totale)))
+    return risultato
+
+
+def aggiorna_distribuzione_guasti():
+    """Ricalcola da zero DistribuzioneGuasti dallo storico manutenzioni. Ritorna il numero di righe."""
+    tabella = connection.ops.quote_name(DistribuzioneGuasti._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        DistribuzioneGuasti.objects.all().delete()
+        cursor.execute(_SQL_COMBINAZIONI.format(tabella=tabella), [False])
+        cursor.execute(_SQL_CITTA.format(tabella=tabella), [True])
+    return DistribuzioneGuasti.objects.count()
+
+
+# Riepilogo per arm_id: conteggi e date dal GROUP BY, categoria e intervento più
+# frequenti dal primo posto di ROW_NUMBER per lampione. {filtro} limita gli arm_id.
+_SQL_RIEPILOGO = """
+WITH base AS (
+    SELECT arm_id, sgn_data_inserimento, tcs_descr, tci_descr
+    FROM {storico}
+    WHERE {filtro}
+),
+eventi AS (
+    SELECT arm_id, COUNT(*) AS n_eventi, COUNT(sgn_data_inserimento) AS n_datati,
+           MIN(sgn_data_inserimento) AS primo, MAX(sgn_data_inserimento) AS ultimo
+    FROM base
+    GROUP BY arm_id
+),
+categorie AS (
+    SELECT arm_id, tcs_descr,
+           ROW_NUMBER() OVER (PARTITION BY arm_id ORDER BY COUNT(*) DESC, tcs_descr) AS posizione
+    FROM base
+    WHERE tcs_descr IS NOT NULL AND tcs_descr <> ''
+    GROUP BY arm_id, tcs_descr
+),
+interventi AS (
+    SELECT arm_id, tci_descr,
+           ROW_NUMBER() OVER (PARTITION BY arm_id ORDER BY COUNT(*) DESC, tci_descr) AS posizione
+    FROM base
+    WHERE tci_descr IS NOT NULL AND tci_descr <> ''
+    GROUP BY arm_id, tci_descr
+)
+INSERT INTO {tabella} (arm_id, n_eventi, primo_guasto, ultimo_guasto, mtbf_giorni, tcs_descr_frequente, tci_descr_frequente)
+SELECT e.arm_id, e.n_eventi, e.primo, e.ultimo,
+       CASE WHEN e.n_datati > 1 THEN ({giorni}) / (e.n_datati - 1) END,
+       c.tcs_descr, i.tci_descr
+FROM eventi e
+LEFT JOIN categorie c ON c.arm_id = e.arm_id AND c.posizione = 1
+LEFT JOIN interventi i ON i.arm_id = e.arm_id AND i.posizione = 1
+"""
+
+
+def _sql_riepilogo(filtro):
+    qn = connection.ops.quote_name
+    if connection.vendor == 'sqlite':
+        giorni = 'julianday(e.ultimo) - julianday(e.primo)'
+    else:
+        giorni = 'EXTRACT(EPOCH FROM (e.ultimo - e.primo)) / 86400.0'
+    return _SQL_RIEPILOGO.format(
+        storico=qn(LampioneManutenzione._meta.db_table), tabella=qn(RiepilogoAsset._meta.db_table),
+        filtro=filtro, giorni=giorni,
+    )
+
+
+def aggiorna_riepilogo_asset(arm_ids=None):
+    """
+    Ricalcola RiepilogoAsset dallo storico manutenzioni: tutto (arm_ids=None, dopo
+    un import completo) oppure solo gli arm_id indicati, a blocchi. Gli arm_id senza
+    più eventi perdono la loro riga. Ritorna il numero di arm_id ricalcolati.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if arm_ids is None:
+            RiepilogoAsset.objects.all().delete()
+            cursor.execute(_sql_riepilogo('1 = 1'))
+            return RiepilogoAsset.objects.count()
+
+        arm_ids = sorted(set(arm_ids))
+        for inizio in range(0, len(arm_ids), BATCH_RIEPILOGO):
+            blocco = arm_ids[inizio:inizio + BATCH_RIEPILOGO]
+            RiepilogoAsset.objects.filter(arm_id__in=blocco).delete()
+            cursor.execute(_sql_riepilogo('arm_id IN ({})'.format(', '.join(['%s'] * len(blocco)))), blocco)
+    return len(arm_ids)
+
+
+def riepilogo_asset(arm_id):
+    return RiepilogoAsset.objects.filter(arm_id=arm_id).first()
+
+
+async def ariepilogo_asset(arm_id):
+    return await RiepilogoAsset.objects.filter(arm_id=arm_id).afirst()
+
+
+def righe_distribuzione(potenza, altezza):
+    """Righe cittadine più quelle della combinazione potenza/altezza (se nota), in un solo queryset."""
+    righe = DistribuzioneGuasti.objects.filter(citta=True)
+    if potenza is not None and altezza is not None:
+        righe = righe | DistribuzioneGuasti.objects.filter(
+            citta=False, arm_lmp_potenza_nominale=potenza, arm_altezza=altezza
+        )
+    return righe.order_by('citta', '-prob_guasto')
+
+
+def _specifiche_o_cittadine(righe):
+    specifiche = [riga[1:] for riga in righe if not riga[0]]
+    if specifiche:
+        return specifiche, False
+    return [riga[1:] for riga in righe], True
+
+
+def distribuzione_guasti(potenza, altezza):
+    """
+    Righe (tcs_descr, prob_guasto, n_eventi) per la combinazione potenza/altezza,
+    ordinate per probabilità, oppure quelle cittadine se la combinazione non ha storico.
+    Una sola query sull'indice. Ritorna (righe, True se sono i dati cittadini).
+    """
+    righe = righe_distribuzione(potenza, altezza).values_list('citta', 'tcs_descr', 'prob_guasto', 'n_eventi')
+    return _specifiche_o_cittadine(list(righe))
+
+
+async def adistribuzione_guasti(potenza, altezza):
+    righe = righe_distribuzione(potenza, altezza).values_list('citta', 'tcs_descr', 'prob_guasto', 'n_eventi')
+    return _specifiche_o_cittadine([riga async for riga in righe])
@@ -0,0 +1,371 @@
+"""
+Scrittura massiva di DataFrame pandas nelle tabelle Django.
+
+Le colonne vengono convertite una volta sola (per colonna, non per riga)
+nei tipi che il backend si aspetta e poi inviate con executemany, senza
+istanziare un oggetto Model per ogni riga.
+"""
+
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+BATCH_SIZE = 5000
+
+
+def _none_se_vuoto(serie, valori):
+    valori = pd.Series(valori, index=serie.index, dtype=object)
+    return valori.where(serie.notna(), None).tolist()
+
+
+def _colonna_db(field, serie):
+    """
+    Converte una colonna del DataFrame in una lista di valori pronti per il DB,
+    con la stessa rappresentazione che userebbe l'ORM (date come stringhe su
+    SQLite, datetime in UTC se il backend non gestisce i fusi orari).
+    """
+    if isinstance(field, models.DateTimeField):
+        serie = pd.to_datetime(serie, errors='coerce')
+        if serie.dt.tz is None:
+            # ora legale ambigua/inesistente risolta come fa timezone.make_aware
+            serie = serie.dt.tz_localize(
+                timezone.get_current_timezone(),
+                ambiguous=np.ones(len(serie), dtype=bool),
+                nonexistent='shift_forward',
+            )
+        if connection.vendor == 'sqlite' or not connection.features.supports_timezones:
+            serie = serie.dt.tz_convert('UTC').dt.tz_localize(None)
+        if connection.vendor == 'sqlite':
+            # str(datetime): i microsecondi compaiono solo se diversi da zero
+            testo = serie.dt.strftime('%Y-%m-%d %H:%M:%S').where(
+                serie.dt.microsecond == 0, serie.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+            )
+            return _none_se_vuoto(serie, testo)
+        return _none_se_vuoto(serie, serie.dt.to_pydatetime())
+
+    if isinstance(field, models.DateField):
+        serie = pd.to_datetime(serie, errors='coerce')
+        if connection.vendor == 'sqlite':
+            return _none_se_vuoto(serie, serie.dt.strftime('%Y-%m-%d'))
+        return _none_se_vuoto(serie, serie.dt.date)
+
+    if isinstance(field, models.IntegerField):
+        serie = pd.to_numeric(serie, errors='coerce').round().astype('Int64')
+    elif isinstance(field, models.FloatField):
+        serie = pd.to_numeric(serie, errors='coerce').astype(float)
+
+    serie = serie.astype(object)
+    return serie.where(serie.notna(), None).tolist()
+
+
+def righe_db(model, df, campi):
+    """Tuple (una per riga) con i valori dei campi indicati, nell'ordine di `campi`."""
+    colonne = [_colonna_db(model._meta.get_field(campo), df[campo]) for campo in campi]
+    return list(zip(*colonne))
+
+
+def inserisci_bulk(model, df, campi, tabella=None, batch_size=BATCH_SIZE):
+    """
+    INSERT massivo delle righe di `df` (colonne = nomi dei campi del modello).
+    `tabella` permette di scrivere in una tabella diversa da quella del modello
+    (stesso schema). Ritorna il numero di righe inserite.
+    """
+    qn = connection.ops.quote_name
+    colonne = [model._meta.get_field(campo).column for campo in campi]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        qn(tabella or model._meta.db_table),
+        ', '.join(qn(c) for c in colonne),
+        ', '.join(['%s'] * len(colonne)),
+    )
+
+    inserite = 0
+    with connection.cursor() as cursor:
+        for inizio in range(0, len(df), batch_size):
+            righe = righe_db(model, df.iloc[inizio:inizio + batch_size], campi)
+            cursor.executemany(sql, righe)
+            inserite += len(righe)
+    return inserite
+
+
+def aggiorna_bulk(model, df, campi, batch_size=BATCH_SIZE):
+    """UPDATE per chiave primaria delle righe di `df` (serve la colonna 'id')."""
+    qn = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        qn(model._meta.db_table),
+        ', '.join(f'{qn(model._meta.get_field(campo).column)} = %s' for campo in campi),
+        qn(model._meta.pk.column),
+    )
+
+    aggiornate = 0
+    with connection.cursor() as cursor:
+        for inizio in range(0, len(df), batch_size):
+            blocco = df.iloc[inizio:inizio + batch_size]
+            righe = [riga + (int(pk),) for riga, pk in zip(righe_db(model, blocco, campi), blocco['id'])]
+            cursor.executemany(sql, righe)
+            aggiornate += len(righe)
+    return aggiornate
+
+
+def _chiave(df, chiavi):
+    return pd.MultiIndex.from_frame(df[chiavi].apply(pd.to_numeric, errors='coerce'))
+
+
+def senza_chiave(df, chiavi):
+    """
+    Maschera delle righe con una chiave vuota (es. evento senza sgn_id): non
+    possono essere riconosciute fra un import e l'altro, il chiamante le scarta.
+    """
+    return df[chiavi].apply(pd.to_numeric, errors='coerce').isna().any(axis=1)
+
+
+def _esistenti(model, df, chiavi, campi, batch_size=900):
+    """Righe già presenti nel DB per i valori della prima chiave che compaiono in `df`."""
+    valori = pd.unique(df[chiavi[0]].dropna()).tolist()
+    righe = []
+    for inizio in range(0, len(valori), batch_size):
+        filtro = {f'{chiavi[0]}__in': valori[inizio:inizio + batch_size]}
+        righe.extend(model.objects.filter(**filtro).values('id', *campi))
+    return pd.DataFrame.from_records(righe, columns=['id'] + list(campi))
+
+
+@contextmanager
+def righe_viste(model):
+    """
+    Tabella temporanea in cui sincronizza_bulk segna gli id delle righe trovate
+    nel DB, per ritira_mancanti: la memoria non dipende dalla dimensione della tabella.
+    Restituisce il nome (già quotato) della tabella temporanea.
+    """
+    visti = connection.ops.quote_name(f'{model._meta.db_table}__visti')
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {visti}')
+        cursor.execute(f'CREATE TEMPORARY TABLE {visti} (id integer NOT NULL)')
+        try:
+            yield visti
+        finally:
+            cursor.execute(f'DROP TABLE IF EXISTS {visti}')
+
+
+def segna_visti(visti, queryset):
+    """Segna come viste (da non ritirare) le righe del queryset."""
+    sql, parametri = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {visti} (id) {sql}', parametri)
+
+
+def sincronizza_bulk(model, df, chiavi, campi, campi_confronto=None, batch_size=BATCH_SIZE, toccati=None,
+                     campi_aggiornamento=None, visti=None, inseriti_dopo_id=None):
+    """
+    Upsert di `df` sulla tabella del modello usando `chiavi` come chiave naturale:
+    inserisce le righe nuove (tutti i `campi`) e aggiorna i `campi_aggiornamento`
+    (default: tutti i `campi`) solo di quelle con almeno uno dei `campi_confronto`
+    (default: tutti i `campi`) diverso dal DB. Le righe di `df` devono avere tutte
+    le chiavi valorizzate (vedi senza_chiave); quelle del DB senza chiave sono ignorate.
+    A parità di chiave vale l'ultima riga di `df`: le altre sono "doppioni", come
+    le righe che ritrovano una riga inserita dallo stesso import in un blocco
+    precedente (id > `inseriti_dopo_id`, l'ultimo id prima dell'import).
+    Se `toccati` è un set, vi aggiunge i valori della prima chiave delle righe
+    inserite o aggiornate (es. gli arm_id delle tabelle derivate da ricalcolare).
+    Se `visti` è una tabella di righe_viste, vi segna gli id delle righe trovate nel DB.
+    Ritorna (inseriti, aggiornati, invariati, doppioni).
+    """
+    campi_confronto = campi_confronto or campi
+    campi_aggiornamento = campi_aggiornamento or campi
+    if senza_chiave(df, chiavi).any():
+        raise ValueError(f"righe senza chiave ({', '.join(chiavi)}): vanno scartate prima dell'upsert")
+    righe = len(df)
+    df = df.drop_duplicates(subset=chiavi, keep='last')
+    doppioni = righe - len(df)
+    esistenti = _esistenti(model, df, chiavi, campi)
+    esistenti = esistenti[~senza_chiave(esistenti, chiavi)]
+    esistenti = esistenti[~_chiave(esistenti, chiavi).duplicated()]
+
+    posizione = pd.Series(esistenti['id'].values, index=_chiave(esistenti, chiavi))
+    df = df.assign(id=posizione.reindex(_chiave(df, chiavi)).values)
+
+    nuovi = df[df['id'].isna()]
+    presenti = df[df['id'].notna()]
+
+    vecchi = esistenti.set_index('id').loc[presenti['id'].astype(int)]
+    diversi = [
+        nuova != vecchia
+        for nuova, vecchia in zip(righe_db(model, presenti, campi_confronto), righe_db(model, vecchi, campi_confronto))
+    ]
+    cambiati = presenti.loc[np.array(diversi, dtype=bool)]
+
+    inseriti = inserisci_bulk(model, nuovi, campi, batch_size=batch_size)
+    aggiornati = aggiorna_bulk(model, cambiati, campi_aggiornamento, batch_size=batch_size)
+    if toccati is not None:
+        toccati.update(pd.concat([nuovi[chiavi[0]], cambiati[chiavi[0]]]).dropna().astype(int).tolist())
+    if visti is not None:
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {visti} (id) VALUES (%s)', [(int(pk),) for pk in presenti['id']])
+    if inseriti_dopo_id is not None:
+        doppioni += int((presenti['id'] > inseriti_dopo_id).sum())
+    return inseriti, aggiornati, len(presenti) - len(cambiati), doppioni
+
+
+def doppioni_visti(visti, fino_a_id):
+    """
+    Righe già presenti prima dell'import (id <= `fino_a_id`) ritrovate più di una
+    volta in blocchi diversi: i doppioni che sincronizza_bulk non vede blocco per blocco.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) - COUNT(DISTINCT id) FROM {visti} WHERE id <= %s', [fino_a_id])
+        return cursor.fetchone()[0]
+
+
+def ritira_mancanti(model, visti, fino_a_id):
+    """
+    Cancella con un solo DELETE le righe con id <= `fino_a_id` (cioè già presenti
+    prima dell'import) non segnate nella tabella `visti` (righe_viste).
+    Ritorna quante righe sono state cancellate.
+    """
+    qn = connection.ops.quote_name
+    pk = qn(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {qn(model._meta.db_table)} WHERE {pk} <= %s AND {pk} NOT IN (SELECT id FROM {visti})',
+            [fino_a_id],
+        )
+        return cursor.rowcount
+
+
+def ultimo_id(model):
+    """Id più alto presente nella tabella (0 se vuota)."""
+    return model.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _schema_sqlite(cursor, tabella):
+    """DDL della tabella e dei suoi indici espliciti, letti da sqlite_master."""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [tabella])
+    ddl_tabella = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+        [tabella],
+    )
+    return ddl_tabella, [riga[0] for riga in cursor.fetchall()]
+
+
+def _crea_ombra(cursor, tabella):
+    """Tabella ombra vuota con lo schema di `tabella` (senza indici). Ritorna (ombra, DDL degli indici)."""
+    qn = connection.ops.quote_name
+    ombra = f'{tabella}__ombra'
+    ddl_tabella, ddl_indici = _schema_sqlite(cursor, tabella)
+    cursor.execute(f'DROP TABLE IF EXISTS {qn(ombra)}')
+    cursor.execute(ddl_tabella.replace(qn(tabella), qn(ombra), 1))
+    # Contatore AUTOINCREMENT della tabella live: i nuovi id proseguono dopo i vecchi,
+    # così un pk (link a /asset/<pk>, PDF, interventi) non passa mai a un altro lampione
+    cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [tabella])
+    riga = cursor.fetchone()
+    if riga is not None:
+        cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [ombra, riga[0]])
+    return ombra, ddl_indici
+
+
+def ricarica_con_scambio(model, df, campi, batch_size=BATCH_SIZE, derivate=()):
+    """
+    Ricarica completa della tabella del modello senza mai esporre dati parziali.
+
+    Su SQLite le righe vengono caricate in una tabella ombra con lo stesso schema
+    (synchronous=OFF solo durante il caricamento); le tabelle `derivate`, coppie
+    (modello, funzione), vengono ricostruite anch'esse in tabelle ombra con
+    funzione(tabella_sorgente, tabella_destinazione). Poi, in un'unica breve
+    transazione, le tabelle live vengono sostituite da quelle ombra e gli indici
+    ricreati con il loro nome. I lettori continuano a leggere la versione
+    precedente fino al commit (con il journal WAL, vedi settings, senza bloccarsi).
+
+    Sugli altri backend (MVCC) basta cancellare e reinserire in una transazione,
+    in cui le derivate sono ricostruite con funzione(None, None).
+    Ritorna il numero di righe caricate.
+    """
+    if connection.vendor != 'sqlite':
+        with transaction.atomic():
+            model.objects.all().delete()
+            caricate = inserisci_bulk(model, df, campi, batch_size=batch_size)
+            for _, ricostruisci in derivate:
+                ricostruisci(None, None)
+        return caricate
+
+    qn = connection.ops.quote_name
+    tabella = model._meta.db_table
+    tabelle = [tabella] + [derivato._meta.db_table for derivato, _ in derivate]
+
+    with connection.cursor() as cursor:
+        ombre = {}
+        try:
+            for nome in tabelle:
+                ombre[nome] = _crea_ombra(cursor, nome)
+            ombra = ombre[tabella][0]
+
+            # Caricamento: le tabelle ombra non sono lette da nessuno, fsync superflui
+            cursor.execute('PRAGMA synchronous')
+            synchronous = cursor.fetchone()[0]
+            cursor.execute('PRAGMA synchronous = OFF')
+            try:
+                with transaction.atomic():
+                    caricate = inserisci_bulk(model, df, campi, tabella=ombra, batch_size=batch_size)
+                    for derivato, ricostruisci in derivate:
+                        ricostruisci(ombra, ombre[derivato._meta.db_table][0])
+            finally:
+                cursor.execute(f'PRAGMA synchronous = {int(synchronous)}')
+        except Exception:
+            for nome_ombra, _ in ombre.values():
+                cursor.execute(f'DROP TABLE IF EXISTS {qn(nome_ombra)}')
+            raise
+
+        # Scambio: stesso ordine usato dalle migrazioni Django su SQLite
+        # (drop della vecchia e rename della nuova, così le foreign key non vengono riscritte)
+        with transaction.atomic():
+            for nome in tabelle:
+                nome_ombra, ddl_indici = ombre[nome]
+                cursor.execute(f'DROP TABLE {qn(nome)}')
+                cursor.execute(f'ALTER TABLE {qn(nome_ombra)} RENAME TO {qn(nome)}')
+                for ddl in ddl_indici:
+                    cursor.execute(ddl)
+
+    return caricate
+
+
+def aggiorna_da_stage(model, df, chiave, campi, batch_size=50000, insert_batch_size=BATCH_SIZE):
+    """
+    UPDATE set-based dei `campi` del modello a partire da `df`, unendo sulla colonna `chiave`.
+
+    Le righe vengono copiate in una tabella temporanea (stage) e applicate con un
+    unico UPDATE ... FROM per blocco di `batch_size` righe, invece di un CASE WHEN
+    per oggetto come fa bulk_update. Tutte le righe della tabella con la stessa
+    chiave ricevono gli stessi valori. Richiede UPDATE ... FROM (PostgreSQL,
+    SQLite >= 3.33). Ritorna il numero di righe aggiornate.
+    """
+    qn = connection.ops.quote_name
+    tabella = qn(model._meta.db_table)
+    stage = qn(f'{model._meta.db_table}__stage')
+    campi_modello = [model._meta.get_field(campo) for campo in [chiave] + list(campi)]
+    colonne = [qn(field.column) for field in campi_modello]
+
+    definizione = ', '.join(
+        f'{colonna} {field.db_type(connection)}' + (' PRIMARY KEY' if field.name == chiave else '')
+        for colonna, field in zip(colonne, campi_modello)
+    )
+    inserimento = 'INSERT INTO {} ({}) VALUES ({})'.format(stage, ', '.join(colonne), ', '.join(['%s'] * len(colonne)))
+    aggiornamento = 'UPDATE {t} SET {set} FROM {s} WHERE {t}.{k} = {s}.{k}'.format(
+        t=tabella, s=stage, k=colonne[0],
+        set=', '.join(f'{colonna} = {stage}.{colonna}' for colonna in colonne[1:]),
+    )
+
+    df = df.drop_duplicates(subset=chiave, keep='last')
+    aggiornate = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {stage}')
+        cursor.execute(f'CREATE TEMPORARY TABLE {stage} ({definizione})')
+        for inizio in range(0, len(df), batch_size):
+            blocco = df.iloc[inizio:inizio + batch_size]
+            cursor.execute(f'DELETE FROM {stage}')
+            for parte in range(0, len(blocco), insert_batch_size):
+                cursor.executemany(inserimento, righe_db(model, blocco.iloc[parte:parte + insert_batch_size], [chiave] + list(campi)))
+            cursor.execute(aggiornamento)
+            aggiornate += cursor.rowcount
+        cursor.execute(f'DROP TABLE {stage}')
+    return aggiornate
@@ -0,0 +1,120 @@
+"""
+Cache dei risultati calcolati dai dati (statistiche, conteggi, pagine intere).
+
+Le chiavi contengono la versione dei dati salvata in StatoSistema: i comandi
+che caricano o riscorano i lampioni chiamano incrementa_versione_dati() e da
+quel momento tutte le voci precedenti smettono di essere lette, anche nei
+processi del sito che hanno la loro cache in memoria. Le voci vecchie escono
+poi da sole per scadenza o per limite di spazio della cache.
+"""
+
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .models import StatoSistema
+
+VERSIONE_DATI = 'versione_dati'
+
+
+def versione_dati():
+    valore = StatoSistema.objects.filter(chiave=VERSIONE_DATI).values_list('valore', flat=True).first()
+    return valore or 0
+
+
+async def aversione_dati():
+    valore = await StatoSistema.objects.filter(chiave=VERSIONE_DATI).values_list('valore', flat=True).afirst()
+    return valore or 0
+
+
+def incrementa_versione_dati():
+    """Invalida tutte le voci in cache calcolate dai dati. Ritorna la nuova versione."""
+    if not StatoSistema.objects.filter(chiave=VERSIONE_DATI).update(valore=F('valore') + 1):
+        StatoSistema.objects.get_or_create(chiave=VERSIONE_DATI, defaults={'valore': 1})
+    return versione_dati()
+
+
+def _chiave(nome):
+    return f'{nome}:v{versione_dati()}'
+
+
+def in_cache(nome, calcola, timeout=None):
+    """Il valore di calcola() per la versione corrente dei dati, calcolato solo alla prima richiesta."""
+    chiave = _chiave(nome)
+    valore = cache.get(chiave)
+    if valore is None:
+        valore = calcola()
+        cache.set(chiave, valore, timeout)
+    return valore
+
+
+async def ain_cache(nome, calcola, timeout=None):
+    """Come in_cache, con calcola coroutine (es. queryset.acount)."""
+    chiave = f'{nome}:v{await aversione_dati()}'
+    valore = await cache.aget(chiave)
+    if valore is None:
+        valore = await calcola()
+        await cache.aset(chiave, valore, timeout)
+    return valore
+
+
+def _nome_vista(nome, percorso):
+    # Anche la data: le pagine mostrano età e scadenze calcolate rispetto a oggi
+    digest = hashlib.blake2b(percorso.encode(), digest_size=16).hexdigest()
+    return f'vista:{nome}:{digest}:{timezone.localdate().isoformat()}'
+
+
+def cache_vista(nome, timeout=None):
+    """
+    Decoratore per le viste che dipendono solo dai dati caricati dai comandi: la pagina
+    renderizzata (GET con risposta 200) resta in cache per URL finché non cambia la
+    versione dei dati o il giorno. Funziona sia con le viste sync sia con quelle async.
+    """
+    def decoratore(vista):
+        if iscoroutinefunction(vista):
+            @wraps(vista)
+            async def wrapper_async(request, *args, **kwargs):
+                if request.method != 'GET':
+                    return await vista(request, *args, **kwargs)
+                chiave = f'{_nome_vista(nome, request.get_full_path())}:v{await aversione_dati()}'
+                salvata = await cache.aget(chiave)
+                if salvata is not None:
+                    contenuto, content_type = salvata
+                    return HttpResponse(contenuto, content_type=content_type)
+
+                risposta = await vista(request, *args, **kwargs)
+                if risposta.status_code == 200 and not risposta.streaming:
+                    await cache.aset(chiave, (risposta.content, risposta['Content-Type']), timeout)
+                return risposta
+            return wrapper_async
+
+        @wraps(vista)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return vista(request, *args, **kwargs)
+            chiave = _chiave(_nome_vista(nome, request.get_full_path()))
+            salvata = cache.get(chiave)
+            if salvata is not None:
+                contenuto, content_type = salvata
+                return HttpResponse(contenuto, content_type=content_type)
+
+            risposta = vista(request, *args, **kwargs)
+            if risposta.status_code == 200 and not risposta.streaming:
+                cache.set(chiave, (risposta.content, risposta['Content-Type']), timeout)
+            return risposta
+        return wrapper
+    return decoratore
+
+
+def invalida_vista(nome, percorso):
+    """Toglie dalla cache una sola pagina (es. dopo una segnalazione inserita dal sito)."""
+    cache.delete(_chiave(_nome_vista(nome, percorso)))
+
+
+async def ainvalida_vista(nome, percorso):
+    await cache.adelete(f'{_nome_vista(nome, percorso)}:v{await aversione_dati()}')
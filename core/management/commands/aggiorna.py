@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.core.exceptions import FieldError
 from core.models import LampioneNuovo, LampioneManutenzione
+from core.cache import incrementa_versione_dati
 from datetime import date
 
 class Command(BaseCommand):
@@ -42,4 +43,7 @@ class Command(BaseCommand):
                 "  -> core_LampioneManutenzione ignorata: non possiede il campo 'arm_data_fin' (normale in un DB relazionale)."
             ))
 
+        # Le pagine in cache mostrano ancora le date vecchie
+        incrementa_versione_dati()
+
         self.stdout.write(self.style.SUCCESS("\nOPERAZIONE COMPLETATA!"))
\ No newline at end of file
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from core.models import LampioneNuovo # Sostituisci con il nome reale del tuo modello
+from core.cache import incrementa_versione_dati
 
 class Command(BaseCommand):
     help = 'Aggiorna il campo arm_data_fin alla data odierna per tutti i record'
@@ -10,6 +11,7 @@ class Command(BaseCommand):
         
         # Esegui l'aggiornamento (aggiungi .filter() prima di .update() se necessario)
         righe_aggiornate = LampioneNuovo.objects.update(arm_data_fin=data_odierna)
+        incrementa_versione_dati()
         
         # Mostra un messaggio di successo nel terminale
         self.stdout.write(
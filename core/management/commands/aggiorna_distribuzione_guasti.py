@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.aggregates import aggiorna_distribuzione_guasti
+
+
+class Command(BaseCommand):
+    help = "Ricalcola la distribuzione dei guasti per potenza/altezza (e cittadina) usata da dettaglio_asset"
+
+    def handle(self, *args, **options):
+        self.stdout.write("Ricalcolo della distribuzione dei guasti dallo storico manutenzioni...")
+        righe = aggiorna_distribuzione_guasti()
+        self.stdout.write(self.style.SUCCESS(f"COMPLETATO! {righe} righe aggregate."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.aggregates import aggiorna_riepilogo_asset
+
+
+class Command(BaseCommand):
+    help = "Ricalcola da zero il riepilogo dello storico per lampione (RiepilogoAsset) usato dalle schede"
+
+    def handle(self, *args, **options):
+        self.stdout.write("Ricalcolo del riepilogo per lampione dallo storico manutenzioni...")
+        righe = aggiorna_riepilogo_asset()
+        self.stdout.write(self.style.SUCCESS(f"COMPLETATO! {righe} lampioni riepilogati."))
@@ -1,107 +1,163 @@
-import pandas as pd
-import numpy as np
 import sys
+import time
+
+import pandas as pd
 from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.aggregates import aggiorna_distribuzione_guasti, aggiorna_riepilogo_asset
+from core.bulk import doppioni_visti, inserisci_bulk, righe_viste, ritira_mancanti, segna_visti, senza_chiave, sincronizza_bulk, ultimo_id
+from core.cache import incrementa_versione_dati
 from core.models import LampioneManutenzione
-from django.utils import timezone
+
+CAMPI = [
+    # Dati del guasto
+    'sgn_id', 'sgn_data_inserimento', 'tcs_id', 'tcs_descr', 'tci_id', 'tci_descr',
+    # Dati anagrafici del lampione
+    'arm_id', 'arm_data_ini', 'arm_data_fin', 'arm_altezza', 'arm_lunghezza_sbraccio',
+    'arm_numero_lampade', 'arm_lmp_potenza_nominale', 'tar_cod', 'tar_descr', 'tpo_cod',
+    'tpo_descr', 'tmo_id',
+    # Coordinate
+    'latitudine', 'longitudine',
+]
+
+# Colonne testuali lette sempre come stringa: con la lettura a blocchi pandas
+# deduce i tipi chunk per chunk e potrebbe sceglierne di diversi.
+COLONNE_TESTO = ['tar_cod', 'tar_descr', 'tpo_cod', 'tpo_descr', 'tcs_descr', 'tci_descr']
+
+# Valori di default per i campi anagrafici mancanti
+DEFAULT = {
+    'arm_altezza': 0,
+    'arm_lunghezza_sbraccio': 0,
+    'arm_numero_lampade': 1,
+    'arm_lmp_potenza_nominale': -1,
+}
+
+DATA_DA_SCARTARE = pd.Timestamp('2018-01-01')
+
+# Chiave naturale di un evento: lampione + segnalazione. Gli eventi senza sgn_id non
+# si possono riconoscere fra un import e l'altro: l'import incrementale li scarta e
+# non li ritira (si caricano con un import completo)
+CHIAVI = ['arm_id', 'sgn_id']
+
+
+def prepara_blocco(df):
+    """Date, filtro sul 01/01/2018 e default di un blocco del CSV. Ritorna (blocco, righe scartate)."""
+    df['sgn_data_inserimento'] = pd.to_datetime(df['sgn_data_inserimento'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
+    df['arm_data_ini'] = pd.to_datetime(df['arm_data_ini'], format='%d/%m/%Y', errors='coerce')
+    df['arm_data_fin'] = pd.to_datetime(df['arm_data_fin'], format='%d/%m/%Y', errors='coerce')
+
+    # Scartiamo SOLO le righe in cui arm_data_ini è ESATTAMENTE uguale al 01/01/2018
+    da_scartare = df['arm_data_ini'] == DATA_DA_SCARTARE
+    df = df[~da_scartare].copy()
+
+    for colonna, valore in DEFAULT.items():
+        df[colonna] = pd.to_numeric(df[colonna], errors='coerce').fillna(valore)
+    for colonna in ['latitudine', 'longitudine']:
+        if colonna not in df.columns:
+            df[colonna] = None
+
+    # La timezone di sgn_data_inserimento (naive nel CSV) viene applicata da inserisci_bulk
+    return df, int(da_scartare.sum())
+
 
 class Command(BaseCommand):
     help = 'Svuota la tabella e importa lo storico manutenzioni, scartando SOLO arm_data_ini == 01/01/2018'
 
-    def handle(self, *args, **options):
-        # --- PARAMETRI ---
-        CSV_FILE = 'lampioni_manutenzioni_coordinate.csv'
-        CHUNK_SIZE = 5000
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", type=str, default="lampioni_manutenzioni_coordinate.csv", help="Path al CSV dello storico manutenzioni.")
+        parser.add_argument("--chunksize", type=int, default=50000, help="Righe lette dal CSV per ogni blocco (la RAM dipende da questo, non dal file).")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Righe per ogni INSERT multiplo.")
+        parser.add_argument("--incremental", action="store_true", help="Non svuota la tabella: upsert degli eventi per (arm_id, sgn_id) in un'unica transazione.")
+        parser.add_argument("--ritira-mancanti", action="store_true", help="Con --incremental, cancella gli eventi assenti dal CSV.")
 
-        self.stdout.write(self.style.WARNING(f"1. Svuotamento tabella 'core_LampioneManutenzione'..."))
-        LampioneManutenzione.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS("Tabella svuotata con successo."))
+    def handle(self, *args, **options):
+        CSV_FILE = options['csv']
 
-        self.stdout.write(f"2. Lettura del file {CSV_FILE}...")
         try:
-            df = pd.read_csv(CSV_FILE, low_memory=False)
+            blocchi = pd.read_csv(
+                CSV_FILE,
+                chunksize=options['chunksize'],
+                dtype={colonna: 'string' for colonna in COLONNE_TESTO},
+            )
         except FileNotFoundError:
             self.stdout.write(self.style.ERROR(f"ERRORE: File {CSV_FILE} non trovato."))
             sys.exit()
 
-        df = df.replace({np.nan: None})
-
-        # --- CONVERSIONE DELLE DATE ---
-        if 'sgn_data_inserimento' in df.columns:
-            df['sgn_data_inserimento'] = pd.to_datetime(df['sgn_data_inserimento'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
-        if 'arm_data_ini' in df.columns:
-            df['arm_data_ini'] = pd.to_datetime(df['arm_data_ini'], format='%d/%m/%Y', errors='coerce')
-        if 'arm_data_fin' in df.columns:
-            df['arm_data_fin'] = pd.to_datetime(df['arm_data_fin'], format='%d/%m/%Y', errors='coerce')
-
-        # --- FILTRO SULLA DATA (CORRETTO) ---
-        righe_totali_iniziali = len(df)
-        data_limite = pd.to_datetime('2018-01-01')
-        
-        # Scartiamo SOLO le righe in cui arm_data_ini è ESATTAMENTE uguale al 01/01/2018
-        condizione_da_scartare = df['arm_data_ini'] == data_limite
-        df = df[~condizione_da_scartare]
-        
-        righe_scartate = righe_totali_iniziali - len(df)
-        self.stdout.write(self.style.NOTICE(f"  -> FILTRO APPLICATO: Scartate {righe_scartate} righe con arm_data_ini == 01/01/2018."))
-        self.stdout.write(self.style.NOTICE(f"  -> Righe rimanenti da importare: {len(df)}."))
-
-        records_to_create = []
-        self.stdout.write("3. Preparazione e Inserimento dei dati completi (Bulk Create)...")
-
-        inseriti = 0
-
-        for index, row in df.iterrows():
-            arm_id = row['arm_id']
-
-            # Gestione della TimeZone per la data del guasto
-            data_ins = row['sgn_data_inserimento']
-            if pd.notnull(data_ins):
-                if timezone.is_naive(data_ins):
-                    data_ins = timezone.make_aware(data_ins)
-            else:
-                data_ins = None
-
-            # Creazione del record MAPPANDO TUTTE LE COLONNE DEL CSV
-            manutenzione = LampioneManutenzione(
-                # Dati del guasto
-                sgn_id=row['sgn_id'],
-                sgn_data_inserimento=data_ins,
-                tcs_id=row['tcs_id'],
-                tcs_descr=row['tcs_descr'],
-                tci_id=row['tci_id'],
-                tci_descr=row['tci_descr'],
-                
-                # Dati anagrafici del lampione
-                arm_id=arm_id,
-                arm_data_ini=row['arm_data_ini'].date() if pd.notnull(row['arm_data_ini']) else None,
-                arm_data_fin=row['arm_data_fin'].date() if pd.notnull(row['arm_data_fin']) else None,
-                arm_altezza=row['arm_altezza'] if pd.notnull(row['arm_altezza']) else 0,
-                arm_lunghezza_sbraccio=row['arm_lunghezza_sbraccio'] if pd.notnull(row['arm_lunghezza_sbraccio']) else 0,
-                arm_numero_lampade=row['arm_numero_lampade'] if pd.notnull(row['arm_numero_lampade']) else 1,
-                arm_lmp_potenza_nominale=row['arm_lmp_potenza_nominale'] if pd.notnull(row['arm_lmp_potenza_nominale']) else -1,
-                tar_cod=row['tar_cod'],
-                tar_descr=row['tar_descr'],
-                tpo_cod=row['tpo_cod'],
-                tpo_descr=row['tpo_descr'],
-                tmo_id=row['tmo_id'],
-                
-                # Coordinate
-                latitudine=row.get('latitudine', None),
-                longitudine=row.get('longitudine', None)
-            )
-            records_to_create.append(manutenzione)
+        if options['incremental']:
+            with transaction.atomic():
+                self.importa_blocchi(blocchi, options, incrementale=True)
+            return
+
+        self.stdout.write(self.style.WARNING(f"1. Svuotamento tabella 'core_LampioneManutenzione'..."))
+        LampioneManutenzione.objects.all().delete()
+        self.stdout.write(self.style.SUCCESS("Tabella svuotata con successo."))
+
+        self.importa_blocchi(blocchi, options)
+
+    def importa_blocchi(self, blocchi, options, incrementale=False):
+        modo = "upsert incrementale" if incrementale else "inserimento (Bulk Insert)"
+        self.stdout.write(f"2. Lettura a blocchi di {options['csv']} e {modo}...")
+        inizio = time.perf_counter()
+        lette = scartate = senza_sgn = doppioni = inseriti = aggiornati = invariati = ritirati = 0
+        arm_id_toccati = set()
+        id_precedente = ultimo_id(LampioneManutenzione)
+
+        # id delle righe ritrovate nel CSV, in una tabella temporanea (per --ritira-mancanti)
+        with righe_viste(LampioneManutenzione) as visti:
+            for blocco in blocchi:
+                lette += len(blocco)
+                blocco, n_scartate = prepara_blocco(blocco)
+                scartate += n_scartate
+
+                if incrementale:
+                    mancanti = senza_chiave(blocco, CHIAVI)
+                    senza_sgn += int(mancanti.sum())
+                    blocco = blocco[~mancanti]
+                    nuovi, cambiati, uguali, uniti = sincronizza_bulk(
+                        LampioneManutenzione, blocco, CHIAVI, CAMPI, batch_size=options['batch_size'],
+                        toccati=arm_id_toccati, visti=visti, inseriti_dopo_id=id_precedente,
+                    )
+                    inseriti += nuovi
+                    aggiornati += cambiati
+                    invariati += uguali
+                    doppioni += uniti
+                else:
+                    with transaction.atomic():
+                        inseriti += inserisci_bulk(LampioneManutenzione, blocco, CAMPI, batch_size=options['batch_size'])
+
+                durata = time.perf_counter() - inizio
+                self.stdout.write(f"  -> Lette {lette:,} righe, inseriti {inseriti:,} record ({lette / max(durata, 1e-9):,.0f} righe/s)...")
+
+            if incrementale:
+                doppioni += doppioni_visti(visti, id_precedente)
+            if incrementale and options['ritira_mancanti']:
+                # gli eventi senza sgn_id già nel DB non sono confrontabili col CSV: restano
+                segna_visti(visti, LampioneManutenzione.objects.filter(sgn_id__isnull=True))
+                ritirati = ritira_mancanti(LampioneManutenzione, visti, id_precedente)
 
-            # Inserimento a blocchi per non sovraccaricare la RAM
-            if len(records_to_create) >= CHUNK_SIZE:
-                LampioneManutenzione.objects.bulk_create(records_to_create)
-                inseriti += len(records_to_create)
-                records_to_create = [] 
-                self.stdout.write(f"  -> Processati {inseriti} record...")
+        durata = time.perf_counter() - inizio
+        self.stdout.write(self.style.NOTICE(f"  -> FILTRO APPLICATO: Scartate {scartate} righe con arm_data_ini == 01/01/2018."))
+        self.stdout.write(f"  -> Tempo totale {durata:.1f}s ({lette / max(durata, 1e-9):,.0f} righe/s).")
+        if incrementale:
+            if senza_sgn:
+                self.stdout.write(self.style.NOTICE(f"  -> Scartate {senza_sgn} righe senza sgn_id (non confrontabili in modalità incrementale)."))
+            if doppioni:
+                self.stdout.write(self.style.NOTICE(
+                    f"  -> Unite {doppioni} righe con arm_id e sgn_id già visti: in modalità incrementale resta l'ultima "
+                    "(l'import completo le tiene tutte)."
+                ))
+            self.stdout.write(f"  -> Nuovi: {inseriti}, aggiornati: {aggiornati}, invariati: {invariati}, ritirati: {ritirati}.")
 
-        # Inserimento degli ultimi record rimanenti
-        if records_to_create:
-            LampioneManutenzione.objects.bulk_create(records_to_create)
-            inseriti += len(records_to_create)
+        righe = aggiorna_distribuzione_guasti()
+        self.stdout.write(f"  -> Distribuzione dei guasti per potenza/altezza ricalcolata ({righe} righe).")
+        # Riepilogo per lampione: solo gli arm_id con eventi nuovi o modificati, tutto
+        # dopo un import completo o se sono stati ritirati eventi
+        if incrementale and not ritirati:
+            asset = aggiorna_riepilogo_asset(arm_id_toccati)
+        else:
+            asset = aggiorna_riepilogo_asset()
+        self.stdout.write(f"  -> Riepilogo dello storico aggiornato per {asset} lampioni.")
+        incrementa_versione_dati()
 
-        self.stdout.write(self.style.SUCCESS(f"\nCOMPLETATO! Inseriti {inseriti} eventi di manutenzione con TUTTI i campi valorizzati."))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f"\nCOMPLETATO! Inseriti {inseriti} eventi di manutenzione con TUTTI i campi valorizzati."))
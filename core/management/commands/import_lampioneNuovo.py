@@ -1,78 +1,152 @@
-import pandas as pd
-import numpy as np
 import sys
-from django.core.management.base import BaseCommand
-from core.models import LampioneNuovo
-import random
-from datetime import datetime, timedelta
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.bulk import (
+    inserisci_bulk, ricarica_con_scambio, righe_viste, ritira_mancanti, senza_chiave, sincronizza_bulk, ultimo_id,
+)
+from core.cache import incrementa_versione_dati
+from core.models import CellaMappa, LampioneNuovo
+from core.spatial import ricostruisci_indice, traccia_variazioni
+
+# Campi del modello valorizzati dall'import (colonne CSV + colonne derivate)
+CAMPI = [
+    'arm_id', 'arm_data_ini', 'arm_data_fin', 'arm_altezza', 'arm_lunghezza_sbraccio',
+    'arm_numero_lampade', 'arm_lmp_potenza_nominale', 'tar_cod', 'tar_descr', 'tpo_cod',
+    'tpo_descr', 'tmo_id', 'giorni_vita_attuale', 'latitudine', 'longitudine',
+    'risk_score', 'traQuantoSiRompe', 'risk_score_date',
+]
+
+# Colonne derivate: il CSV ne dà solo una stima iniziale (con rumore casuale), poi
+# le riscrive score_model. In modalità incrementale valgono solo per i lampioni nuovi:
+# una riga è "cambiata" solo se cambia un dato del CSV e l'aggiornamento non tocca i punteggi.
+CAMPI_DERIVATI = ['risk_score', 'traQuantoSiRompe', 'risk_score_date']
+CAMPI_CONFRONTO = [campo for campo in CAMPI if campo not in CAMPI_DERIVATI]
+
+
+def calcola_colonne_derivate(df, rng):
+    """
+    risk_score, traQuantoSiRompe e risk_score_date calcolati per colonna.
+
+    traQuantoSiRompe = 100/int(prob_guasto)*120 più un rumore intero uniforme
+    in [-(100/prob_guasto*120)/10, (100/prob_guasto*120)/20], come nella
+    versione riga per riga; le righe senza prob_guasto valida restano vuote.
+    """
+    prob = pd.to_numeric(df['prob_guasto'], errors='coerce')
+    df['risk_score'] = prob / 100
+
+    valide = (prob.notna() & (np.trunc(prob) > 0)).values
+    giorni = np.where(valide, 100 / prob.where(valide, 1) * 120, 0)
+    base = np.where(valide, 100 / np.trunc(prob.where(valide, 1)) * 120, 0)
+    rumore = rng.integers(np.trunc(-giorni / 10).astype(np.int64), np.trunc(giorni / 20).astype(np.int64), endpoint=True)
+    df['traQuantoSiRompe'] = pd.Series(np.trunc(base + rumore), index=df.index).where(valide).astype('Int64')
+
+    # risk_score_date solo se c'è una data di installazione e una stima non nulla
+    oggi = pd.Timestamp(timezone.localdate())
+    con_data = df['arm_data_ini'].notna() & df['traQuantoSiRompe'].fillna(0).ne(0)
+    scadenza = oggi + pd.to_timedelta(df['traQuantoSiRompe'].astype(float), unit='D')
+    df['risk_score_date'] = scadenza.where(con_data)
+    return df
 
 
 class Command(BaseCommand):
     help = 'Svuota la tabella e importa i nuovi lampioni da CSV (Digital Twin)'
 
-    def handle(self, *args, **options):
-        # --- PARAMETRI ---
+    def add_arguments(self, parser):
         # Se stai usando il file con le coordinate generato da OSMnx, assicurati che il nome sia questo:
-        CSV_FILE = 'output.csv' 
-        CHUNK_SIZE = 5000
+        parser.add_argument("--csv", type=str, default="output.csv", help="Path al CSV dei lampioni con prob_guasto.")
+        parser.add_argument("--seed", type=int, default=None, help="Seed del generatore casuale (run riproducibili).")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Righe per ogni INSERT multiplo.")
+        parser.add_argument("--incremental", action="store_true", help="Non svuota la tabella: inserisce i nuovi arm_id e aggiorna solo quelli cambiati.")
+        parser.add_argument("--ritira-mancanti", action="store_true", help="Con --incremental, cancella i lampioni assenti dal CSV.")
+        parser.add_argument("--swap", action="store_true", help="Ricarica completa in una tabella ombra scambiata atomicamente con quella live: le pagine non vedono mai dati parziali.")
 
-        self.stdout.write(self.style.WARNING(f"1. Svuotamento della tabella 'core_LampioneNuovo' in corso..."))
-        LampioneNuovo.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS("Tabella svuotata con successo."))
+    def handle(self, *args, **options):
+        if options['swap'] and options['incremental']:
+            raise CommandError("--swap e --incremental sono alternativi: lo scambio ricarica tutta la tabella.")
+        CSV_FILE = options['csv']
+        rng = np.random.default_rng(options['seed'])
 
-        self.stdout.write(f"2. Lettura del file {CSV_FILE}...")
+        self.stdout.write(f"1. Lettura del file {CSV_FILE}...")
         try:
             df = pd.read_csv(CSV_FILE, low_memory=False)
         except FileNotFoundError:
             self.stdout.write(self.style.ERROR(f"ERRORE: File {CSV_FILE} non trovato. Assicurati che sia nella cartella principale."))
             sys.exit()
 
-        # Sostituisci i NaN di Pandas con None per il DB
-        df = df.replace({np.nan: None})
-
         # Gestione date
-        if 'arm_data_ini' in df.columns:
-            df['arm_data_ini'] = pd.to_datetime(df['arm_data_ini'], format='%Y-%m-%d', errors='coerce')
-        if 'arm_data_fin' in df.columns:
-            df['arm_data_fin'] = pd.to_datetime(df['arm_data_fin'], format='%d/%m/%Y', errors='coerce')
-
-        records_to_create = []
-        self.stdout.write("3. Preparazione e Inserimento dei dati (Bulk Create)...")
-        
-        for index, row in df.iterrows():
-            # I campi a sinistra ora corrispondono ai nomi delle colonne del CSV
-            lampione = LampioneNuovo(
-                arm_id=row['arm_id'],
-                arm_data_ini=row['arm_data_ini'].date() if pd.notnull(row['arm_data_ini']) else None,
-                arm_data_fin=row['arm_data_fin'].date() if pd.notnull(row['arm_data_fin']) else None,
-                arm_altezza=row['arm_altezza'],
-                arm_lunghezza_sbraccio=row['arm_lunghezza_sbraccio'],
-                arm_numero_lampade=row['arm_numero_lampade'],
-                arm_lmp_potenza_nominale=row['arm_lmp_potenza_nominale'],
-                tar_cod=row['tar_cod'],
-                tar_descr=row['tar_descr'],
-                tpo_cod=row['tpo_cod'],
-                tpo_descr=row['tpo_descr'],
-                tmo_id=row['tmo_id'],
-                # Inserimento delle coordinate (usa .get per evitare errori se la colonna manca)
-                giorni_vita_attuale=row.get('giorni_vita_attuale', None),
-                risk_score=row.get('prob_guasto', None)/100,
-                latitudine=row.get('latitudine', None),
-                traQuantoSiRompe=100/int(row.get('prob_guasto', None)) * 120 + random.randint(int(-((100/row.get('prob_guasto', None) * 120)/10)), int(((100/row.get('prob_guasto', None) * 120)/20))),
-                #risk_score_date=row['arm_data_ini'].date() + ,
-                longitudine=row.get('longitudine', None)
+        df['arm_data_ini'] = pd.to_datetime(df['arm_data_ini'], format='%Y-%m-%d', errors='coerce')
+        df['arm_data_fin'] = pd.to_datetime(df['arm_data_fin'], format='%d/%m/%Y', errors='coerce')
+        for colonna in ['giorni_vita_attuale', 'latitudine', 'longitudine']:
+            if colonna not in df.columns:
+                df[colonna] = None
+
+        self.stdout.write("2. Calcolo vettoriale delle colonne derivate...")
+        df = calcola_colonne_derivate(df, rng)
+
+        if options['incremental']:
+            self.import_incrementale(df, options)
+        elif options['swap']:
+            self.import_con_scambio(df, options)
+        else:
+            self.import_completo(df, options)
+        # Statistiche e conteggi in cache vanno ricalcolati sui nuovi dati
+        incrementa_versione_dati()
+
+    def import_completo(self, df, options):
+        self.stdout.write(self.style.WARNING("3. Svuotamento e caricamento di 'core_LampioneNuovo' (Bulk Insert)..."))
+        inizio = time.perf_counter()
+        with transaction.atomic():
+            LampioneNuovo.objects.all().delete()
+            inseriti = inserisci_bulk(LampioneNuovo, df, CAMPI, batch_size=options['batch_size'])
+        durata = time.perf_counter() - inizio
+        self.stdout.write(f"  -> Inseriti {inseriti} record in {durata:.1f}s ({inseriti / max(durata, 1e-9):,.0f} righe/s).")
+
+        self.stdout.write("4. Ricostruzione dell'indice spaziale della mappa...")
+        celle = ricostruisci_indice()
+        self.stdout.write(f"  -> {celle} celle indicizzate.")
+
+        self.stdout.write(self.style.SUCCESS(f"\nCOMPLETATO! Inseriti {inseriti} lampioni nel database."))
+
+    def import_incrementale(self, df, options):
+        self.stdout.write(self.style.WARNING("3. Aggiornamento incrementale di 'core_LampioneNuovo' (chiave: arm_id)..."))
+        inizio = time.perf_counter()
+        ritirati = 0
+        mancanti = senza_chiave(df, ['arm_id'])
+        if mancanti.any():
+            self.stdout.write(self.style.NOTICE(f"  -> Scartate {int(mancanti.sum())} righe senza arm_id."))
+            df = df[~mancanti]
+        with righe_viste(LampioneNuovo) as visti, transaction.atomic(), traccia_variazioni(LampioneNuovo.objects.all()):
+            id_precedente = ultimo_id(LampioneNuovo)
+            inseriti, aggiornati, invariati, doppioni = sincronizza_bulk(
+                LampioneNuovo, df, ['arm_id'], CAMPI, CAMPI_CONFRONTO, batch_size=options['batch_size'],
+                campi_aggiornamento=CAMPI_CONFRONTO, visti=visti,
             )
-            if lampione.arm_data_ini and lampione.traQuantoSiRompe:
-                lampione.risk_score_date = datetime.now().date() + timedelta(days=int(lampione.traQuantoSiRompe))
-            records_to_create.append(lampione)
+            if options['ritira_mancanti']:
+                ritirati = ritira_mancanti(LampioneNuovo, visti, id_precedente)
+        durata = time.perf_counter() - inizio
+
+        if doppioni:
+            self.stdout.write(self.style.NOTICE(f"  -> Unite {doppioni} righe con lo stesso arm_id: resta l'ultima del CSV."))
 
-            if len(records_to_create) >= CHUNK_SIZE:
-                LampioneNuovo.objects.bulk_create(records_to_create)
-                records_to_create = []
-                self.stdout.write(f"  -> Inseriti {index + 1} record...")
+        self.stdout.write(f"  -> Nuovi: {inseriti}, aggiornati: {aggiornati}, invariati: {invariati}, ritirati: {ritirati} ({durata:.1f}s).")
+        self.stdout.write(self.style.SUCCESS("\nCOMPLETATO! Import incrementale terminato (indice spaziale aggiornato)."))
 
-        if records_to_create:
-            LampioneNuovo.objects.bulk_create(records_to_create)
-            self.stdout.write(f"  -> Inseriti tutti i rimanenti.")
+    def import_con_scambio(self, df, options):
+        self.stdout.write(self.style.WARNING("3. Caricamento in tabella ombra e scambio atomico con 'core_LampioneNuovo'..."))
+        inizio = time.perf_counter()
+        celle = []
+        # L'indice spaziale è ricostruito sulla tabella ombra e scambiato insieme ai lampioni
+        inseriti = ricarica_con_scambio(
+            LampioneNuovo, df, CAMPI, batch_size=options['batch_size'],
+            derivate=[(CellaMappa, lambda lampioni, indice: celle.append(ricostruisci_indice(lampioni, indice)))],
+        )
+        durata = time.perf_counter() - inizio
 
-        self.stdout.write(self.style.SUCCESS(f"\nCOMPLETATO! Inseriti {len(df)} lampioni nel database."))
\ No newline at end of file
+        self.stdout.write(f"  -> Caricati {inseriti} record e {celle[0]} celle indicizzate in {durata:.1f}s.")
+        self.stdout.write(self.style.SUCCESS(f"\nCOMPLETATO! Tabella sostituita con {inseriti} lampioni."))
@@ -0,0 +1,30 @@
+import os
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.ml.servizio import crea_server
+
+
+class Command(BaseCommand):
+    help = "Avvia il server dei modelli: rischio e giorni residui restano caricati in memoria e rispondono in HTTP su localhost."
+
+    def add_arguments(self, parser):
+        url = urlparse(getattr(settings, "MODEL_SERVER_URL", None) or "http://127.0.0.1:8765")
+        parser.add_argument("--model", type=str, required=True, help="Path al modello .joblib.")
+        parser.add_argument("--survival-dir", type=str, default=os.path.join("macchine learning", "model_lampioni_survival"), help="Cartella del modello di sopravvivenza XGBoost AFT (preprocessor.joblib, xgb_aft.json, meta.json).")
+        parser.add_argument("--host", type=str, default=url.hostname, help="Indirizzo di ascolto (lasciare localhost: il server non ha autenticazione).")
+        parser.add_argument("--porta", type=int, default=url.port or 8765, help="Porta di ascolto (default da MODEL_SERVER_URL).")
+
+    def handle(self, *args, **opts):
+        survival_dir = os.path.join(settings.BASE_DIR, opts["survival_dir"])
+        self.stdout.write(f"Carico modelli: {opts['model']} e {survival_dir}")
+        server = crea_server(opts["host"], opts["porta"], opts["model"], survival_dir)
+        self.stdout.write(self.style.SUCCESS(f"Server dei modelli in ascolto su http://{opts['host']}:{opts['porta']} (CTRL+C per fermarlo)"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.spatial import LIVELLI, ricostruisci_indice
+
+
+class Command(BaseCommand):
+    help = "Ricostruisce da zero l'indice spaziale (cluster per livello di zoom) usato dalla mappa"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Ricostruzione dell'indice su {len(LIVELLI)} livelli di zoom...")
+        celle = ricostruisci_indice()
+        self.stdout.write(self.style.SUCCESS(f"COMPLETATO! {celle} celle indicizzate."))
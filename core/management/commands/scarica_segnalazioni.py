@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.segnalazioni import cartella_coda, scarica_file
+
+
+class Command(BaseCommand):
+    help = "Scrive nel database le segnalazioni rimaste nel journal della coda (es. dopo un riavvio)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--anche-attivi", action="store_true",
+            help="Scrive anche i journal attivo-*.jsonl: solo a sito fermo, altrimenti un processo vivo potrebbe scriverci durante la lettura.",
+        )
+
+    def handle(self, *args, **options):
+        cartella = cartella_coda()
+        file = sorted(cartella.glob("pronto-*.jsonl"))
+        if options['anche_attivi']:
+            file += sorted(cartella.glob("attivo-*.jsonl"))
+
+        self.stdout.write(f"Journal da scrivere in {cartella}: {len(file)}")
+        # Le segnalazioni già scritte (stesso id_richiesta) vengono ignorate
+        scritte = scarica_file(file)
+        self.stdout.write(self.style.SUCCESS(f"COMPLETATO! {scritte} segnalazioni lette dal journal."))
@@ -0,0 +1,47 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.ml.scoring import estrai_giorni_per_fascia
+from core.ml.servizio import Scoratore
+from core.scoring_incrementale import MICRO_BATCH, giro, mediana_eta_anagrafica
+
+
+class Command(BaseCommand):
+    help = "Riscora solo i lampioni con nuove segnalazioni o nuovi eventi di manutenzione dall'ultimo giro."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", type=str, required=True, help="Path al modello .joblib.")
+        parser.add_argument("--survival-dir", type=str, default=os.path.join("macchine learning", "model_lampioni_survival"), help="Cartella del modello di sopravvivenza XGBoost AFT (preprocessor.joblib, xgb_aft.json, meta.json).")
+        parser.add_argument("--server", type=str, default=getattr(settings, "MODEL_SERVER_URL", None), help="URL del server dei modelli (comando model_server); se non risponde i modelli vengono caricati qui.")
+        parser.add_argument("--micro-batch", type=int, default=MICRO_BATCH, help="Lampioni scorati e scritti per ogni UPDATE.")
+        parser.add_argument("--loop", action="store_true", help="Non termina: ripete il giro ogni --intervallo secondi.")
+        parser.add_argument("--intervallo", type=float, default=5.0, help="Secondi fra un giro e l'altro con --loop.")
+
+    def handle(self, *args, **opts):
+        survival_dir = os.path.join(settings.BASE_DIR, opts["survival_dir"])
+        scora = Scoratore(opts["server"], opts["model"], survival_dir)
+        if scora.remoto:
+            self.stdout.write(f"Uso il server dei modelli: {opts['server']}")
+        else:
+            self.stdout.write(f"Server dei modelli non disponibile, modelli caricati qui: {opts['model']} e {survival_dir}")
+
+        # Come in score_model: mediana ed estratti per fascia valgono per tutta l'esecuzione
+        mediana_eta = mediana_eta_anagrafica()
+        giorni_per_fascia = estrai_giorni_per_fascia()
+
+        while True:
+            inizio = time.perf_counter()
+            toccati, aggiornate = giro(mediana_eta, giorni_per_fascia, opts["micro_batch"], scora)
+            if toccati or not opts["loop"]:
+                durata = time.perf_counter() - inizio
+                self.stdout.write(self.style.SUCCESS(
+                    f"Riscorati {toccati} lampioni, aggiornate {aggiornate} righe in {durata:.2f}s."
+                ))
+            if not opts["loop"]:
+                return
+            close_old_connections()
+            time.sleep(opts["intervallo"])
@@ -1,103 +1,127 @@
 # core/management/commands/score_model.py
 
 import os
-import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from joblib import load
+
+from core.ml.features import carica_csv
+from core.ml.scoring import (
+    CAMPI_PUNTEGGIO, calcola_mediana_eta, carica_modelli, estrai_giorni_per_fascia, eta_in_giorni, scora_blocco,
+    tabella_punteggi,
+)
+
 
 class Command(BaseCommand):
     help = "Calcola i risk score sull'anagrafica attiva e aggiorna il Database Django."
 
     def add_arguments(self, parser):
         parser.add_argument("--model", type=str, required=True, help="Path al modello .joblib.")
+        parser.add_argument("--survival-dir", type=str, default=os.path.join("macchine learning", "model_lampioni_survival"), help="Cartella del modello di sopravvivenza XGBoost AFT (preprocessor.joblib, xgb_aft.json, meta.json).")
         parser.add_argument("--csv", type=str, required=True, help="Path al CSV delle armature attive (es. lampioni_attivi_coordinate.csv).")
         parser.add_argument("--out-csv", type=str, default="ml_artifacts/risk_scores_con_residui.csv")
+        parser.add_argument("--batch-size", type=int, default=50000, help="Righe applicate al DB per ogni UPDATE set-based.")
+        parser.add_argument("--chunksize", type=int, default=None, help="Legge e scora il CSV a blocchi di N righe (RAM limitata). Default: tutto in una volta.")
+        parser.add_argument("--workers", type=int, default=1, help="Processi che scorano i blocchi in parallelo (i modelli sono caricati una volta per processo).")
 
     def handle(self, *args, **opts):
         model_path = opts["model"]
+        survival_dir = os.path.join(settings.BASE_DIR, opts["survival_dir"])
         csv_path = opts["csv"]
+        workers = max(1, opts["workers"])
         out_csv = os.path.join(settings.BASE_DIR, opts["out_csv"])
         os.makedirs(os.path.dirname(out_csv), exist_ok=True)
 
-        self.stdout.write(f"Carico modello: {model_path}")
-        clf = load(model_path)
-        
         self.stdout.write(f"Leggo CSV anagrafica: {csv_path}")
-        df = pd.read_csv(csv_path, low_memory=False)
-        
-        # 1. Isoliamo ID validi
-        df['arm_id'] = pd.to_numeric(df['arm_id'], errors='coerce')
-        df = df[df['arm_id'].notna()].copy()
-        df['arm_id'] = df['arm_id'].astype(int)
-
-        # 2. LA MAGIA: Calcoliamo 'giorni_osservati_finora' al volo se manca
-        if 'giorni_osservati_finora' not in df.columns:
-            if 'arm_data_ini' in df.columns:
+        if opts["chunksize"] is None:
+            # Tutto in una volta: CSV già tipizzato dalla cache delle feature (riparsato solo se cambia)
+            df = carica_csv(csv_path)
+            colonne = df.columns
+            blocchi = [df]
+        else:
+            colonne = pd.read_csv(csv_path, nrows=0).columns
+            blocchi = pd.read_csv(csv_path, low_memory=False, chunksize=opts["chunksize"])
+
+        mediana_eta = None
+        if 'giorni_osservati_finora' not in colonne:
+            if 'arm_data_ini' in colonne:
                 self.stdout.write("Calcolo l'età dei lampioni da 'arm_data_ini'...")
-                # Trasformiamo la colonna in date reali
-                df['arm_data_ini'] = pd.to_datetime(df['arm_data_ini'], errors='coerce')
-                # Sottraiamo la data di installazione ad oggi per ottenere i giorni
-                df['giorni_osservati_finora'] = (pd.Timestamp.now() - df['arm_data_ini']).dt.days
-                # Se un lampione non ha la data inserita (NaN), gli diamo la media dell'impianto
-                mediana_eta = df['giorni_osservati_finora'].median()
-                df['giorni_osservati_finora'] = df['giorni_osservati_finora'].fillna(mediana_eta)
+                if opts["chunksize"] is None:
+                    mediana_eta = eta_in_giorni(df['arm_data_ini']).median()
+                else:
+                    mediana_eta = calcola_mediana_eta(csv_path, opts["chunksize"])
             else:
                 raise ValueError("Errore: Il CSV non ha né 'giorni_osservati_finora' né 'arm_data_ini'.")
 
-        # 3. Allineamento Feature per il Modello
-        feature_cols = ["arm_altezza", "arm_lmp_potenza_nominale", "giorni_osservati_finora", "tmo_id"]
-        
-        # Conversione dei tipi per evitare crash
-        df['tmo_id'] = df['tmo_id'].astype(str)
-        for c in ["arm_altezza", "arm_lmp_potenza_nominale", "giorni_osservati_finora"]:
-            df[c] = pd.to_numeric(df[c], errors='coerce')
-
-        X = df[feature_cols].copy()
-        
-        # 4. Predizione AI
-        self.stdout.write("Calcolo delle predizioni in corso...")
-        proba = clf.predict_proba(X)[:, 1]
-        df["risk_score"] = proba
-        # Salvataggio file CSV per sicurezza/debug
-        df_out = df[["arm_id", "risk_score"]].sort_values("risk_score", ascending=False)
-        df_out.to_csv(out_csv, index=False)
-        self.stdout.write(self.style.SUCCESS(f"Punteggi salvati su file: {out_csv}"))
-
-        # --- AGGIORNAMENTO DATABASE DJANGO ---
+        # --- AGGIORNAMENTO DATABASE DJANGO (preparazione) ---
+        from core.bulk import aggiorna_da_stage
+        from core.cache import incrementa_versione_dati
+        from core.scoring_incrementale import allinea_watermark
         from core.models import LampioneNuovo
+        from core.spatial import traccia_arm_id
         from django.utils.timezone import now
-        
-        self.stdout.write("Aggiornamento del Database in corso...")
-        scores_dict = df_out.set_index('arm_id')['risk_score'].to_dict()
-        
-        pred = pd.read_csv("macchine learning\\predizioneDelGesu.csv")
-
-        merged = df_out.merge(
-            pred[["arm_id", "pred_giorni_residui"]],
-            on="arm_id",
-            how="inner"
-        )
-        #merged.loc[merged["pred_giorni_residui"] > 10000, "pred_giorni_residui"] = -1
-        merged.loc[merged["risk_score"] > 0.9, "pred_giorni_residui"] = random.randint(0, 30)
-        
-        merged.loc[(merged["risk_score"] > 0.7) & (merged["risk_score"] <= 0.9), "pred_giorni_residui"] = random.randint(30, 150)
-
-        merged.loc[(merged["risk_score"] <= 0.2) & (merged["risk_score"] > 0.1), "pred_giorni_residui"] = random.randint(360, 1800)
-
-        merged.loc[merged["risk_score"] <= 0.1, "pred_giorni_residui"] = random.randint(700, 2000)
-        merged=merged.set_index('arm_id')['pred_giorni_residui'].to_dict()
-        
-        # Prendiamo dal DB solo i lampioni che esistono nel CSV
-        lampioni = LampioneNuovo.objects.filter(arm_id__in=scores_dict.keys())
-        #print(giorni_dict)
-        for lampione in lampioni:
-            lampione.risk_score = scores_dict[lampione.arm_id]
-            lampione.risk_score_date = now()
-            lampione.traQuantoSiRompe = merged[lampione.arm_id]
-            
-        LampioneNuovo.objects.bulk_update(lampioni, ['risk_score', 'risk_score_date','traQuantoSiRompe'])
+
+        # Un solo estratto per fascia di rischio per tutta l'esecuzione, come nella versione non a blocchi
+        giorni_per_fascia = estrai_giorni_per_fascia()
+        data_score = now()
+
+        def scrivi_blocco(df_out):
+            # Un solo UPDATE ... FROM per blocco, unendo la tabella di stage su arm_id.
+            # L'indice spaziale della mappa viene aggiornato solo per i lampioni del blocco che cambiano fascia
+            stage = tabella_punteggi(df_out, giorni_per_fascia, data_score)
+            with traccia_arm_id(pd.unique(stage["arm_id"].dropna()).tolist()):
+                return aggiorna_da_stage(
+                    LampioneNuovo, stage, "arm_id", CAMPI_PUNTEGGIO, batch_size=opts["batch_size"],
+                )
+
+        self.stdout.write(f"Carico modelli: {model_path} e {survival_dir} ({workers} processi)")
+        self.stdout.write("Calcolo delle predizioni e aggiornamento del Database in corso...")
+        inizio = time.perf_counter()
+        scorati = aggiornati = 0
+        # Salvataggio file CSV per sicurezza/debug (ordinato per rischio dentro ogni blocco)
+        if os.path.exists(out_csv):
+            os.remove(out_csv)
+
+        for df_out in self.scora_blocchi(blocchi, (model_path, survival_dir), mediana_eta, workers):
+            df_out.to_csv(out_csv, mode="a", header=scorati == 0, index=False)
+            aggiornati += scrivi_blocco(df_out)
+            scorati += len(df_out)
+
+            durata = time.perf_counter() - inizio
+            self.stdout.write(f"  -> Scorati {scorati:,} lampioni, aggiornate {aggiornati:,} righe ({scorati / max(durata, 1e-9):,.0f} righe/s)...")
+
+        # La dashboard e i conteggi delle fasce di rischio in cache non valgono più
+        incrementa_versione_dati()
+        # Tutte le segnalazioni e gli eventi presenti sono già considerati: score_incrementale riparte da qui
+        allinea_watermark()
+
+        durata = time.perf_counter() - inizio
+        self.stdout.write(self.style.SUCCESS(f"Punteggi salvati su file: {out_csv}"))
+        self.stdout.write(f"Scorati {scorati} lampioni e aggiornate {aggiornati} righe in {durata:.1f}s ({scorati / max(durata, 1e-9):,.0f} righe/s).")
         self.stdout.write(self.style.SUCCESS("Database Django aggiornato con successo! Siete pronti per la mappa!"))
 
-        #python .\manage.py score_model --model ml_artifacts\risk_model_h60d.joblib --csv .\lampioni_attivi_coordinate.csv
\ No newline at end of file
+    def scora_blocchi(self, blocchi, modelli, mediana_eta, workers):
+        """
+        Genera i blocchi scorati nell'ordine del CSV. Con più worker tiene in volo
+        al massimo 2 blocchi per processo, così la RAM non dipende dalla dimensione del file.
+        """
+        if workers == 1:
+            carica_modelli(*modelli)
+            for blocco in blocchi:
+                yield scora_blocco(blocco, mediana_eta)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=carica_modelli, initargs=modelli) as pool:
+            in_volo = deque()
+            for blocco in blocchi:
+                in_volo.append(pool.submit(scora_blocco, blocco, mediana_eta))
+                if len(in_volo) >= 2 * workers:
+                    yield in_volo.popleft().result()
+            while in_volo:
+                yield in_volo.popleft().result()
+
+        #python .\manage.py score_model --model ml_artifacts\risk_model_h60d.joblib --csv .\lampioni_attivi_coordinate.csv --chunksize 200000 --workers 4
@@ -0,0 +1,121 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import queries
+from core.aggregates import righe_distribuzione, sql_dashboard
+from core.models import LampioneManutenzione, LampioneNuovo
+from core.pagination import PER_PAGINA, query_seek
+from core.spatial import celle_viewport
+
+# Ordinamenti accettati dalle liste (gli stessi valid_fields delle viste)
+ORDINAMENTI_RISCHIO = ['arm_id', 'risk_score', 'arm_altezza', 'risk_score_date', 'traQuantoSiRompe']
+ORDINAMENTI_MANUTENZIONE = ['arm_id', 'sgn_data_inserimento', 'tci_descr', 'arm_altezza']
+
+# Righe del piano che indicano la lettura dell'intera tabella
+SCANSIONE_COMPLETA = {
+    'sqlite': re.compile(r'\bSCAN (?!.*\bUSING\b)(?!CONSTANT ROW)'),
+    'postgresql': re.compile(r'\bSeq Scan\b'),
+}
+
+
+def _esempio(queryset, campo):
+    """Un valore reale del campo da usare come parametro (None se la tabella è vuota)."""
+    return queryset.exclude(**{f'{campo}__isnull': True}).values_list(campo, flat=True).first()
+
+
+def _pagina_successiva(queryset, campo):
+    """La query keyset di una pagina successiva delle liste, con un cursore preso dai dati."""
+    cursore = queryset.exclude(**{f'{campo}__isnull': True}).values_list(campo, 'pk').first()
+    return query_seek(queryset, campo, False, cursore)[0][:PER_PAGINA + 1]
+
+
+def query_delle_viste():
+    """
+    (nome, queryset o (sql, parametri), aggregata) per ogni query delle viste, con parametri presi dai dati.
+    Le query aggregate (dashboard) leggono per natura tutta la tabella: vengono stampate
+    ma non contano come regressione.
+    """
+    categoria = _esempio(LampioneManutenzione.objects, 'tcs_descr') or ''
+    intervento = _esempio(LampioneManutenzione.objects, 'tci_descr') or ''
+    arm_id = _esempio(LampioneManutenzione.objects, 'arm_id') or 0
+    potenza = _esempio(LampioneManutenzione.objects, 'arm_lmp_potenza_nominale')
+    altezza = _esempio(LampioneManutenzione.objects, 'arm_altezza')
+    lat = _esempio(LampioneNuovo.objects, 'latitudine') or 0.0
+    lon = _esempio(LampioneNuovo.objects, 'longitudine') or 0.0
+    bbox = (lon - 0.002, lat - 0.002, lon + 0.002, lat + 0.002)
+
+    elenco = [
+        ('index: top critici', queries.top_critici(), False),
+        ('mappa: lampioni nel viewport', queries.lampioni_nel_bbox(*bbox), False),
+        ('mappa: celle del viewport (zoom 13)', celle_viewport(13, *bbox), False),
+        ('dashboard: categorie e interventi (una query)', sql_dashboard(), True),
+        ('dettaglio_lampione: storico', queries.storico_lampione(arm_id), False),
+        ('dettaglio_asset: segnalazioni', queries.segnalazioni_lampione(arm_id), False),
+        ('dettaglio_asset: distribuzione guasti', righe_distribuzione(potenza, altezza), False),
+    ]
+    for livello in queries.LIVELLI_RISCHIO:
+        for campo in ORDINAMENTI_RISCHIO:
+            qs = _pagina_successiva(queries.lampioni_per_rischio(livello)[1], campo)
+            elenco.append((f'dettaglio_rischio {livello} per -{campo}', qs, False))
+    for campo in ORDINAMENTI_MANUTENZIONE:
+        elenco.append((f'dettaglio_guasto per -{campo}', _pagina_successiva(queries.guasti_per_categoria(categoria), campo), False))
+        elenco.append((f'dettaglio_intervento per -{campo}', _pagina_successiva(queries.interventi_per_tipo(intervento), campo), False))
+    return elenco
+
+
+def _spiega(query):
+    if isinstance(query, tuple):
+        sql, parametri = query
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", parametri)
+            return "\n".join(" ".join(str(colonna) for colonna in riga) for riga in cursor.fetchall())
+    return query.explain()
+
+
+class Command(BaseCommand):
+    help = "Stampa il piano di esecuzione (EXPLAIN) di ogni query delle viste e segnala le scansioni complete"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--analyze", action="store_true", help="Esegue ANALYZE prima, così il planner usa statistiche aggiornate.")
+        parser.add_argument("--solo-problemi", action="store_true", help="Stampa solo le query che leggono l'intera tabella.")
+        parser.add_argument("--fail-on-scan", action="store_true", help="Esce con errore se una query non aggregata legge l'intera tabella (per la CI).")
+
+    def handle(self, *args, **options):
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        scansione = SCANSIONE_COMPLETA.get(connection.vendor)
+        if scansione is None:
+            self.stdout.write(self.style.WARNING(f"Backend '{connection.vendor}': piani stampati senza controllo delle scansioni."))
+
+        regressioni = []
+        for nome, queryset, aggregata in query_delle_viste():
+            piano = _spiega(queryset)
+            completa = bool(scansione and any(scansione.search(riga) for riga in piano.splitlines()))
+            if options['solo_problemi'] and not completa:
+                continue
+
+            if not completa:
+                esito = self.style.SUCCESS("OK")
+            elif aggregata:
+                esito = self.style.NOTICE("SCANSIONE COMPLETA (aggregato, attesa)")
+            else:
+                esito = self.style.ERROR("SCANSIONE COMPLETA")
+                regressioni.append(nome)
+
+            self.stdout.write(f"\n== {nome}: {esito}")
+            if options['verbosity'] > 1:
+                self.stdout.write(queryset[0] if isinstance(queryset, tuple) else str(queryset.query))
+            for riga in piano.splitlines():
+                self.stdout.write(f"   {riga}")
+
+        if regressioni:
+            messaggio = f"{len(regressioni)} query leggono l'intera tabella: " + ", ".join(regressioni)
+            if options['fail_on_scan']:
+                raise CommandError(messaggio)
+            self.stdout.write(self.style.WARNING(f"\n{messaggio}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("\nNessuna scansione completa nelle query delle viste."))
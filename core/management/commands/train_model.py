@@ -3,18 +3,16 @@
 import json
 import os
 import numpy as np
-import pandas as pd
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from joblib import dump
 
-from sklearn.compose import ColumnTransformer
-from sklearn.impute import SimpleImputer
 from sklearn.ensemble import HistGradientBoostingClassifier
 from sklearn.metrics import average_precision_score, roc_auc_score
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import OrdinalEncoder
-from sklearn.model_selection import train_test_split
+
+from core.ml.binning import carica_matrice
+
 
 class Command(BaseCommand):
     help = "Allena modello predittivo sul nuovo dataset CSV statico."
@@ -22,55 +20,43 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--csv", type=str, required=True, help="Path al nuovo CSV.")
         parser.add_argument("--out-dir", type=str, default="ml_artifacts")
+        parser.add_argument("--max-bins", type=int, default=255, help="Bin per feature della matrice pre-discretizzata (fino a 255: uint8).")
+        parser.add_argument("--senza-cache", action="store_true", help="Ricostruisce la matrice dal CSV senza leggere né scrivere la cache.")
 
     def handle(self, *args, **opts):
         csv_path = opts["csv"]
         out_dir = os.path.join(settings.BASE_DIR, opts["out_dir"])
         os.makedirs(out_dir, exist_ok=True)
 
-        self.stdout.write(f"Leggo nuovo CSV: {csv_path}")
-        df = pd.read_csv(csv_path)
-
-        # 1. Creazione Target (y = 1 se giorni_guasto > 0 altrimenti 0)
-        df['y'] = (df['giorni_guasto'] > 0).astype(int)
-
-        # 2. Pulizia tipi
-        df['arm_altezza'] = pd.to_numeric(df['arm_altezza'], errors='coerce')
-        df['arm_lmp_potenza_nominale'] = pd.to_numeric(df['arm_lmp_potenza_nominale'], errors='coerce')
-        df['giorni_osservati_finora'] = pd.to_numeric(df['giorni_osservati_finora'], errors='coerce')
-        df['tmo_id'] = df['tmo_id'].astype(str)
-
-        self.stdout.write(f"Righe lette: {len(df):,}")
-        self.stdout.write(f"Guasti trovati: {df['y'].sum():,} ({df['y'].mean()*100:.2f}%)")
-
-        # 3. Definizione Feature
+        # 1. Definizione Feature
         numeric_features = ["arm_altezza", "arm_lmp_potenza_nominale", "giorni_osservati_finora"]
         categorical_features = ["tmo_id"]
 
-        X = df[numeric_features + categorical_features].copy()
-        y = df['y'].values
+        # 2. Matrice pre-discretizzata (codici uint8 + target grezzo + split train/test), in cache
+        # finché il CSV non cambia; bordi dei bin e categorie vengono dalle sole righe di training
+        self.stdout.write(f"Leggo nuovo CSV: {csv_path}")
+        matrice = carica_matrice(
+            csv_path, numeric_features, categorical_features,
+            max_bins=opts["max_bins"], cache=not opts["senza_cache"],
+        )
+        if matrice.dalla_cache:
+            self.stdout.write("Matrice pre-discretizzata letta dalla cache (memory-map).")
 
-        # 4. Split Train/Test randomico
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
-        self.stdout.write(f"Train size: {len(X_train)}  Test size: {len(X_test)}")
+        # 3. Creazione Target (y = 1 se giorni_guasto > 0 altrimenti 0)
+        y = (matrice.target > 0).astype(int)
 
-        # 5. Pipeline Preprocessing
-        numeric_transformer = "passthrough"
-        categorical_transformer = Pipeline(steps=[
-            ("imputer", SimpleImputer(strategy="most_frequent")),
-            ("ordinal", OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=-1)),
-        ])
+        self.stdout.write(f"Righe lette: {len(y):,}")
+        self.stdout.write(f"Guasti trovati: {y.sum():,} ({y.mean()*100:.2f}%)")
 
-        preprocessor = ColumnTransformer(
-            transformers=[
-                ("num", numeric_transformer, numeric_features),
-                ("cat", categorical_transformer, categorical_features),
-            ],
-            remainder="drop",
-            n_jobs=-1
-        )
+        # 4. Split Train/Test randomico, già fatto da carica_matrice (sugli indici: si copiano solo le righe usate)
+        idx_train, idx_test = matrice.idx_train, matrice.idx_test
+        X_train = matrice.binner.a_float(matrice.codici[idx_train])
+        X_test = matrice.binner.a_float(matrice.codici[idx_test])
+        y_train, y_test = y[idx_train], y[idx_test]
+        self.stdout.write(f"Train size: {len(X_train)}  Test size: {len(X_test)}")
 
-        cat_indices = list(range(len(numeric_features), len(numeric_features) + len(categorical_features)))
+        # 5. Preprocessing: il PreBinner allenato (bordi dei bin e mappa delle categorie) passa
+        # dalle feature grezze ai codici, per lo scoring; in training i codici sono già pronti
 
         # 6. Modello con BILANCIAMENTO CLASSI per risolvere le probabilità a 0%
         model = HistGradientBoostingClassifier(
@@ -82,16 +68,16 @@ class Command(BaseCommand):
             class_weight="balanced"  # <-- Questo forzerà probabilità alte per i lampioni a rischio!
         )
 
+        self.stdout.write("Avvio training modello...")
+        model.fit(X_train, y_train)
+
         clf = Pipeline(steps=[
-            ("preprocess", preprocessor),
+            ("preprocess", matrice.binner),
             ("model", model),
         ])
 
-        self.stdout.write("Avvio training modello...")
-        clf.fit(X_train, y_train)
-
         # 7. Valutazione
-        proba = clf.predict_proba(X_test)[:, 1]
+        proba = model.predict_proba(X_test)[:, 1]
         if len(np.unique(y_test)) > 1:
             roc = roc_auc_score(y_test, proba)
             ap = average_precision_score(y_test, proba)
@@ -107,6 +93,7 @@ class Command(BaseCommand):
         meta = {
             "numeric_features": numeric_features,
             "categorical_features": categorical_features,
+            "max_bins": opts["max_bins"],
         }
         with open(meta_path, "w", encoding="utf-8") as f:
             json.dump(meta, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_segnalazioni_datetime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CellaMappa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('livello', models.IntegerField()),
+                ('cx', models.IntegerField()),
+                ('cy', models.IntegerField()),
+                ('n', models.IntegerField(default=0)),
+                ('critico', models.IntegerField(default=0)),
+                ('attenzione', models.IntegerField(default=0)),
+                ('ottimo', models.IntegerField(default=0)),
+                ('sconosciuto', models.IntegerField(default=0)),
+                ('lat_somma', models.FloatField(default=0)),
+                ('lon_somma', models.FloatField(default=0)),
+                ('lampione_id', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('livello', 'cx', 'cy'), name='cella_mappa_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-17 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_cellamappa'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistribuzioneGuasti',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('citta', models.BooleanField(default=False)),
+                ('arm_lmp_potenza_nominale', models.FloatField(blank=True, null=True)),
+                ('arm_altezza', models.FloatField(blank=True, null=True)),
+                ('tcs_descr', models.CharField(max_length=255)),
+                ('n_eventi', models.IntegerField()),
+                ('prob_guasto', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['citta', 'arm_lmp_potenza_nominale', 'arm_altezza'], name='distribuzione_guasti_combo')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.2 on 2026-10-17 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_distribuzioneguasti'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lampionemanutenzione',
+            index=models.Index(fields=['tcs_descr', 'sgn_data_inserimento'], name='manut_categoria_data'),
+        ),
+        migrations.AddIndex(
+            model_name='lampionemanutenzione',
+            index=models.Index(fields=['tci_descr', 'sgn_data_inserimento'], name='manut_intervento_data'),
+        ),
+        migrations.AddIndex(
+            model_name='lampionemanutenzione',
+            index=models.Index(fields=['arm_id', 'sgn_data_inserimento'], name='manut_arm_data'),
+        ),
+        migrations.AddIndex(
+            model_name='lampionemanutenzione',
+            index=models.Index(fields=['arm_lmp_potenza_nominale', 'arm_altezza', 'tcs_descr'], name='manut_potenza_altezza'),
+        ),
+        migrations.AddIndex(
+            model_name='lampionenuovo',
+            index=models.Index(fields=['risk_score'], name='nuovo_risk_score'),
+        ),
+        migrations.AddIndex(
+            model_name='lampionenuovo',
+            index=models.Index(fields=['risk_score_date'], name='nuovo_risk_score_date'),
+        ),
+        migrations.AddIndex(
+            model_name='lampionenuovo',
+            index=models.Index(fields=['traQuantoSiRompe'], name='nuovo_traquantosirompe'),
+        ),
+        migrations.AddIndex(
+            model_name='lampionenuovo',
+            index=models.Index(fields=['latitudine', 'longitudine'], name='nuovo_lat_lon'),
+        ),
+        migrations.AddIndex(
+            model_name='segnalazioni',
+            index=models.Index(fields=['arm_id', 'datetime'], name='segnalazioni_arm_data'),
+        ),
+    ]
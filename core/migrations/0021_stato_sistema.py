@@ -0,0 +1,20 @@
+# Generated by Django 6.0.2 on 2026-10-17 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_indici_viste'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatoSistema',
+            fields=[
+                ('chiave', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('valore', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
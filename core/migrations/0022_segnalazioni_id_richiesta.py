@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_stato_sistema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='segnalazioni',
+            name='id_richiesta',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-17 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_segnalazioni_id_richiesta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiepilogoAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('arm_id', models.IntegerField(unique=True)),
+                ('n_eventi', models.IntegerField(default=0)),
+                ('primo_guasto', models.DateTimeField(blank=True, null=True)),
+                ('ultimo_guasto', models.DateTimeField(blank=True, null=True)),
+                ('mtbf_giorni', models.FloatField(blank=True, null=True)),
+                ('tcs_descr_frequente', models.CharField(blank=True, max_length=255, null=True)),
+                ('tci_descr_frequente', models.CharField(blank=True, max_length=255, null=True)),
+            ],
+        ),
+    ]
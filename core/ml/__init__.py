@@ -0,0 +1,6 @@
+"""
+Modelli di machine learning usati dai comandi di gestione.
+
+Questo package non importa Django: può essere usato anche dagli script
+standalone in "macchine learning/".
+"""
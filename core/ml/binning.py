@@ -0,0 +1,180 @@
+"""
+Matrice di training pre-discretizzata per il modello di rischio.
+
+PreBinner trasforma le feature in codici interi di al più max_bins valori
+(quantili per le numeriche, indice della categoria per tmo_id) con un codice
+riservato ai valori mancanti. Il PreBinner è allenato solo sulle righe di
+training: lo split train/test si fa prima (stratificato sul target) e fa parte
+della chiave della cache, così bordi e categorie non vedono le righe di test.
+La matrice dei codici (uint8, uint16 oltre 255 bin), il target grezzo, gli
+indici dello split e il PreBinner allenato vengono salvati in una cache la cui
+chiave è l'hash del CSV: i training successivi (parametri diversi, orizzonte
+diverso) la aprono in memory-map senza riparsare né ripreprocessare, e più
+processi possono leggerla insieme senza copiarla.
+
+Il PreBinner resta il primo passo della Pipeline salvata: lo scoring continua
+a passare le feature grezze al modello.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from joblib import dump, load
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.model_selection import train_test_split
+
+from .features import CACHE_DIR, VERSIONE_CACHE, carica_csv, hash_file
+
+# Colonna del CSV da cui si ricava il target (y = giorni_guasto > 0)
+COLONNA_TARGET = "giorni_guasto"
+
+
+class PreBinner(TransformerMixin, BaseEstimator):
+    """
+    Codici 0..max_bins-1 per ogni feature, max_bins per i mancanti (o le categorie mai viste).
+    transform restituisce i codici come float con NaN al posto dei mancanti, così
+    HistGradientBoosting li tratta con il suo supporto nativo dei valori mancanti.
+    """
+
+    def __init__(self, numeric_features, categorical_features, max_bins=255):
+        self.numeric_features = numeric_features
+        self.categorical_features = categorical_features
+        self.max_bins = max_bins
+
+    @property
+    def mancante(self):
+        return self.max_bins
+
+    @property
+    def dtype(self):
+        return np.uint8 if self.max_bins <= 255 else np.uint16
+
+    def fit(self, X, y=None):
+        self.bin_edges_ = {}
+        for colonna in self.numeric_features:
+            valori = pd.to_numeric(X[colonna], errors="coerce").to_numpy(dtype=float)
+            valori = valori[~np.isnan(valori)]
+            unici = np.unique(valori)
+            if len(unici) <= self.max_bins:
+                # pochi valori distinti: un bin per valore (soglie a metà strada, come HistGradientBoosting)
+                bordi = (unici[:-1] + unici[1:]) / 2
+            else:
+                bordi = np.unique(np.quantile(valori, np.linspace(0, 1, self.max_bins + 1)[1:-1]))
+            self.bin_edges_[colonna] = bordi
+
+        self.categories_ = {}
+        for colonna in self.categorical_features:
+            # oltre max_bins categorie restano le più frequenti, le altre diventano "mancante"
+            frequenti = X[colonna].astype(str).value_counts().index[:self.max_bins]
+            self.categories_[colonna] = sorted(frequenti)
+        return self
+
+    def codici(self, X):
+        """Matrice (righe, feature) di codici interi, nell'ordine numeriche + categoriche."""
+        colonne = []
+        for colonna in self.numeric_features:
+            valori = pd.to_numeric(X[colonna], errors="coerce").to_numpy(dtype=float)
+            codice = np.searchsorted(self.bin_edges_[colonna], valori, side="right")
+            colonne.append(np.where(np.isnan(valori), self.mancante, codice))
+        for colonna in self.categorical_features:
+            categorie = pd.Index(self.categories_[colonna])
+            codice = categorie.get_indexer(X[colonna].astype(str))
+            colonne.append(np.where(codice < 0, self.mancante, codice))
+        return np.column_stack(colonne).astype(self.dtype)
+
+    def a_float(self, codici):
+        X = codici.astype(np.float32)
+        X[codici == self.mancante] = np.nan
+        return X
+
+    def transform(self, X):
+        return self.a_float(self.codici(X))
+
+
+@dataclass
+class MatriceBinned:
+    codici: np.ndarray
+    target: np.ndarray
+    idx_train: np.ndarray
+    idx_test: np.ndarray
+    binner: PreBinner
+    dalla_cache: bool
+
+
+def cartella_cache(csv_path, numeric_features, categorical_features, max_bins, test_size, random_state,
+                   cache_dir=CACHE_DIR):
+    # anche feature e split fanno parte della chiave: cambiarli produce un'altra matrice
+    feature = hashlib.blake2b("+".join(numeric_features + categorical_features).encode(), digest_size=4).hexdigest()
+    chiave = f"{hash_file(csv_path)}-v{VERSIONE_CACHE}-b{max_bins}-t{test_size}-s{random_state}-{feature}"
+    return Path(cache_dir) / "binned" / f"{Path(csv_path).stem}-{chiave}"
+
+
+def _apri(cartella, dalla_cache=True):
+    return MatriceBinned(
+        codici=np.load(cartella / "codici.npy", mmap_mode="r"),
+        target=np.load(cartella / "target.npy", mmap_mode="r"),
+        idx_train=np.load(cartella / "idx_train.npy"),
+        idx_test=np.load(cartella / "idx_test.npy"),
+        binner=load(cartella / "binner.joblib"),
+        dalla_cache=dalla_cache,
+    )
+
+
+def carica_matrice(csv_path, numeric_features, categorical_features, max_bins=255, test_size=0.2,
+                   random_state=42, cache=True, cache_dir=CACHE_DIR):
+    """
+    Codici delle feature, target grezzo (giorni_guasto), split train/test
+    (stratificato su giorni_guasto > 0) e PreBinner allenato sulle sole righe di
+    training. Se la cache esiste la matrice è aperta in memory-map (sola lettura),
+    altrimenti viene costruita dal CSV e salvata.
+    """
+    cartella = cartella_cache(
+        csv_path, numeric_features, categorical_features, max_bins, test_size, random_state, cache_dir
+    )
+    if cache and (cartella / "meta.json").exists():
+        return _apri(cartella)
+
+    df = carica_csv(csv_path)
+    target = pd.to_numeric(df[COLONNA_TARGET], errors="coerce").to_numpy(dtype=np.float32)
+    idx_train, idx_test = train_test_split(
+        np.arange(len(df)), test_size=test_size, random_state=random_state, stratify=target > 0
+    )
+    binner = PreBinner(numeric_features, categorical_features, max_bins).fit(df.iloc[idx_train])
+    codici = binner.codici(df)
+    if not cache:
+        return MatriceBinned(codici, target, idx_train, idx_test, binner, dalla_cache=False)
+
+    # scrittura in una cartella temporanea rinominata alla fine: un processo concorrente
+    # vede la cache completa oppure non la vede
+    temporanea = cartella.with_name(cartella.name + f".{os.getpid()}.tmp")
+    shutil.rmtree(temporanea, ignore_errors=True)
+    temporanea.mkdir(parents=True)
+    np.save(temporanea / "codici.npy", codici)
+    np.save(temporanea / "target.npy", target)
+    np.save(temporanea / "idx_train.npy", idx_train)
+    np.save(temporanea / "idx_test.npy", idx_test)
+    dump(binner, temporanea / "binner.joblib")
+    with open(temporanea / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "csv": str(csv_path),
+            "righe": len(codici),
+            "righe_train": len(idx_train),
+            "test_size": test_size,
+            "random_state": random_state,
+            "feature": numeric_features + categorical_features,
+            "max_bins": max_bins,
+            "bin_edges": {colonna: bordi.tolist() for colonna, bordi in binner.bin_edges_.items()},
+            "categorie": binner.categories_,
+        }, f, indent=2, ensure_ascii=False)
+    try:
+        os.replace(temporanea, cartella)
+    except OSError:
+        # un altro processo l'ha già scritta
+        shutil.rmtree(temporanea, ignore_errors=True)
+    return _apri(cartella, dalla_cache=False)
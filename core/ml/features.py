@@ -0,0 +1,132 @@
+"""
+Feature store dei CSV dei lampioni.
+
+Il CSV viene letto e tipizzato una volta sola (stringhe ripulite, date con
+formati espliciti, numeriche convertite) e il risultato viene salvato in una
+cache colonnare (Parquet se pyarrow è installato, altrimenti pickle) la cui
+chiave è l'hash del file sorgente: finché il CSV non cambia, training, scoring
+e script lo rileggono dalla cache senza riparsarlo.
+
+Le feature in giorni dipendono dalla data di oggi e vengono calcolate al
+caricamento con aggiungi_giorni (vettoriale, costa pochi millisecondi).
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Cambiare la versione invalida tutte le cache (es. se cambia il parsing)
+VERSIONE_CACHE = 1
+
+CACHE_DIR = Path(__file__).resolve().parents[2] / "ml_artifacts" / "feature_cache"
+
+VALORI_NULLI = ["", "NULL", "null", "NaN", "nan"]
+
+# Formati provati in ordine, ciascuno solo sulle righe non ancora riconosciute
+FORMATI_DATA = ["%Y-%m-%d", "%d/%m/%Y", "%d/%m/%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S"]
+
+COLONNE_DATA = ["arm_data_ini", "arm_data_fin", "sgn_data_inserimento"]
+
+COLONNE_NUMERICHE = [
+    "arm_id", "arm_altezza", "arm_lunghezza_sbraccio", "arm_numero_lampade",
+    "arm_lmp_potenza_nominale", "tmo_id", "sgn_id", "tcs_id", "tci_id",
+    "latitudine", "longitudine", "giorni_guasto", "giorni_osservati_finora",
+    "giorni_vita_attuale", "prob_guasto", "prob_guasto_entra_60gg",
+]
+
+try:
+    import pyarrow  # noqa: F401
+    FORMATO_CACHE = "parquet"
+except ImportError:
+    FORMATO_CACHE = "pkl"
+
+
+def parse_date(serie):
+    """Date con i formati di FORMATI_DATA (niente dayfirst/inferenza): il resto diventa NaT."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    date = pd.Series(pd.NaT, index=serie.index, dtype="datetime64[ns]")
+    for formato in FORMATI_DATA:
+        mancanti = date.isna() & serie.notna()
+        if not mancanti.any():
+            break
+        date[mancanti] = pd.to_datetime(serie[mancanti], format=formato, errors="coerce")
+    return date
+
+
+def tipizza(df):
+    """Ripulisce le stringhe e converte date e colonne numeriche note, colonna per colonna."""
+    for colonna in df.columns:
+        if df[colonna].dtype == object or pd.api.types.is_string_dtype(df[colonna]):
+            testo = df[colonna].str.strip()
+            df[colonna] = testo.mask(testo.isin(VALORI_NULLI))
+
+    for colonna in COLONNE_DATA:
+        if colonna in df.columns:
+            df[colonna] = parse_date(df[colonna])
+    for colonna in COLONNE_NUMERICHE:
+        if colonna in df.columns:
+            df[colonna] = pd.to_numeric(df[colonna], errors="coerce")
+    return df
+
+
+def aggiungi_giorni(df, oggi=None):
+    """
+    Feature in giorni, tutte vettoriali:
+    - giorni_guasto: dall'installazione alla segnalazione (NaN se non c'è segnalazione)
+    - giorni_osservati_finora: giorni_guasto se c'è un guasto, altrimenti giorni da installazione a oggi
+    - giorni_vita_attuale: giorni da installazione a oggi
+    - giorni_vita_fin: giorni da installazione a fine vita (arm_data_fin)
+    """
+    oggi = pd.Timestamp.today().normalize() if oggi is None else pd.Timestamp(oggi)
+    ini = df["arm_data_ini"]
+
+    df["giorni_vita_attuale"] = (oggi - ini).dt.days
+    if "arm_data_fin" in df.columns:
+        df["giorni_vita_fin"] = (df["arm_data_fin"] - ini).dt.days
+    if "sgn_data_inserimento" in df.columns:
+        df["giorni_guasto"] = (df["sgn_data_inserimento"] - ini).dt.days
+        guasto = df["giorni_guasto"].fillna(0)
+        df["giorni_osservati_finora"] = np.where(guasto == 0, df["giorni_vita_attuale"], guasto)
+    return df
+
+
+def hash_file(path, blocco=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while dati := f.read(blocco):
+            h.update(dati)
+    return h.hexdigest()
+
+
+def percorso_cache(path, cache_dir=CACHE_DIR):
+    chiave = f"{hash_file(path)}-v{VERSIONE_CACHE}"
+    return Path(cache_dir) / f"{Path(path).stem}-{chiave}.{FORMATO_CACHE}"
+
+
+def carica_csv(path, cache=True, cache_dir=CACHE_DIR, **read_csv_kwargs):
+    """
+    CSV tipizzato (vedi tipizza), letto dalla cache se il file non è cambiato.
+    Le feature in giorni non sono in cache: aggiungerle con aggiungi_giorni.
+    """
+    file_cache = percorso_cache(path, cache_dir) if cache else None
+    if file_cache is not None and file_cache.exists():
+        if FORMATO_CACHE == "parquet":
+            return pd.read_parquet(file_cache)
+        return pd.read_pickle(file_cache)
+
+    df = tipizza(pd.read_csv(path, dtype=str, keep_default_na=False, **read_csv_kwargs))
+
+    if file_cache is not None:
+        os.makedirs(file_cache.parent, exist_ok=True)
+        # scrittura atomica: un processo concorrente non legge mai una cache a metà
+        temporaneo = file_cache.with_name(file_cache.name + f".{os.getpid()}.tmp")
+        if FORMATO_CACHE == "parquet":
+            df.to_parquet(temporaneo, index=False)
+        else:
+            df.to_pickle(temporaneo)
+        os.replace(temporaneo, file_cache)
+    return df
@@ -0,0 +1,118 @@
+"""
+Scoring dell'anagrafica attiva: rischio di guasto (HistGradientBoosting) e giorni
+residui (XGBoost AFT) calcolati sullo stesso blocco, con le feature preparate una volta.
+
+I modelli vengono caricati una sola volta per processo con carica_modelli, che
+fa anche da initializer dei worker del pool in score_model.
+"""
+
+import random
+
+import pandas as pd
+from joblib import load
+
+from . import survival
+from .features import parse_date
+
+FEATURE_COLS = ["arm_altezza", "arm_lmp_potenza_nominale", "giorni_osservati_finora", "tmo_id"]
+# Campi di LampioneNuovo scritti dallo scoring
+CAMPI_PUNTEGGIO = ["risk_score", "traQuantoSiRompe", "risk_score_date"]
+
+# Modelli caricati una sola volta per processo (worker del pool o processo principale)
+_clf = None
+_survival = None
+
+
+def carica_modelli(model_path, survival_dir):
+    global _clf, _survival
+    _clf = load(model_path)
+    _survival = survival.load_artifacts(survival_dir)
+
+
+def eta_in_giorni(arm_data_ini):
+    """Giorni dall'installazione a oggi (NaN se la data manca o non è valida)."""
+    return (pd.Timestamp.now() - parse_date(arm_data_ini)).dt.days
+
+
+def calcola_mediana_eta(csv_path, chunksize):
+    """
+    Mediana dell'età (giorni da arm_data_ini) su tutto il CSV, leggendo solo quella colonna.
+    Serve a riempire le età mancanti con lo stesso valore in tutti i blocchi.
+    """
+    eta = [
+        eta_in_giorni(blocco['arm_data_ini']).dropna()
+        for blocco in pd.read_csv(csv_path, usecols=['arm_data_ini'], dtype=str, chunksize=chunksize or 10**6)
+    ]
+    return pd.concat(eta).median() if eta else float('nan')
+
+
+def prepara_feature(df, mediana_eta):
+    # 1. Isoliamo ID validi
+    df['arm_id'] = pd.to_numeric(df['arm_id'], errors='coerce')
+    df = df[df['arm_id'].notna()].copy()
+    df['arm_id'] = df['arm_id'].astype(int)
+
+    # 2. LA MAGIA: Calcoliamo 'giorni_osservati_finora' al volo se manca
+    if 'giorni_osservati_finora' not in df.columns:
+        # Sottraiamo la data di installazione (formati espliciti) ad oggi per ottenere i giorni
+        df['giorni_osservati_finora'] = eta_in_giorni(df['arm_data_ini'])
+        # Se un lampione non ha la data inserita (NaN), gli diamo la mediana dell'impianto
+        df['giorni_osservati_finora'] = df['giorni_osservati_finora'].fillna(mediana_eta)
+
+    # 3. Conversione dei tipi per evitare crash
+    for c in ["arm_altezza", "arm_lmp_potenza_nominale", "giorni_osservati_finora"]:
+        df[c] = pd.to_numeric(df[c], errors='coerce')
+    return df
+
+
+def scora_blocco(df, mediana_eta):
+    """
+    Feature + predizione di entrambi i modelli su un blocco del CSV.
+    Ritorna arm_id, risk_score, pred_giorni_al_guasto e pred_giorni_residui ordinati per rischio.
+    """
+    colonne = ["arm_id", "risk_score", "pred_giorni_al_guasto", "pred_giorni_residui"]
+    df = prepara_feature(df, mediana_eta)
+    if df.empty:
+        return pd.DataFrame(columns=colonne)
+
+    # Il modello di rischio è stato allenato con tmo_id come stringa,
+    # quello di sopravvivenza con tmo_id numerico
+    X = df[FEATURE_COLS].assign(tmo_id=df['tmo_id'].astype(str))
+    df["risk_score"] = _clf.predict_proba(X)[:, 1]
+
+    preprocessor, booster, feature_cols = _survival
+    df["tmo_id"] = pd.to_numeric(df["tmo_id"], errors='coerce')
+    df["pred_giorni_al_guasto"], df["pred_giorni_residui"], _ = survival.predict_residual_days(
+        preprocessor, booster, feature_cols, df
+    )
+    return df[colonne].sort_values("risk_score", ascending=False)
+
+
+def estrai_giorni_per_fascia():
+    """Giorni residui assegnati alle fasce di rischio estreme: un estratto per esecuzione."""
+    return {
+        "oltre_09": random.randint(0, 30),
+        "07_09": random.randint(30, 150),
+        "01_02": random.randint(360, 1800),
+        "fino_01": random.randint(700, 2000),
+    }
+
+
+def tabella_punteggi(df_out, giorni_per_fascia, data_score):
+    """Righe (arm_id + CAMPI_PUNTEGGIO) da applicare a LampioneNuovo per un blocco scorato."""
+    blocco = df_out.copy()
+    #blocco.loc[blocco["pred_giorni_residui"] > 10000, "pred_giorni_residui"] = -1
+    blocco.loc[blocco["risk_score"] > 0.9, "pred_giorni_residui"] = giorni_per_fascia["oltre_09"]
+
+    blocco.loc[(blocco["risk_score"] > 0.7) & (blocco["risk_score"] <= 0.9), "pred_giorni_residui"] = giorni_per_fascia["07_09"]
+
+    blocco.loc[(blocco["risk_score"] <= 0.2) & (blocco["risk_score"] > 0.1), "pred_giorni_residui"] = giorni_per_fascia["01_02"]
+
+    blocco.loc[blocco["risk_score"] <= 0.1, "pred_giorni_residui"] = giorni_per_fascia["fino_01"]
+
+    return pd.DataFrame({
+        "arm_id": blocco["arm_id"],
+        "risk_score": blocco["risk_score"],
+        "traQuantoSiRompe": blocco["pred_giorni_residui"],
+        "risk_score_date": data_score,
+    })
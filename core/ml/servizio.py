@@ -0,0 +1,146 @@
+"""
+Server dei modelli: un processo che tiene caricati il modello di rischio e quello
+di sopravvivenza e risponde in HTTP su localhost, così chi deve scorare pochi
+lampioni (score_incrementale, script) non paga import e joblib.load a ogni avvio.
+
+API (JSON):
+- GET  /stato  -> {"pronto": true, "modello": ..., "survival_dir": ...}
+- POST /scora  <- {"mediana_eta": float|null, "righe": {colonna: [valori, ...]}}
+               -> {"colonne": [...], "righe": [[...], ...]}
+  Le colonne in ingresso sono quelle del CSV dell'anagrafica (arm_id,
+  arm_altezza, arm_lmp_potenza_nominale, tmo_id, arm_data_ini in formato
+  YYYY-MM-DD oppure giorni_osservati_finora); l'uscita è quella di scora_blocco.
+
+Il modulo non importa Django: il comando model_server lo avvia con le opzioni
+del progetto e Scoratore lo usa come client, con ripiego sui modelli caricati
+nel processo se il server non risponde.
+"""
+
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+import pandas as pd
+
+from . import scoring
+
+logger = logging.getLogger(__name__)
+
+# Righe massime per richiesta: blocchi più grandi vanno divisi dal client
+MAX_RIGHE = 50000
+
+
+def _in_json(df):
+    """Colonne del DataFrame come liste JSON (NaN/NaT -> null, date -> YYYY-MM-DD)."""
+    colonne = {}
+    for colonna in df.columns:
+        serie = df[colonna]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            serie = serie.dt.strftime('%Y-%m-%d')
+        serie = serie.astype(object)
+        colonne[colonna] = serie.where(serie.notna(), None).tolist()
+    return colonne
+
+
+class _Gestore(BaseHTTPRequestHandler):
+    server_version = "ModelServer/1.0"
+
+    def _rispondi(self, stato, dati):
+        corpo = json.dumps(dati).encode()
+        self.send_response(stato)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_GET(self):
+        if self.path != "/stato":
+            return self._rispondi(404, {"errore": "percorso sconosciuto"})
+        self._rispondi(200, {"pronto": True, **self.server.modelli})
+
+    def do_POST(self):
+        if self.path != "/scora":
+            return self._rispondi(404, {"errore": "percorso sconosciuto"})
+        try:
+            richiesta = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            df = pd.DataFrame(richiesta["righe"])
+        except (ValueError, KeyError, TypeError):
+            return self._rispondi(400, {"errore": "JSON non valido"})
+        if len(df) > MAX_RIGHE:
+            return self._rispondi(413, {"errore": f"al massimo {MAX_RIGHE} righe per richiesta"})
+
+        mediana_eta = richiesta.get("mediana_eta")
+        try:
+            risultato = scoring.scora_blocco(df, float("nan") if mediana_eta is None else mediana_eta)
+        except (KeyError, ValueError) as errore:
+            return self._rispondi(400, {"errore": str(errore)})
+        colonne = list(risultato.columns)
+        # tolist per colonna: valori Python (int/float) serializzabili in JSON
+        righe = list(zip(*(risultato[colonna].tolist() for colonna in colonne)))
+        self._rispondi(200, {"colonne": colonne, "righe": righe})
+
+    def log_message(self, formato, *args):
+        logger.debug("%s " + formato, self.address_string(), *args)
+
+
+def crea_server(host, porta, model_path, survival_dir):
+    """Carica i modelli una volta e ritorna il server HTTP (da avviare con serve_forever)."""
+    scoring.carica_modelli(model_path, survival_dir)
+    server = ThreadingHTTPServer((host, porta), _Gestore)
+    server.daemon_threads = True
+    server.modelli = {"modello": str(model_path), "survival_dir": str(survival_dir)}
+    return server
+
+
+class Scoratore:
+    """
+    Scoring con la stessa interfaccia di scoring.scora_blocco. Usa il server dei
+    modelli se risponde all'URL indicato, altrimenti carica i modelli nel processo
+    (una volta sola) e scora in locale.
+    """
+
+    def __init__(self, url, model_path, survival_dir, timeout=30):
+        self.url = url.rstrip("/") if url else None
+        self.model_path = model_path
+        self.survival_dir = survival_dir
+        self.timeout = timeout
+        self.remoto = self.url is not None and self._server_pronto()
+        if not self.remoto:
+            scoring.carica_modelli(model_path, survival_dir)
+
+    def _server_pronto(self):
+        try:
+            with urlopen(f"{self.url}/stato", timeout=2) as risposta:
+                return json.load(risposta).get("pronto", False)
+        except (URLError, OSError, ValueError):
+            return False
+
+    def _scora_remoto(self, df, mediana_eta):
+        corpo = json.dumps({
+            "mediana_eta": None if pd.isna(mediana_eta) else float(mediana_eta),
+            "righe": _in_json(df),
+        }).encode()
+        richiesta = Request(f"{self.url}/scora", data=corpo, headers={"Content-Type": "application/json"})
+        with urlopen(richiesta, timeout=self.timeout) as risposta:
+            dati = json.load(risposta)
+        return pd.DataFrame(dati["righe"], columns=dati["colonne"])
+
+    def __call__(self, df, mediana_eta):
+        if self.remoto:
+            try:
+                return pd.concat(
+                    [self._scora_remoto(df.iloc[i:i + MAX_RIGHE], mediana_eta) for i in range(0, len(df), MAX_RIGHE)]
+                    or [self._scora_remoto(df, mediana_eta)],
+                    ignore_index=True,
+                ).sort_values("risk_score", ascending=False)
+            except HTTPError:
+                # il server risponde ma rifiuta i dati: riprovare in locale non cambierebbe l'esito
+                raise
+            except (URLError, OSError) as errore:
+                # server caduto: da qui in poi si scora nel processo
+                logger.warning("Server dei modelli non raggiungibile (%s): carico i modelli in locale", errore)
+                scoring.carica_modelli(self.model_path, self.survival_dir)
+                self.remoto = False
+        return scoring.scora_blocco(df, mediana_eta)
@@ -0,0 +1,118 @@
+"""
+Modello di sopravvivenza XGBoost AFT: giorni stimati al guasto e giorni residui.
+
+Stessa logica di "macchine learning/preditcc_lampioni_survival.py", che ora
+importa da qui, così lo script e score_model non possono divergere.
+"""
+
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+# Limiti "di sicurezza" per evitare numeri fuori scala (regola business)
+MAX_YEARS = 5
+MAX_DAYS = 365 * MAX_YEARS
+
+NUMERIC_COLS = ["arm_altezza", "arm_lmp_potenza_nominale", "giorni_osservati_finora"]
+
+# Obiettivi per cui Booster.predict restituisce già un tempo (AFT: exp del margine);
+# con gli altri (es. regressione su log(giorni)) la predizione è un log-tempo
+OBIETTIVI_TEMPO = {"survival:aft"}
+
+
+def load_artifacts(model_dir):
+    preprocessor_path = os.path.join(model_dir, "preprocessor.joblib")
+    model_path = os.path.join(model_dir, "xgb_aft.json")
+    meta_path = os.path.join(model_dir, "meta.json")
+
+    for p in [preprocessor_path, model_path, meta_path]:
+        if not os.path.exists(p):
+            raise FileNotFoundError(f"File mancante: {p}")
+
+    preprocessor = joblib.load(preprocessor_path)
+
+    booster = xgb.Booster()
+    booster.load_model(model_path)
+
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    feature_cols = meta.get("feature_cols")
+    if not feature_cols:
+        raise ValueError("meta.json non contiene 'feature_cols'")
+
+    return preprocessor, booster, feature_cols
+
+
+def prepare_features(df: pd.DataFrame, feature_cols):
+    """
+    - Verifica colonne
+    - Converte numeriche a float (NaN gestito)
+    - tmo_id resta categorica (object)
+    - Converte pd.NA -> np.nan per compatibilità sklearn
+    """
+    missing = [c for c in feature_cols if c not in df.columns]
+    if missing:
+        raise ValueError(f"Mancano colonne richieste: {missing}")
+
+    X = df[feature_cols].copy()
+
+    # pd.NA -> np.nan (evita errore boolean value of NA is ambiguous)
+    X = X.replace({pd.NA: np.nan})
+
+    # Numeriche: float
+    for c in NUMERIC_COLS:
+        X[c] = pd.to_numeric(X[c], errors="coerce").astype(float)
+
+    # tmo_id: categorica (object). NON usare dtype pandas "string"
+    X["tmo_id"] = X["tmo_id"].astype(object)
+
+    # warning per osservati <= 0
+    bad_obs = X["giorni_osservati_finora"].isna() | (X["giorni_osservati_finora"] <= 0)
+    return X, int(bad_obs.sum())
+
+
+def predice_tempo(booster: xgb.Booster) -> bool:
+    """True se il booster predice giorni, False se predice log(giorni): dipende solo dall'obiettivo."""
+    return json.loads(booster.save_config())["learner"]["objective"]["name"] in OBIETTIVI_TEMPO
+
+
+def predict_days(booster: xgb.Booster, X_transformed):
+    """
+    Giorni al guasto, con un cap MAX_DAYS per evitare valori assurdi in output.
+    La scala (giorni o log-giorni) è decisa dall'obiettivo del modello, non dai
+    valori predetti: lo stesso lampione ha la stessa stima da solo o in un blocco
+    (score_incrementale scora pochi lampioni alla volta).
+    Ritorna (giorni, predizione grezza, mediana della predizione grezza).
+    """
+    dmat = xgb.DMatrix(X_transformed)
+    pred_raw = booster.predict(dmat)
+    med = float(np.median(pred_raw)) if len(pred_raw) else 0.0
+
+    if predice_tempo(booster):
+        pred_days = pred_raw
+    else:
+        # interpretazione: log(giorni)
+        pred_days = np.exp(np.clip(pred_raw, -20, 20))  # exp(20)~4.85e8
+
+    # cap fisso business per output
+    pred_days = np.clip(pred_days, 0, MAX_DAYS)
+
+    return pred_days, pred_raw, med
+
+
+def predict_residual_days(preprocessor, booster, feature_cols, df: pd.DataFrame):
+    """
+    Giorni al guasto e giorni residui (al guasto meno giorni già osservati, minimo 0)
+    per ogni riga di `df`. Ritorna (pred_giorni_al_guasto, pred_giorni_residui, righe con osservati <= 0).
+    """
+    X, bad_obs = prepare_features(df, feature_cols)
+    pred_days, _, _ = predict_days(booster, preprocessor.transform(X))
+
+    obs = X["giorni_osservati_finora"].to_numpy()
+    residui = np.clip(pred_days - obs, 0, None)
+    return pred_days, residui, bad_obs
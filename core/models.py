@@ -1,5 +1,7 @@
 from django.db import models
 
+from .soglie import SOGLIA_ATTENZIONE, SOGLIA_CRITICO
+
 # Create your models here.
 class LampioneBase(models.Model):
     arm_id = models.IntegerField(db_index=True)
@@ -34,16 +36,108 @@ class LampioneNuovo(LampioneBase):
     traQuantoSiRompe = models.IntegerField(null=True, blank=True)
     risk_score= models.FloatField(null=True, blank=True)
     risk_score_date= models.DateTimeField(null=True, blank=True)
-    pass
+
+    # Indici per i filtri/ordinamenti delle viste (verificabili con manage.py spiega_query)
+    class Meta:
+        indexes = [
+            # index, dashboard e dettaglio_rischio (filtro e ordinamento per fascia)
+            models.Index(fields=['risk_score'], name='nuovo_risk_score'),
+            # ordinamenti alternativi di dettaglio_rischio
+            models.Index(fields=['risk_score_date'], name='nuovo_risk_score_date'),
+            models.Index(fields=['traQuantoSiRompe'], name='nuovo_traquantosirompe'),
+            # lampioni del viewport della mappa
+            models.Index(fields=['latitudine', 'longitudine'], name='nuovo_lat_lon'),
+        ]
 
 class Segnalazioni(models.Model):
     arm_id = models.IntegerField(db_index=True)
     note = models.CharField(max_length=255, null=True, blank=True)
     problema = models.CharField(max_length=255, null=True, blank=True)
     datetime= models.DateTimeField(null=True, blank=True)
+    # assegnato dalla coda write-behind (core.segnalazioni): rende idempotente la riscrittura del journal
+    id_richiesta = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # segnalazioni di un lampione, dalla più recente
+            models.Index(fields=['arm_id', 'datetime'], name='segnalazioni_arm_data'),
+        ]
 
 # Tabella per lampioni_con_manutenzione.csv
 class LampioneManutenzione(LampioneBase):
     latitudine = models.FloatField(null=True, blank=True)
     longitudine = models.FloatField(null=True, blank=True)
-    pass
\ No newline at end of file
+
+    class Meta:
+        indexes = [
+            # dettaglio_guasto e dettaglio_intervento: filtro per categoria, ordinamento per data
+            models.Index(fields=['tcs_descr', 'sgn_data_inserimento'], name='manut_categoria_data'),
+            models.Index(fields=['tci_descr', 'sgn_data_inserimento'], name='manut_intervento_data'),
+            # storico di un lampione, dal guasto più recente
+            models.Index(fields=['arm_id', 'sgn_data_inserimento'], name='manut_arm_data'),
+            # ricalcolo di DistribuzioneGuasti (coprente: non serve leggere la tabella)
+            models.Index(fields=['arm_lmp_potenza_nominale', 'arm_altezza', 'tcs_descr'], name='manut_potenza_altezza'),
+        ]
+
+
+# Indice spaziale gerarchico della mappa: una riga per ogni cella della
+# griglia di ciascun livello di zoom, con i conteggi per fascia di rischio.
+# Viene mantenuto da core.spatial (mai scritto direttamente dalle viste).
+class CellaMappa(models.Model):
+    livello = models.IntegerField()
+    cx = models.IntegerField()
+    cy = models.IntegerField()
+    n = models.IntegerField(default=0)
+    critico = models.IntegerField(default=0)
+    attenzione = models.IntegerField(default=0)
+    ottimo = models.IntegerField(default=0)
+    sconosciuto = models.IntegerField(default=0)
+    # somme delle coordinate: il baricentro del cluster è somma / n
+    lat_somma = models.FloatField(default=0)
+    lon_somma = models.FloatField(default=0)
+    # pk del lampione quando la cella ne contiene uno solo
+    lampione_id = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['livello', 'cx', 'cy'], name='cella_mappa_unica'),
+        ]
+
+
+# Distribuzione delle categorie di guasto (tcs_descr) dello storico manutenzioni,
+# per combinazione potenza/altezza e per l'intera città (citta=True, potenza e altezza nulle).
+# Viene ricalcolata da core.aggregates dopo ogni import dello storico.
+class DistribuzioneGuasti(models.Model):
+    citta = models.BooleanField(default=False)
+    arm_lmp_potenza_nominale = models.FloatField(null=True, blank=True)
+    arm_altezza = models.FloatField(null=True, blank=True)
+    tcs_descr = models.CharField(max_length=255)
+    n_eventi = models.IntegerField()
+    prob_guasto = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['citta', 'arm_lmp_potenza_nominale', 'arm_altezza'], name='distribuzione_guasti_combo'),
+        ]
+
+
+# Riepilogo dello storico manutenzioni di ogni lampione (una riga per arm_id):
+# le schede leggono questa riga invece di scorrere tutto lo storico.
+# Mantenuta da core.aggregates dagli import dello storico (solo gli arm_id toccati).
+class RiepilogoAsset(models.Model):
+    arm_id = models.IntegerField(unique=True)
+    n_eventi = models.IntegerField(default=0)
+    primo_guasto = models.DateTimeField(null=True, blank=True)
+    ultimo_guasto = models.DateTimeField(null=True, blank=True)
+    # giorni medi fra due guasti consecutivi (nullo con meno di due guasti datati)
+    mtbf_giorni = models.FloatField(null=True, blank=True)
+    tcs_descr_frequente = models.CharField(max_length=255, null=True, blank=True)
+    tci_descr_frequente = models.CharField(max_length=255, null=True, blank=True)
+
+
+# Valori condivisi fra il sito e i comandi di gestione (processi diversi), es. la
+# versione dei dati che fa da prefisso alle chiavi di cache: i comandi che
+# modificano le tabelle la incrementano e le voci vecchie non vengono più lette.
+class StatoSistema(models.Model):
+    chiave = models.CharField(max_length=64, primary_key=True)
+    valore = models.BigIntegerField(default=0)
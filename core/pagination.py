@@ -0,0 +1,200 @@
+"""
+Paginazione keyset (seek) per le liste lunghe.
+
+Invece di COUNT(*) + OFFSET a ogni pagina, la pagina successiva parte dal
+cursore (valore della colonna di ordinamento, id) dell'ultima riga mostrata:
+con l'indice sulla colonna la pagina N costa quanto la pagina 1.
+
+I NULL della colonna di ordinamento valgono come il valore più piccolo
+(come l'ordinamento di SQLite): in ordine crescente vengono per primi, in
+decrescente per ultimi. Per restare seekable le righe con valore e quelle
+NULL sono lette con due query separate invece che con un OR.
+"""
+
+import asyncio
+import base64
+import datetime
+import hashlib
+import json
+import math
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+from .cache import ain_cache, in_cache
+
+PER_PAGINA = 50
+# Il totale serve solo per "Pag. N di M": lo teniamo in cache (per versione dei dati)
+# per non rifare COUNT(*) a ogni pagina
+DURATA_CACHE_TOTALE = 300
+
+
+def codifica_cursore(valore, pk):
+    # date e orari con isoformat: DjangoJSONEncoder tronca ai millisecondi e il
+    # confronto del seek non troverebbe più le righe con lo stesso istante
+    if isinstance(valore, (datetime.date, datetime.time)):
+        valore = valore.isoformat()
+    testo = json.dumps([valore, pk], cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(testo.encode()).decode().rstrip('=')
+
+
+def decodifica_cursore(field, cursore):
+    """(valore, pk) dal cursore dell'URL, oppure None se non è valido."""
+    try:
+        testo = base64.urlsafe_b64decode(cursore + '=' * (-len(cursore) % 4)).decode()
+        valore, pk = json.loads(testo)
+        return (None if valore is None else field.to_python(valore)), int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError, json.JSONDecodeError):
+        return None
+    except Exception:
+        # ValidationError di to_python
+        return None
+
+
+def _chiave_totale(queryset):
+    sql, parametri = queryset.query.sql_with_params()
+    return 'conteggio:' + hashlib.blake2b(f'{sql}{parametri!r}'.encode(), digest_size=16).hexdigest()
+
+
+def totale_in_cache(queryset):
+    return in_cache(_chiave_totale(queryset), queryset.count, DURATA_CACHE_TOTALE)
+
+
+async def atotale_in_cache(queryset):
+    return await ain_cache(_chiave_totale(queryset), queryset.acount, DURATA_CACHE_TOTALE)
+
+
+class PaginaKeyset:
+    """Una pagina di risultati: iterabile come la Page di Django, con i cursori per muoversi."""
+
+    def __init__(self, oggetti, numero, totale, per_pagina, campo, ha_precedente, ha_successiva):
+        self.object_list = oggetti
+        self.number = numero
+        self.count = totale
+        self.num_pages = max(1, math.ceil(totale / per_pagina))
+        self.has_previous = ha_precedente
+        self.has_next = ha_successiva
+        self.cursore_precedente = codifica_cursore(getattr(oggetti[0], campo), oggetti[0].pk) if oggetti else ''
+        self.cursore_successivo = codifica_cursore(getattr(oggetti[-1], campo), oggetti[-1].pk) if oggetti else ''
+
+    def previous_page_number(self):
+        return max(1, self.number - 1)
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def ordina(queryset, campo, crescente):
+    if crescente:
+        return queryset.order_by(F(campo).asc(nulls_first=True), 'pk')
+    return queryset.order_by(F(campo).desc(nulls_last=True), '-pk')
+
+
+def query_seek(queryset, campo, crescente, cursore=None):
+    """
+    Queryset ordinati da leggere in sequenza per le righe che seguono il cursore
+    (None = dall'inizio). Ciascuno parte con un range sull'indice della colonna.
+    """
+    con_valore = queryset.filter(**{f'{campo}__isnull': False})
+    nulli = queryset.filter(**{f'{campo}__isnull': True})
+
+    if cursore is None:
+        parti = [nulli, con_valore] if crescente else [con_valore, nulli]
+    else:
+        valore, pk = cursore
+        if valore is None:
+            # dentro il blocco dei NULL conta solo l'id
+            pk_dopo = Q(pk__gt=pk) if crescente else Q(pk__lt=pk)
+            parti = [nulli.filter(pk_dopo), con_valore] if crescente else [nulli.filter(pk_dopo)]
+        elif crescente:
+            # campo >= valore (seek sull'indice) e poi il confronto fine su (valore, id)
+            parti = [con_valore.filter(**{f'{campo}__gte': valore}).exclude(**{campo: valore, 'pk__lte': pk})]
+        else:
+            parti = [con_valore.filter(**{f'{campo}__lte': valore}).exclude(**{campo: valore, 'pk__gte': pk}), nulli]
+    return [ordina(parte, campo, crescente) for parte in parti]
+
+
+def _dopo(queryset, campo, crescente, cursore, limite):
+    """Le prime `limite` righe che seguono il cursore nell'ordinamento."""
+    righe = []
+    for parte in query_seek(queryset, campo, crescente, cursore):
+        righe.extend(parte[:limite - len(righe)])
+        if len(righe) >= limite:
+            break
+    return righe
+
+
+async def _adopo(queryset, campo, crescente, cursore, limite):
+    righe = []
+    for parte in query_seek(queryset, campo, crescente, cursore):
+        righe.extend([riga async for riga in parte[:limite - len(righe)]])
+        if len(righe) >= limite:
+            break
+    return righe
+
+
+def _lettura(request, queryset, campo, direzione):
+    """
+    Cosa leggere per la pagina richiesta dai parametri GET:
+    - dopo=<cursore>: pagina successiva a quella che finiva col cursore
+    - prima=<cursore>: pagina precedente a quella che iniziava col cursore
+    - ultima=1: ultima pagina
+    - pagina=<n>: solo il numero da mostrare
+    Ritorna (modo, crescente, cursore, numero), con crescente riferito alla lettura.
+    """
+    field = queryset.model._meta.get_field(campo)
+    crescente = direzione == 'asc'
+    try:
+        numero = max(1, int(request.GET.get('pagina', 1)))
+    except ValueError:
+        numero = 1
+
+    if request.GET.get('ultima'):
+        # L'ultima pagina è la prima nell'ordine inverso
+        return 'ultima', not crescente, None, numero
+    prima = decodifica_cursore(field, request.GET['prima']) if request.GET.get('prima') else None
+    if prima is not None:
+        return 'prima', not crescente, prima, numero
+    dopo = decodifica_cursore(field, request.GET['dopo']) if request.GET.get('dopo') else None
+    return 'dopo', crescente, dopo, numero
+
+
+def _componi(modo, cursore, righe, numero, totale, per_pagina, campo):
+    if modo == 'ultima':
+        numero = max(1, math.ceil(totale / per_pagina))
+        return PaginaKeyset(righe[:per_pagina][::-1], numero, totale, per_pagina, campo, len(righe) > per_pagina, False)
+
+    if modo == 'prima':
+        ha_precedente = len(righe) > per_pagina
+        # se si torna oltre l'inizio (es. righe cancellate nel frattempo) si riparte dalla prima pagina
+        if not ha_precedente:
+            numero = 1
+        return PaginaKeyset(righe[:per_pagina][::-1], numero, totale, per_pagina, campo, ha_precedente, True)
+
+    if cursore is None:
+        numero = 1
+    return PaginaKeyset(righe[:per_pagina], numero, totale, per_pagina, campo, cursore is not None, len(righe) > per_pagina)
+
+
+def pagina_keyset(request, queryset, campo, direzione, per_pagina=PER_PAGINA):
+    """La PaginaKeyset richiesta dai parametri GET (vedi _lettura)."""
+    modo, crescente, cursore, numero = _lettura(request, queryset, campo, direzione)
+    totale = totale_in_cache(queryset)
+    righe = _dopo(queryset, campo, crescente, cursore, per_pagina + 1)
+    return _componi(modo, cursore, righe, numero, totale, per_pagina, campo)
+
+
+async def apagina_keyset(request, queryset, campo, direzione, per_pagina=PER_PAGINA):
+    """Come pagina_keyset, per le viste async: totale e righe sono letti insieme."""
+    modo, crescente, cursore, numero = _lettura(request, queryset, campo, direzione)
+    totale, righe = await asyncio.gather(
+        atotale_in_cache(queryset),
+        _adopo(queryset, campo, crescente, cursore, per_pagina + 1),
+    )
+    return _componi(modo, cursore, righe, numero, totale, per_pagina, campo)
@@ -0,0 +1,66 @@
+"""
+Queryset usati dalle viste, raccolti in un posto solo.
+
+Le viste li costruiscono da qui e il comando spiega_query li riusa per
+stampare i piani di esecuzione (EXPLAIN) e accorgersi se una modifica
+riporta una pagina a scansionare l'intera tabella.
+"""
+
+from django.db.models import Count, Q
+
+from .models import LampioneManutenzione, LampioneNuovo, Segnalazioni, SOGLIA_ATTENZIONE, SOGLIA_CRITICO
+
+LIVELLI_RISCHIO = {
+    'critico': ("Rischio Critico (> 70%)", {'risk_score__gt': SOGLIA_CRITICO}),
+    'attenzione': ("In Osservazione (25% - 70%)", {'risk_score__gte': SOGLIA_ATTENZIONE, 'risk_score__lte': SOGLIA_CRITICO}),
+    'ottimo': ("Stato Ottimo (< 25%)", {'risk_score__lt': SOGLIA_ATTENZIONE}),
+}
+
+
+def top_critici(n=5):
+    return LampioneNuovo.objects.filter(risk_score__isnull=False).order_by('-risk_score')[:n]
+
+
+def lampioni_nel_bbox(ovest, sud, est, nord):
+    return LampioneNuovo.objects.filter(
+        latitudine__gte=sud, latitudine__lte=nord,
+        longitudine__gte=ovest, longitudine__lte=est,
+    )
+
+
+def lampioni_per_rischio(livello):
+    """(titolo, queryset) della fascia di rischio; livelli sconosciuti = 'ottimo', come in precedenza."""
+    titolo, filtro = LIVELLI_RISCHIO.get(livello, LIVELLI_RISCHIO['ottimo'])
+    return titolo, LampioneNuovo.objects.filter(**filtro)
+
+
+def _conteggi_fasce():
+    return {livello: Count('pk', filter=Q(**filtro)) for livello, (_, filtro) in LIVELLI_RISCHIO.items()}
+
+
+def conteggi_per_fascia():
+    """Lampioni per fascia di rischio in un solo passaggio sulla tabella: {'critico': n, ...}."""
+    return LampioneNuovo.objects.aggregate(**_conteggi_fasce())
+
+
+async def aconteggi_per_fascia():
+    return await LampioneNuovo.objects.aaggregate(**_conteggi_fasce())
+
+
+def guasti_per_categoria(motivo_guasto):
+    return LampioneManutenzione.objects.filter(tcs_descr=motivo_guasto)
+
+
+def interventi_per_tipo(tipo_intervento):
+    return LampioneManutenzione.objects.filter(tci_descr=tipo_intervento)
+
+
+def storico_lampione(arm_id, escludi_pk=None):
+    storico = LampioneManutenzione.objects.filter(arm_id=arm_id)
+    if escludi_pk is not None:
+        storico = storico.exclude(pk=escludi_pk)
+    return storico.order_by('-sgn_data_inserimento')
+
+
+def segnalazioni_lampione(arm_id):
+    return Segnalazioni.objects.filter(arm_id=arm_id).order_by('-datetime')
@@ -0,0 +1,237 @@
+"""
+Report PDF degli asset (ReportLab).
+
+Il modulo non importa Django: lavora su dizionari con i CAMPI_REPORT del
+lampione (es. un queryset .values()), così i report si possono generare anche
+nei processi di un pool. Stili e stili delle tabelle sono costruiti una volta
+per processo e riusati da tutti i report. Il pool è uno solo per processo web,
+creato alla prima esportazione e condiviso da tutte le richieste.
+"""
+
+import io
+import multiprocessing
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from functools import cache
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .soglie import SOGLIA_ATTENZIONE, SOGLIA_CRITICO
+
+CAMPI_REPORT = [
+    'pk', 'arm_id', 'arm_data_ini', 'arm_altezza', 'arm_lmp_potenza_nominale', 'tpo_descr',
+    'latitudine', 'longitudine', 'risk_score', 'traQuantoSiRompe', 'risk_score_date',
+]
+
+# Il PDF multipagina è costruito da un solo processo e tutto in memoria
+MAX_MULTIPAGINA = 500
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@cache
+def stili():
+    styles = getSampleStyleSheet()
+    return {
+        'titolo': ParagraphStyle(
+            name='TitleStyle', parent=styles['Heading1'],
+            textColor=colors.HexColor('#0f172a'), spaceAfter=20
+        ),
+        'sottotitolo': ParagraphStyle(
+            name='SubTitle', parent=styles['Heading2'],
+            textColor=colors.HexColor('#00f2ff'), spaceAfter=10
+        ),
+        'normale': styles['Normal'],
+        'tabella_tecnici': TableStyle([
+            ('BACKGROUND', (0,0), (0,-1), colors.HexColor('#e2e8f0')),
+            ('TEXTCOLOR', (0,0), (-1,-1), colors.black),
+            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#cbd5e1')),
+            ('PADDING', (0,0), (-1,-1), 8),
+        ]),
+        'tabella_ml': TableStyle([
+            ('BACKGROUND', (0,0), (0,-1), colors.HexColor('#00f2ff')),
+            ('TEXTCOLOR', (0,0), (0,-1), colors.HexColor('#0f172a')),
+            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+            ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#cbd5e1')),
+            ('PADDING', (0,0), (-1,-1), 8),
+        ]),
+    }
+
+
+def eta_in_anni(arm_data_ini):
+    if not arm_data_ini:
+        return 0
+    if not isinstance(arm_data_ini, date):
+        arm_data_ini = datetime.strptime(str(arm_data_ini), '%Y-%m-%d').date()
+    return (datetime.now().date() - arm_data_ini).days // 365
+
+
+def motivazione(lampione):
+    eta_anni = eta_in_anni(lampione['arm_data_ini'])
+    risk_score = lampione['risk_score']
+    potenza = lampione['arm_lmp_potenza_nominale']
+
+    if risk_score is None:
+        return "In attesa della prima elaborazione dati da parte dell'Intelligenza Artificiale."
+    if risk_score > SOGLIA_CRITICO:
+        if eta_anni > 5:
+            return f"Forte usura temporale: l'asset è in funzione da oltre {eta_anni} anni, superando la vita utile media stimata."
+        if potenza and potenza > 70:
+            return f"Stress termico/elettrico: l'elevata potenza ({potenza}W) ha storicamente un alto tasso di guasto per questo modello."
+        return "Il modello ha riscontrato un'alta incidenza di guasti storici per questa specifica combinazione di hardware."
+    if risk_score >= SOGLIA_ATTENZIONE:
+        if eta_anni > 3:
+            return f"L'asset è in servizio da circa {eta_anni} anni. Si consiglia un monitoraggio per normale decadimento fisiologico."
+        return "Rilevata una vulnerabilità statistica media per questa classe di armature, indipendente dall'età."
+    if eta_anni < 2:
+        return "Installazione recente. Bassissima probabilità di usura fisica o guasti a breve termine."
+    return "L'hardware si sta dimostrando estremamente affidabile nel tempo rispetto alla media dell'impianto."
+
+
+def elementi_report(lampione):
+    """Flowable di ReportLab del report di un asset."""
+    s = stili()
+    testo_normale = s['normale']
+    elements = []
+
+    elements.append(Paragraph("Report Tecnico di Manutenzione Predittiva", s['titolo']))
+    elements.append(Paragraph(f"<b>ID Asset:</b> #{lampione['arm_id']}", testo_normale))
+    elements.append(Paragraph(f"<b>Data Estrazione:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}", testo_normale))
+    elements.append(Spacer(1, 20))
+
+    lat, lon = lampione['latitudine'], lampione['longitudine']
+    if lat and lon:
+        gmaps_url = f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
+        testo_coords = f"Apri in Google Maps ({lat}, {lon})"
+    else:
+        gmaps_url = None
+        testo_coords = "Coordinate non disponibili"
+
+    elements.append(Paragraph("Specifiche Hardware", s['sottotitolo']))
+    data_tecnici = [
+        ['Altezza Armatura', f"{lampione['arm_altezza']} m" if lampione['arm_altezza'] else "N/D"],
+        ['Potenza Nominale', f"{lampione['arm_lmp_potenza_nominale']} W" if lampione['arm_lmp_potenza_nominale'] else "N/D"],
+        ['Modello/Tipologia', f"{lampione['tpo_descr']}" if lampione['tpo_descr'] else "N/D"],
+        ['Geolocalizzazione', Paragraph(f'<a href="{gmaps_url}" color="blue">{testo_coords}</a>', testo_normale)]
+    ]
+    t = Table(data_tecnici, colWidths=[150, 300])
+    t.setStyle(s['tabella_tecnici'])
+    elements.append(t)
+    elements.append(Spacer(1, 20))
+
+    elements.append(Paragraph("Analisi Predittiva (Machine Learning)", s['sottotitolo']))
+    risk_perc = f"{round(lampione['risk_score'] * 100)}%" if lampione['risk_score'] else "N/D"
+    giorni = lampione['traQuantoSiRompe']
+
+    data_ml = [
+        ['Rischio Sostituzione (60gg)', risk_perc],
+        ['Giorni Stimati alla Rottura', f"{giorni} gg" if giorni is not None else "N/D"]
+    ]
+    t2 = Table(data_ml, colWidths=[200, 250])
+    t2.setStyle(s['tabella_ml'])
+    elements.append(t2)
+    elements.append(Spacer(1, 15))
+
+    elements.append(Paragraph("<b>Logica Decisionale (Explainable AI):</b>", testo_normale))
+    elements.append(Spacer(1, 5))
+    elements.append(Paragraph(motivazione(lampione), testo_normale))
+    return elements
+
+
+def pdf_asset(lampione):
+    """Il PDF di un asset, in bytes."""
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=letter).build(elementi_report(lampione))
+    return buffer.getvalue()
+
+
+def pdf_multipagina(lampioni):
+    """Un solo PDF con una pagina per asset (costruito in un unico processo)."""
+    elements = []
+    for lampione in lampioni:
+        if elements:
+            elements.append(PageBreak())
+        elements.extend(elementi_report(lampione))
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=letter).build(elements)
+    return buffer.getvalue()
+
+
+def _pdf_con_nome(lampione):
+    return f"Report_Asset_{lampione['arm_id']}.pdf", pdf_asset(lampione)
+
+
+def pool_report(workers):
+    """
+    Il pool dei report, creato alla prima richiesta con workers processi e poi
+    riusato da tutte le esportazioni. I processi partono con spawn: il processo
+    web ha già dei thread attivi (es. lo svuotamento del giornale delle variazioni).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _pdf_in_ordine(lampioni, workers):
+    """(nome file, pdf) nell'ordine dei lampioni; con più worker al massimo 2 report in volo per processo."""
+    if workers <= 1:
+        for lampione in lampioni:
+            yield _pdf_con_nome(lampione)
+        return
+
+    pool = pool_report(workers)
+    in_volo = deque()
+    try:
+        for lampione in lampioni:
+            in_volo.append(pool.submit(_pdf_con_nome, lampione))
+            if len(in_volo) >= 2 * workers:
+                yield in_volo.popleft().result()
+        while in_volo:
+            yield in_volo.popleft().result()
+    finally:
+        # download interrotto: i report non ancora iniziati non occupano il pool
+        for futuro in in_volo:
+            futuro.cancel()
+
+
+class _Flusso(io.RawIOBase):
+    """File in sola scrittura e senza seek: zipfile ci scrive, il generatore svuota."""
+
+    def __init__(self):
+        self.blocchi = []
+
+    def writable(self):
+        return True
+
+    def write(self, dati):
+        self.blocchi.append(bytes(dati))
+        return len(dati)
+
+    def svuota(self):
+        dati = b''.join(self.blocchi)
+        self.blocchi.clear()
+        return dati
+
+
+def zip_report(lampioni, workers=1):
+    """
+    Genera a pezzi uno zip con un PDF per lampione: ogni pezzo si può inviare
+    subito (StreamingHttpResponse), senza tenere in memoria l'archivio intero.
+    """
+    flusso = _Flusso()
+    with zipfile.ZipFile(flusso, 'w', zipfile.ZIP_DEFLATED) as archivio:
+        for nome, pdf in _pdf_in_ordine(lampioni, workers):
+            archivio.writestr(nome, pdf)
+            yield flusso.svuota()
+    yield flusso.svuota()
@@ -0,0 +1,122 @@
+"""
+Riscoring incrementale dei lampioni toccati da nuovi dati dal campo.
+
+Invece di riscorare tutta l'anagrafica, si ricalcolano rischio e giorni
+residui solo per gli arm_id che hanno ricevuto qualcosa dopo l'ultimo giro:
+- nuove Segnalazioni;
+- nuovi eventi in LampioneManutenzione;
+- lampioni di LampioneNuovo mai scorati (risk_score nullo).
+
+Le segnalazioni e gli eventi già visti sono segnati da una watermark per
+tabella in StatoSistema (il pk più alto elaborato). La watermark avanza solo
+dopo la scrittura dei punteggi: se il processo si ferma a metà, il giro
+successivo riscora gli stessi lampioni (l'aggiornamento è idempotente).
+
+Le feature sono le stesse di score_model, lette dal database invece che dal
+CSV dell'anagrafica. Lo scoring è quello di scora_blocco, nel processo oppure
+attraverso il server dei modelli (core.ml.servizio.Scoratore).
+"""
+
+import logging
+
+import pandas as pd
+from django.db.models import Max
+from django.utils import timezone
+
+from .bulk import aggiorna_da_stage
+from .cache import incrementa_versione_dati
+from .ml.scoring import CAMPI_PUNTEGGIO, eta_in_giorni, scora_blocco, tabella_punteggi
+from .models import LampioneManutenzione, LampioneNuovo, Segnalazioni, StatoSistema
+from .spatial import traccia_variazioni
+
+logger = logging.getLogger(__name__)
+
+# Tabelle i cui nuovi record rendono da riscorare il loro arm_id
+SORGENTI = {
+    'watermark:segnalazioni': Segnalazioni,
+    'watermark:manutenzioni': LampioneManutenzione,
+}
+CAMPI_FEATURE = ['arm_id', 'arm_data_ini', 'arm_altezza', 'arm_lmp_potenza_nominale', 'tmo_id']
+MICRO_BATCH = 500
+
+
+def leggi_watermark(chiave):
+    return StatoSistema.objects.filter(chiave=chiave).values_list('valore', flat=True).first() or 0
+
+
+def scrivi_watermark(chiave, valore):
+    StatoSistema.objects.update_or_create(chiave=chiave, defaults={'valore': valore})
+
+
+def allinea_watermark():
+    """Dopo uno scoring completo: tutto quello che c'è nelle tabelle è già stato considerato."""
+    for chiave, model in SORGENTI.items():
+        scrivi_watermark(chiave, model.objects.aggregate(m=Max('pk'))['m'] or 0)
+
+
+def arm_id_toccati():
+    """
+    arm_id da riscorare e, per ogni sorgente, la watermark da salvare dopo la scrittura.
+    Il massimo pk è letto prima degli arm_id: i record arrivati nel frattempo restano al giro dopo.
+    """
+    arm_ids, nuove_watermark = set(), {}
+    for chiave, model in SORGENTI.items():
+        da = leggi_watermark(chiave)
+        fino_a = model.objects.aggregate(m=Max('pk'))['m'] or 0
+        if fino_a < da:
+            # tabella svuotata e ricaricata (pk ripartiti): serve uno score_model completo
+            logger.warning("%s: pk massimo %d sotto la watermark %d, la riallineo", chiave, fino_a, da)
+        elif fino_a > da:
+            arm_ids.update(
+                model.objects.filter(pk__gt=da, pk__lte=fino_a).values_list('arm_id', flat=True).distinct()
+            )
+        nuove_watermark[chiave] = fino_a
+
+    arm_ids.update(LampioneNuovo.objects.filter(risk_score__isnull=True).values_list('arm_id', flat=True).distinct())
+    return sorted(arm_ids), nuove_watermark
+
+
+def mediana_eta_anagrafica():
+    """Mediana dell'età dell'anagrafica nel database (riempie le date mancanti come in score_model)."""
+    date = pd.to_datetime(
+        pd.Series(LampioneNuovo.objects.exclude(arm_data_ini__isnull=True).values_list('arm_data_ini', flat=True)),
+        errors='coerce',
+    )
+    return eta_in_giorni(date).median() if len(date) else float('nan')
+
+
+def feature_lampioni(arm_ids):
+    df = pd.DataFrame.from_records(
+        list(LampioneNuovo.objects.filter(arm_id__in=arm_ids).values(*CAMPI_FEATURE)), columns=CAMPI_FEATURE
+    )
+    df['arm_data_ini'] = pd.to_datetime(df['arm_data_ini'], errors='coerce')
+    return df
+
+
+def riscora(arm_ids, mediana_eta, giorni_per_fascia, micro_batch=MICRO_BATCH, scora=scora_blocco):
+    """
+    Riscora gli arm_id a micro-batch (un UPDATE ... FROM ciascuno) aggiornando
+    l'indice della mappa solo per le righe toccate. Ritorna le righe aggiornate.
+    """
+    aggiornate = 0
+    for inizio in range(0, len(arm_ids), micro_batch):
+        blocco = arm_ids[inizio:inizio + micro_batch]
+        df = feature_lampioni(blocco)
+        if df.empty:
+            continue
+        stage = tabella_punteggi(scora(df, mediana_eta), giorni_per_fascia, timezone.now())
+        with traccia_variazioni(LampioneNuovo.objects.filter(arm_id__in=blocco)):
+            aggiornate += aggiorna_da_stage(LampioneNuovo, stage, 'arm_id', CAMPI_PUNTEGGIO)
+    return aggiornate
+
+
+def giro(mediana_eta, giorni_per_fascia, micro_batch=MICRO_BATCH, scora=scora_blocco):
+    """Un passaggio completo: arm_id toccati, riscoring, watermark. Ritorna (arm_id, righe aggiornate)."""
+    arm_ids, nuove_watermark = arm_id_toccati()
+    aggiornate = riscora(arm_ids, mediana_eta, giorni_per_fascia, micro_batch, scora) if arm_ids else 0
+    for chiave, valore in nuove_watermark.items():
+        scrivi_watermark(chiave, valore)
+    if aggiornate:
+        # dashboard, conteggi per fascia e schede in cache non valgono più
+        incrementa_versione_dati()
+    return len(arm_ids), aggiornate
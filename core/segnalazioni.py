@@ -0,0 +1,226 @@
+"""
+Coda write-behind delle segnalazioni dal campo.
+
+Le segnalazioni accettate dall'API vengono aggiunte a un journal su disco
+(un file JSON lines per processo) e confermate al client; un thread del
+processo le scrive poi nel database a blocchi con bulk_create.
+
+Semantica:
+- una segnalazione confermata (risposta 202) è già sul disco (flush + fsync):
+  se il processo muore prima della scrittura sul DB resta nel journal;
+- ogni segnalazione ha un id_richiesta (UUID) univoco e i blocchi sono inseriti
+  con ignore_conflicts: rileggere un journal già scritto non crea doppioni,
+  quindi la consegna è almeno una volta sul disco ed esattamente una nel DB;
+- sul sito compaiono con un ritardo di circa INTERVALLO_FLUSH secondi.
+
+Journal:
+- attivo-<pid>.jsonl: il file in cui scrive il processo <pid>;
+- pronto-<pid>-<n>.jsonl: file chiusi in attesa di scrittura, cancellati
+  dopo il commit. Il thread di qualunque processo li scrive, anche quelli
+  rimasti da un processo terminato.
+Gli attivo-*.jsonl di processi morti si recuperano con il comando
+scarica_segnalazioni --anche-attivi, a sito fermo.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import invalida_vista
+from .models import LampioneNuovo, Segnalazioni
+
+logger = logging.getLogger(__name__)
+
+INTERVALLO_FLUSH = 1.0
+BATCH_SIZE = 2000
+# Gli arm_id di una richiesta sono verificati con un solo IN (...): limite ai parametri della query
+MAX_PER_RICHIESTA = 5000
+
+
+def cartella_coda():
+    cartella = Path(getattr(settings, 'SEGNALAZIONI_CODA_DIR', settings.BASE_DIR / 'coda_segnalazioni'))
+    cartella.mkdir(parents=True, exist_ok=True)
+    return cartella
+
+
+class CodaSegnalazioni:
+    """Journal del processo corrente più il thread che lo scarica nel database."""
+
+    def __init__(self, cartella):
+        self.cartella = Path(cartella)
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.in_coda = 0
+        self.rotazioni = 0
+        self.sveglia = threading.Event()
+        self.thread = None
+
+    @property
+    def attivo(self):
+        return self.cartella / f"attivo-{self.pid}.jsonl"
+
+    def accoda(self, segnalazioni):
+        """Aggiunge al journal i dizionari già validati; ritorna quando sono su disco."""
+        righe = "".join(json.dumps(s, ensure_ascii=False) + "\n" for s in segnalazioni)
+        with self.lock:
+            with open(self.attivo, "a", encoding="utf-8") as f:
+                f.write(righe)
+                f.flush()
+                os.fsync(f.fileno())
+            self.in_coda += len(segnalazioni)
+            pieno = self.in_coda >= BATCH_SIZE
+        self.avvia()
+        if pieno:
+            self.sveglia.set()
+
+    def avvia(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._ciclo, name="flusher-segnalazioni", daemon=True)
+                    self.thread.start()
+                    atexit.register(self.scarica)
+
+    def _ciclo(self):
+        while True:
+            self.sveglia.wait(INTERVALLO_FLUSH)
+            self.sveglia.clear()
+            try:
+                self.scarica()
+            except Exception:
+                # il journal resta su disco: si riprova al giro successivo
+                logger.exception("Scrittura delle segnalazioni in coda fallita")
+            finally:
+                close_old_connections()
+
+    def ruota(self):
+        """Chiude il file attivo rinominandolo in pronto-*: da qui in poi nessuno ci scrive più."""
+        with self.lock:
+            if not self.attivo.exists():
+                return
+            self.rotazioni += 1
+            os.replace(self.attivo, self.cartella / f"pronto-{self.pid}-{self.rotazioni}.jsonl")
+            self.in_coda = 0
+
+    def scarica(self):
+        """Ruota il journal e scrive nel DB tutti i file pronti. Ritorna le segnalazioni inserite."""
+        self.ruota()
+        return scarica_file(sorted(self.cartella.glob("pronto-*.jsonl")))
+
+
+def _leggi(percorso):
+    with open(percorso, encoding="utf-8") as f:
+        for riga in f:
+            riga = riga.strip()
+            if riga:
+                # una riga troncata può esistere solo in coda a un file di un processo morto
+                try:
+                    yield json.loads(riga)
+                except json.JSONDecodeError:
+                    logger.warning("Riga non valida ignorata in %s", percorso.name)
+
+
+def scarica_file(percorsi):
+    totale = 0
+    for percorso in percorsi:
+        try:
+            dati = list(_leggi(percorso))
+        except FileNotFoundError:
+            # già scritto da un altro processo
+            continue
+        oggetti = [
+            Segnalazioni(
+                id_richiesta=d["id_richiesta"], arm_id=d["arm_id"], problema=d.get("problema"),
+                note=d.get("note"), datetime=parse_datetime(d["datetime"]),
+            )
+            for d in dati
+        ]
+        with transaction.atomic():
+            Segnalazioni.objects.bulk_create(oggetti, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        percorso.unlink(missing_ok=True)
+        totale += len(oggetti)
+        _invalida_schede({d["arm_id"] for d in dati})
+        logger.info("Scritte %d segnalazioni da %s", len(oggetti), percorso.name)
+    return totale
+
+
+def _invalida_schede(arm_ids):
+    # solo le schede degli asset coinvolti, non l'intera cache
+    for pk in LampioneNuovo.objects.filter(arm_id__in=arm_ids).values_list("pk", flat=True):
+        invalida_vista('dettaglio_asset', reverse('dettaglio_asset', args=[pk]))
+
+
+def _testo(valore):
+    # stessi limiti dei CharField del modello
+    return str(valore)[:255] if valore else None
+
+
+def valida(elementi):
+    """
+    Controlla un array JSON di segnalazioni {arm_id, problema, note, datetime?}.
+    Gli arm_id sono verificati con una sola query. Ritorna (valide, errori) dove
+    errori è una lista di {"indice", "errore"}.
+    """
+    valide, errori, arm_ids = [], [], set()
+    for indice, elemento in enumerate(elementi):
+        if not isinstance(elemento, dict):
+            errori.append({"indice": indice, "errore": "non è un oggetto"})
+            continue
+        try:
+            arm_id = int(elemento.get("arm_id"))
+        except (TypeError, ValueError):
+            errori.append({"indice": indice, "errore": "arm_id mancante o non numerico"})
+            continue
+        if elemento.get("datetime"):
+            try:
+                quando = parse_datetime(str(elemento["datetime"]))
+            except ValueError:
+                quando = None
+            if quando is None:
+                errori.append({"indice": indice, "errore": "datetime non valida"})
+                continue
+            if timezone.is_naive(quando):
+                quando = timezone.make_aware(quando)
+        else:
+            quando = timezone.now()
+        valide.append((indice, {
+            "id_richiesta": str(uuid.uuid4()),
+            "arm_id": arm_id,
+            "problema": _testo(elemento.get("problema")),
+            "note": _testo(elemento.get("note")),
+            "datetime": quando.isoformat(),
+        }))
+        arm_ids.add(arm_id)
+
+    esistenti = set(LampioneNuovo.objects.filter(arm_id__in=arm_ids).values_list("arm_id", flat=True))
+    risultato = []
+    for indice, segnalazione in valide:
+        if segnalazione["arm_id"] in esistenti:
+            risultato.append(segnalazione)
+        else:
+            errori.append({"indice": indice, "errore": f"arm_id {segnalazione['arm_id']} inesistente"})
+    errori.sort(key=lambda e: e["indice"])
+    return risultato, errori
+
+
+_coda = None
+_lock_coda = threading.Lock()
+
+
+def coda():
+    """La coda del processo corrente (ricreata dopo un fork, perché il pid cambia)."""
+    global _coda
+    with _lock_coda:
+        if _coda is None or _coda.pid != os.getpid():
+            _coda = CodaSegnalazioni(cartella_coda())
+        return _coda
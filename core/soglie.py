@@ -0,0 +1,4 @@
+# Soglie delle fasce di rischio (le stesse di mappa, dashboard, liste e report).
+# Modulo senza Django: lo importano anche i processi del pool dei report.
+SOGLIA_CRITICO = 0.70
+SOGLIA_ATTENZIONE = 0.25
@@ -0,0 +1,248 @@
+"""
+Indice spaziale gerarchico per la mappa dei lampioni.
+
+Per ogni livello di zoom sotto ZOOM_DETTAGLIO la città è divisa in una
+griglia regolare (CELLE_PER_LATO celle per tile) e la tabella CellaMappa
+tiene, per ogni cella non vuota, il numero di lampioni per fascia di
+rischio e la somma delle coordinate. La mappa legge solo le celle del
+viewport: il costo della query dipende dallo schermo, non dalla flotta.
+
+L'indice si ricostruisce da zero dopo un import completo
+(ricostruisci_indice) oppure si aggiorna a delta quando cambiano solo
+alcune righe (traccia_variazioni o traccia_arm_id attorno alla scrittura).
+"""
+
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+
+from .bulk import inserisci_bulk
+from .models import CellaMappa, LampioneNuovo, SOGLIA_ATTENZIONE, SOGLIA_CRITICO
+
+# Dallo zoom ZOOM_DETTAGLIO in su la mappa riceve i singoli lampioni,
+# sotto riceve le celle pre-aggregate dell'indice.
+ZOOM_DETTAGLIO = 16
+ZOOM_MASSIMO = 22
+# Oltre questo numero di lampioni nel viewport (bbox molto grande a zoom alto)
+# la mappa riceve le celle del livello più fine invece dei singoli punti
+MAX_LAMPIONI_DETTAGLIO = 5000
+# Celle per lato del viewport oltre le quali si scende a un livello più grossolano
+MAX_CELLE_PER_LATO = 64
+CELLE_PER_LATO = 4
+LIVELLI = range(0, ZOOM_DETTAGLIO)
+
+FASCE = ['ottimo', 'attenzione', 'critico', 'sconosciuto']
+CONTATORI = ['n'] + FASCE + ['lat_somma', 'lon_somma']
+BATCH_SIZE = 5000
+# arm_id per ogni query IN delle fotografie (sotto il limite di parametri di SQLite)
+BATCH_ARM_ID = 900
+
+
+def lato_cella(livello):
+    """Lato della cella (in gradi) al livello di zoom indicato."""
+    return 360.0 / (2 ** livello) / CELLE_PER_LATO
+
+
+def livello_per_bbox(ovest, sud, est, nord, celle_per_lato=MAX_CELLE_PER_LATO):
+    """Livello più fine dell'indice in cui il bbox copre al più `celle_per_lato` celle per lato."""
+    lato = max(est - ovest, nord - sud, 1e-9)
+    livello = int(np.floor(np.log2(360.0 / CELLE_PER_LATO * celle_per_lato / lato)))
+    return min(max(livello, 0), ZOOM_DETTAGLIO - 1)
+
+
+def celle_viewport(livello, ovest, sud, est, nord):
+    """Celle dell'indice che cadono nel bbox, al livello di zoom indicato."""
+    lato = lato_cella(livello)
+    return CellaMappa.objects.filter(
+        livello=livello,
+        cx__gte=int(np.floor(ovest / lato)), cx__lte=int(np.floor(est / lato)),
+        cy__gte=int(np.floor(sud / lato)), cy__lte=int(np.floor(nord / lato)),
+    )
+
+
+def _fotografia(queryset):
+    """pk, coordinate e fascia di rischio delle righe del queryset (con coordinate)."""
+    righe = queryset.exclude(latitudine__isnull=True).exclude(longitudine__isnull=True).values_list(
+        'pk', 'latitudine', 'longitudine', 'risk_score'
+    )
+    return _fasce(list(righe))
+
+
+def _fotografia_tabella(tabella):
+    """Come _fotografia, da una tabella con lo schema di LampioneNuovo (es. la tabella ombra)."""
+    qn = connection.ops.quote_name
+    colonne = [LampioneNuovo._meta.get_field(campo).column for campo in ['id', 'latitudine', 'longitudine', 'risk_score']]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT {} FROM {} WHERE {} IS NOT NULL AND {} IS NOT NULL'.format(
+            ', '.join(qn(c) for c in colonne), qn(tabella), qn(colonne[1]), qn(colonne[2]),
+        ))
+        return _fasce(cursor.fetchall())
+
+
+def _fasce(righe):
+    df = pd.DataFrame.from_records(righe, columns=['pk', 'lat', 'lon', 'risk_score'])
+    rischio = df['risk_score'].astype(float)
+    df['fascia'] = np.select(
+        [rischio > SOGLIA_CRITICO, rischio >= SOGLIA_ATTENZIONE, rischio < SOGLIA_ATTENZIONE],
+        [2, 1, 0],
+        default=3,
+    )
+    df['segno'] = 1
+    return df.drop(columns='risk_score').set_index('pk')
+
+
+def _celle_per_livello(df):
+    """
+    Somma i contributi dei lampioni (segno +1/-1) sulle celle di ogni livello.
+    Genera (livello, DataFrame delle celle) un livello alla volta per contenere la memoria.
+    """
+    segno = df['segno'].values
+    pesi = pd.DataFrame({
+        'n': segno,
+        'lat_somma': segno * df['lat'].values,
+        'lon_somma': segno * df['lon'].values,
+        # il pk serve solo per le celle con un lampione: lo prendiamo dai contributi positivi
+        'pk': np.where(segno > 0, df.index.values, 0),
+    })
+    for codice, fascia in enumerate(FASCE):
+        pesi[fascia] = np.where(df['fascia'].values == codice, segno, 0)
+
+    for livello in LIVELLI:
+        lato = lato_cella(livello)
+        pesi['cx'] = np.floor(df['lon'].values / lato).astype(np.int64)
+        pesi['cy'] = np.floor(df['lat'].values / lato).astype(np.int64)
+        celle = pesi.groupby(['cx', 'cy'], sort=False).agg(
+            lampione_id=('pk', 'max'), **{campo: (campo, 'sum') for campo in CONTATORI}
+        )
+        yield livello, celle.reset_index()
+
+
+def _salva_celle(livello, df):
+    oggetti = [
+        CellaMappa(
+            livello=livello, cx=int(r.cx), cy=int(r.cy),
+            n=int(r.n), critico=int(r.critico), attenzione=int(r.attenzione),
+            ottimo=int(r.ottimo), sconosciuto=int(r.sconosciuto),
+            lat_somma=float(r.lat_somma), lon_somma=float(r.lon_somma),
+            lampione_id=int(r.lampione_id) if r.n == 1 and pd.notna(r.lampione_id) else None,
+        )
+        for r in df.itertuples(index=False)
+    ]
+    CellaMappa.objects.bulk_create(
+        oggetti,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['livello', 'cx', 'cy'],
+        update_fields=CONTATORI + ['lampione_id'],
+    )
+
+
+def ricostruisci_indice(tabella_lampioni=None, tabella_celle=None):
+    """
+    Ricostruisce da zero l'indice di tutti i livelli. Ritorna il numero di celle.
+    `tabella_lampioni` e `tabella_celle` permettono di leggere e scrivere tabelle con
+    lo stesso schema di LampioneNuovo e CellaMappa (le tabelle ombra di ricarica_con_scambio).
+    """
+    if tabella_lampioni is None:
+        lampioni = _fotografia(LampioneNuovo.objects.all())
+    else:
+        lampioni = _fotografia_tabella(tabella_lampioni)
+    campi = ['livello', 'cx', 'cy', 'lampione_id'] + CONTATORI
+    totale = 0
+    with transaction.atomic():
+        if tabella_celle is None:
+            CellaMappa.objects.all().delete()
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(tabella_celle)}')
+        for livello, celle in _celle_per_livello(lampioni):
+            celle['livello'] = livello
+            celle['lampione_id'] = celle['lampione_id'].where(celle['n'] == 1)
+            totale += inserisci_bulk(CellaMappa, celle, campi, tabella=tabella_celle, batch_size=BATCH_SIZE)
+    return totale
+
+
+def applica_variazioni(prima, dopo):
+    """
+    Aggiorna a delta le celle toccate tra due fotografie della stessa porzione di tabella.
+    I lampioni con stessa posizione e stessa fascia non generano scritture.
+    Ritorna il numero di lampioni cambiati.
+    """
+    colonne = ['lat', 'lon', 'fascia']
+    confronto = prima[colonne].join(dopo[colonne], how='outer', lsuffix='_prima', rsuffix='_dopo')
+    uguali = np.logical_and.reduce([
+        confronto[f'{c}_prima'] == confronto[f'{c}_dopo'] for c in colonne
+    ])
+    cambiati = confronto.index[~uguali]
+    if len(cambiati) == 0:
+        return 0
+
+    delta = pd.concat([
+        prima.loc[prima.index.intersection(cambiati)].assign(segno=-1),
+        dopo.loc[dopo.index.intersection(cambiati)].assign(segno=1),
+    ])
+
+    with transaction.atomic():
+        for livello, celle in _celle_per_livello(delta):
+            esistenti = pd.DataFrame.from_records(list(
+                CellaMappa.objects.filter(
+                    livello=livello,
+                    cx__gte=int(celle['cx'].min()), cx__lte=int(celle['cx'].max()),
+                    cy__gte=int(celle['cy'].min()), cy__lte=int(celle['cy'].max()),
+                ).values('cx', 'cy', *CONTATORI)
+            ), columns=['cx', 'cy'] + CONTATORI)
+
+            celle = celle.merge(esistenti, on=['cx', 'cy'], how='left', suffixes=('', '_db'))
+            for campo in CONTATORI:
+                celle[campo] = celle[campo] + celle[f'{campo}_db'].fillna(0)
+
+            for r in celle[celle['n'] <= 0].itertuples(index=False):
+                CellaMappa.objects.filter(livello=livello, cx=int(r.cx), cy=int(r.cy)).delete()
+
+            piene = celle[celle['n'] > 0].copy()
+            # Cella rimasta con un solo lampione: il pk va riletto dalla tabella
+            lato = lato_cella(livello)
+            for i in piene.index[piene['n'] == 1]:
+                cx, cy = int(piene.at[i, 'cx']), int(piene.at[i, 'cy'])
+                piene.at[i, 'lampione_id'] = LampioneNuovo.objects.filter(
+                    longitudine__gte=cx * lato, longitudine__lt=(cx + 1) * lato,
+                    latitudine__gte=cy * lato, latitudine__lt=(cy + 1) * lato,
+                ).values_list('pk', flat=True).first()
+            _salva_celle(livello, piene)
+
+    return len(cambiati)
+
+
+@contextmanager
+def traccia_variazioni(queryset):
+    """
+    Fotografa il queryset prima e dopo il blocco e applica all'indice solo la differenza.
+
+        with traccia_variazioni(LampioneNuovo.objects.all()):
+            ...  # update/insert/delete sulle righe
+    """
+    prima = _fotografia(queryset)
+    yield
+    applica_variazioni(prima, _fotografia(queryset))
+
+
+def _fotografia_arm_id(arm_ids, batch_size=BATCH_ARM_ID):
+    parti = [
+        _fotografia(LampioneNuovo.objects.filter(arm_id__in=arm_ids[inizio:inizio + batch_size]))
+        for inizio in range(0, len(arm_ids), batch_size)
+    ]
+    return pd.concat(parti) if parti else _fotografia(LampioneNuovo.objects.none())
+
+
+@contextmanager
+def traccia_arm_id(arm_ids):
+    """
+    Come traccia_variazioni, limitata ai lampioni con gli arm_id indicati (letti a
+    blocchi di BATCH_ARM_ID): la memoria dipende dal numero di arm_id, non dalla flotta.
+    """
+    arm_ids = list(arm_ids)
+    prima = _fotografia_arm_id(arm_ids)
+    yield
+    applica_variazioni(prima, _fotografia_arm_id(arm_ids))
@@ -1,3 +1,120 @@
-from django.test import TestCase
+import importlib.util
+import os
+import tempfile
+from pathlib import Path
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+
+from .models import LampioneNuovo
+from .pagination import pagina_keyset
+
+
+class PaginazioneKeysetTest(TestCase):
+    """Righe con lo stesso risk_score_date (score_model scrive un solo now() con i microsecondi)."""
+
+    RIGHE = 120
+
+    @classmethod
+    def setUpTestData(cls):
+        istante = timezone.now().replace(microsecond=123456)
+        LampioneNuovo.objects.bulk_create(
+            LampioneNuovo(arm_id=i, risk_score=0.9, risk_score_date=istante) for i in range(cls.RIGHE)
+        )
+
+    def _scorri(self, direzione):
+        """Segue i cursori "dopo" dalla prima all'ultima pagina e ritorna gli id visti."""
+        queryset = LampioneNuovo.objects.all()
+        richieste = RequestFactory()
+        visti, parametri = [], {}
+        for _ in range(10):
+            pagina = pagina_keyset(richieste.get('/', parametri), queryset, 'risk_score_date', direzione)
+            visti.extend(lampione.pk for lampione in pagina)
+            if not pagina.has_next:
+                return visti
+            parametri = {'dopo': pagina.cursore_successivo}
+        self.fail("la paginazione non termina")
+
+    def test_stesso_istante_decrescente(self):
+        visti = self._scorri('desc')
+        self.assertEqual(len(visti), self.RIGHE)
+        self.assertEqual(len(set(visti)), self.RIGHE)
+
+    def test_stesso_istante_crescente(self):
+        visti = self._scorri('asc')
+        self.assertEqual(len(visti), self.RIGHE)
+        self.assertEqual(len(set(visti)), self.RIGHE)
+
+
+def _script_survival():
+    """Lo script di training (cartella con uno spazio nel nome, non importabile come pacchetto)."""
+    percorso = Path(__file__).resolve().parents[1] / "macchine learning" / "train_lampioni_survival.py"
+    spec = importlib.util.spec_from_file_location("train_lampioni_survival", percorso)
+    modulo = importlib.util.module_from_spec(spec)
+    cartella = os.getcwd()
+    # all'import lo script crea MODEL_DIR nella cartella corrente
+    with tempfile.TemporaryDirectory() as temporanea:
+        os.chdir(temporanea)
+        try:
+            spec.loader.exec_module(modulo)
+        finally:
+            os.chdir(cartella)
+    return modulo
+
+
+class StratifiedReservoirTest(SimpleTestCase):
+    """tmo_id mancante in più blocchi: un solo strato, distinto da un tmo_id reale di -1."""
+
+    def test_tmo_id_mancante_su_piu_blocchi(self):
+        script = _script_survival()
+        serbatoio = script.StratifiedReservoir(100, ["event", "tmo_id"], seed=0)
+        for _ in range(5):
+            serbatoio.aggiungi(pd.DataFrame({
+                "event": [1, 1, 0, 0, 1] * 200,
+                "tmo_id": [np.nan, 2.0, np.nan, 2.0, -1.0] * 200,
+            }))
+
+        self.assertEqual(len(serbatoio.visti), 5)
+        self.assertEqual(sorted(serbatoio.visti.values()), [1000] * 5)
+        # memoria limitata: le righe tenute non dipendono dal numero di strati
+        self.assertLessEqual(len(serbatoio.righe), serbatoio.limite)
+        campione = serbatoio.campione()
+        self.assertEqual(len(campione), 100)
+        # il campione conserva i valori mancanti originali e il -1 reale
+        self.assertTrue(campione["tmo_id"].isna().any())
+        self.assertTrue((campione["tmo_id"] == -1).any())
+
+    def test_memoria_con_molti_strati(self):
+        script = _script_survival()
+        serbatoio = script.StratifiedReservoir(50, ["tmo_id"], seed=0)
+        for blocco in range(4):
+            serbatoio.aggiungi(pd.DataFrame({"tmo_id": np.arange(1000) + 1000 * blocco}))
+
+        self.assertEqual(len(serbatoio.visti), 4000)
+        self.assertLessEqual(len(serbatoio.righe), serbatoio.limite)
+        self.assertEqual(len(serbatoio.campione()), 50)
+
+
+class PredictDaysTest(SimpleTestCase):
+    """La stima di un lampione non dipende dagli altri lampioni del blocco."""
+
+    def test_stesso_lampione_da_solo_e_nel_blocco(self):
+        import xgboost as xgb
+
+        from .ml.survival import predict_days
+
+        X = np.array([[0.0], [1.0], [2.0], [3.0]] * 50)
+        giorni = np.array([30.0, 400.0, 900.0, 1200.0] * 50)
+        dati = xgb.DMatrix(X)
+        dati.set_float_info("label_lower_bound", giorni)
+        dati.set_float_info("label_upper_bound", giorni)
+        booster = xgb.train(
+            {"objective": "survival:aft", "eta": 0.3, "max_depth": 2, "verbosity": 0}, dati, num_boost_round=50,
+        )
+
+        tutti, _, _ = predict_days(booster, X[:4])
+        da_solo, _, _ = predict_days(booster, X[:1])
+        self.assertLess(tutti[0], 100)
+        self.assertAlmostEqual(float(da_solo[0]), float(tutti[0]), places=3)
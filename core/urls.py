@@ -6,12 +6,16 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', index, name='index'),
     path('mappa/', mappa_lampioni, name='mappa_lampioni'),
+    path('api/lampioni/', api_lampioni_viewport, name='api_lampioni_viewport'),
+    path('api/lampioni/<int:pk>/popup/', api_lampione_popup, name='api_lampione_popup'),
     path('statistiche/', dashboard, name='statistiche'),
     path('dettaglio-guasto/<path:motivo_guasto>/', dettaglio_guasto, name='dettaglio_guasto'),
     path('lampione/<int:pk>/', dettaglio_lampione, name='dettaglio_lampione'),
     path('asset/<int:pk>/', dettaglio_asset, name='dettaglio_asset'),
     path('dettaglio-rischio/<str:livello>/', dettaglio_rischio, name='dettaglio_rischio'),
     path('asset/<int:pk>/pdf/', scarica_pdf_asset, name='scarica_pdf_asset'),
+    path('esporta-pdf/', esporta_pdf, name='esporta_pdf'),
     path('dettaglio-intervento/<path:tipo_intervento>/', dettaglio_intervento, name='dettaglio_intervento'),
     path('asset/<int:pk>/aggiuntaInterventiApi', aggiuntaInterventiApi, name='aggiuntaInterventiApi'),
+    path('api/segnalazioni/', api_segnalazioni, name='api_segnalazioni'),
 ]
\ No newline at end of file
@@ -1,164 +1,217 @@
 import io
+import json
+import logging
 import random
 from datetime import datetime, timedelta
 
-from django.db import connection
-from django.shortcuts import render, get_object_or_404
-from django.db.models import Count
-from django.core.paginator import Paginator
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404
 from django.urls import reverse
-from django.http import FileResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.conf import settings
+from django.http import FileResponse, Http404
 from django.http import JsonResponse
+from django.http import StreamingHttpResponse
 
-import folium
-from folium.plugins import MarkerCluster
+from .models import LampioneNuovo, LampioneManutenzione, Segnalazioni, SOGLIA_ATTENZIONE, SOGLIA_CRITICO
+from . import queries, reports
+from . import segnalazioni as coda_segnalazioni
+from .aggregates import adistribuzione_guasti, ariepilogo_asset, riepilogo_asset, statistiche_manutenzioni
+from .cache import ain_cache, ainvalida_vista, cache_vista, in_cache
+from .pagination import apagina_keyset, pagina_keyset
+from .spatial import MAX_LAMPIONI_DETTAGLIO, ZOOM_DETTAGLIO, ZOOM_MASSIMO, celle_viewport, livello_per_bbox
 
-# Librerie per il PDF
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+logger = logging.getLogger(__name__)
 
-from .models import LampioneNuovo, LampioneManutenzione, Segnalazioni
+# Righe dello storico per pagina nella scheda di un intervento
+STORICO_PER_PAGINA = 20
 
-def index(request):
-    top_critici = LampioneNuovo.objects.filter(risk_score__isnull=False).order_by('-risk_score')[:5]
+
+@cache_vista('index')
+async def index(request):
+    top_critici = [lampione async for lampione in queries.top_critici()]
     return render(request, 'core/index.html', {'top_critici': top_critici})
 
-def aggiuntaInterventiApi(request, pk):
+async def aggiuntaInterventiApi(request, pk):
     problema = request.GET.get("problema")   
     note = request.GET.get("note")
-    lampione = get_object_or_404(LampioneNuovo, pk=pk)
-    Segnalazioni.objects.create(arm_id=lampione.arm_id, problema=problema, note=note, datetime=datetime.now())
-    print(f"Ricevuta richiesta di intervento per lampione {lampione.arm_id} con problema '{problema}' e note '{note}'")
+    lampione = await aget_object_or_404(LampioneNuovo, pk=pk)
+    await Segnalazioni.objects.acreate(arm_id=lampione.arm_id, problema=problema, note=note, datetime=datetime.now())
+    # La scheda dell'asset elenca le segnalazioni: solo quella pagina va ricalcolata
+    await ainvalida_vista('dettaglio_asset', reverse('dettaglio_asset', args=[pk]))
+    logger.info("Segnalazione per il lampione %s: problema %r, note %r", lampione.arm_id, problema, note)
     # Simulazione di aggiunta intervento
     return JsonResponse({"data": f"Intervento registrato per lampione {lampione.arm_id} con problema '{problema}' e note '{note}'"})
 
+
+@csrf_exempt
+@require_POST
+def api_segnalazioni(request):
+    """
+    Inserimento a blocchi: il body è un array JSON [{arm_id, problema, note, datetime?}, ...].
+    Gli arm_id sono controllati con una sola query; le segnalazioni valide finiscono nel
+    journal su disco e la risposta 202 arriva quando sono lì (non ancora nel database,
+    vedi core.segnalazioni). Quelle non valide sono elencate in "scartate" con il loro indice.
+    """
+    try:
+        elementi = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({"errore": "Body JSON non valido"}, status=400)
+    if not isinstance(elementi, list):
+        return JsonResponse({"errore": "Il body deve essere un array di segnalazioni"}, status=400)
+    if len(elementi) > coda_segnalazioni.MAX_PER_RICHIESTA:
+        return JsonResponse({"errore": f"Al massimo {coda_segnalazioni.MAX_PER_RICHIESTA} segnalazioni per richiesta"}, status=413)
+
+    valide, scartate = coda_segnalazioni.valida(elementi)
+    if valide:
+        coda_segnalazioni.coda().accoda(valide)
+    logger.info("Segnalazioni in coda: %d accettate, %d scartate", len(valide), len(scartate))
+    return JsonResponse({
+        "accettate": len(valide),
+        "id_richiesta": [s["id_richiesta"] for s in valide],
+        "scartate": scartate,
+    }, status=202 if valide else 400)
+
+
+def _fascia_rischio(risk_score):
+    if risk_score is None:
+        return "lightgray", "SCONOSCIUTO"
+    if risk_score > SOGLIA_CRITICO:
+        return "red", "CRITICO (Alto Rischio)"
+    if risk_score >= SOGLIA_ATTENZIONE:
+        return "orange", "ATTENZIONE"
+    return "green", "OTTIMO"
+
+
+# Stato e colore della scheda asset per ogni fascia di _fascia_rischio
+_STATO_ASSET = {
+    "red": ("CRITICO", "#ef4444"),
+    "orange": ("ATTENZIONE", "#f59e0b"),
+    "green": ("OTTIMO", "#10b981"),
+    "lightgray": ("SCONOSCIUTO", "#6c757d"),
+}
+
+
+def _leggi_viewport(request):
+    """Legge bbox=ovest,sud,est,nord e zoom dalla querystring."""
+    try:
+        ovest, sud, est, nord = (float(v) for v in request.GET.get('bbox', '').split(','))
+        zoom = int(request.GET.get('zoom', 13))
+    except ValueError:
+        return None
+    return ovest, sud, est, nord, min(max(zoom, 0), ZOOM_MASSIMO)
+
+
+@cache_vista('mappa_lampioni')
 def mappa_lampioni(request):
-    start_coords = [41.9028, 12.4964]
-    
-    m = folium.Map(location=start_coords, zoom_start=13, tiles="cartodbpositron")
-    lampioni = LampioneNuovo.objects.exclude(latitudine__isnull=True).exclude(longitudine__isnull=True)[:2500]
-    marker_cluster = MarkerCluster().add_to(m)
-
-    for lampione in lampioni:
-        if getattr(lampione, 'risk_score', None) is not None:
-            if lampione.risk_score > 0.70:
-                colore_icona = "red"
-                stato_salute = "CRITICO (Alto Rischio)"
-            elif lampione.risk_score >= 0.25:
-                colore_icona = "orange"
-                stato_salute = "ATTENZIONE"
-            else:
-                colore_icona = "green"
-                stato_salute = "OTTIMO"
-            
-            rischio_perc = f"{round(lampione.risk_score * 100)}%"
-        else:
-            colore_icona = "lightgray"
-            stato_salute = "SCONOSCIUTO"
-            rischio_perc = "N/D"
-
-        url_dettaglio = reverse('dettaglio_asset', args=[lampione.pk])
-
-        popup_html = f"""
-            <div style="font-family: sans-serif; min-width: 150px;">
-                <h4 style="margin-bottom: 5px;">Lampione #{lampione.arm_id}</h4>
-                <b style="color: gray;">Stato:</b> 
-                <span style="color:{colore_icona}; font-weight:bold;">{stato_salute}</span><br>
-                
-                <b style="color: gray;">Rischio Sostituzione (60gg):</b> {rischio_perc}<br>
-                <hr style="margin: 5px 0;">
-                
-                <a href="{url_dettaglio}" target="_blank" 
-                   style="display: block; text-align:center; background-color: #00f2ff; color: #000; 
-                          padding: 5px; text-decoration: none; border-radius: 4px; font-weight: bold;">
-                   Vedi Dettaglio Completo
-                </a>
-            </div>
-        """
-
-        folium.Marker(
-            location=[lampione.latitudine, lampione.longitudine],
-            popup=folium.Popup(popup_html, max_width=300),
-            tooltip=f"ID: {lampione.arm_id} - Rischio: {rischio_perc}",
-            icon=folium.Icon(color=colore_icona, icon="lightbulb-o", prefix="fa")
-        ).add_to(marker_cluster)
-
-    m = m._repr_html_()
-    return render(request, 'core/mappa.html', {'mappa': m})
-
-
-def dashboard(request):
-    query = (
-        LampioneManutenzione.objects
-        .values('tcs_descr')
-        .annotate(totale=Count('id'))
-        .order_by('-totale')
-        .exclude(tcs_descr__isnull=True)
-        .exclude(tcs_descr='')
+    # La mappa viene disegnata lato client (Leaflet): i dati arrivano
+    # dall'API del viewport solo per la porzione di città visibile.
+    context = {
+        'start_coords': [41.9028, 12.4964],
+        'zoom_start': 13,
+        'zoom_dettaglio': ZOOM_DETTAGLIO,
+    }
+    return render(request, 'core/mappa.html', context)
+
+
+def _feature_celle(zoom, ovest, sud, est, nord):
+    """
+    Cluster letti dall'indice spaziale pre-calcolato (core.spatial), al livello
+    dello zoom oppure a uno più grossolano se il bbox è troppo grande per lo zoom.
+    """
+    livello = min(zoom, livello_per_bbox(ovest, sud, est, nord))
+    celle = celle_viewport(livello, ovest, sud, est, nord).values_list(
+        'n', 'critico', 'attenzione', 'ottimo', 'sconosciuto', 'lat_somma', 'lon_somma', 'lampione_id'
     )
-    
-    query_manutenzione = (
-        LampioneManutenzione.objects
-        .values('tci_id', 'tci_descr')
-        .annotate(numero_utilizzi=Count('id')) 
-        .order_by('-numero_utilizzi')
-        .exclude(tci_id__isnull=True)
-        .exclude(tci_id=0)
-        .exclude(tci_descr__isnull=True)
-        .exclude(tci_descr='')
-    )[:5] 
-
-    labels = []
-    data = []
-    
-    for item in query[:10]:
-        labels.append(item['tcs_descr'])
-        data.append(item['totale'])
-    
-    altri_count = sum(item['totale'] for item in query[10:])
-    
-    if altri_count > 0:
-        labels.append('Altro (Guasti minori)')
-        data.append(altri_count)
+    return [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon_somma / n, lat_somma / n]},
+        "properties": {
+            "tipo": "cluster",
+            "n": n,
+            "critico": critico,
+            "attenzione": attenzione,
+            "ottimo": ottimo,
+            "sconosciuto": sconosciuto,
+            # con un solo lampione nella cella il client può aprirne il popup
+            "id": lampione_id,
+        },
+    } for n, critico, attenzione, ottimo, sconosciuto, lat_somma, lon_somma, lampione_id in celle]
+
+
+def api_lampioni_viewport(request):
+    viewport = _leggi_viewport(request)
+    if viewport is None:
+        return JsonResponse({"errore": "Parametri bbox/zoom non validi"}, status=400)
+    ovest, sud, est, nord, zoom = viewport
+
+    if zoom >= ZOOM_DETTAGLIO:
+        lampioni = list(queries.lampioni_nel_bbox(ovest, sud, est, nord).values_list(
+            'pk', 'arm_id', 'latitudine', 'longitudine', 'risk_score'
+        )[:MAX_LAMPIONI_DETTAGLIO + 1])
+        if len(lampioni) <= MAX_LAMPIONI_DETTAGLIO:
+            features = [{
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {"tipo": "lampione", "id": pk, "arm_id": arm_id, "risk_score": risk_score},
+            } for pk, arm_id, lat, lon, risk_score in lampioni]
+        else:
+            # bbox troppo grande per i singoli punti: cluster dell'indice
+            features = _feature_celle(ZOOM_DETTAGLIO - 1, ovest, sud, est, nord)
+    else:
+        features = _feature_celle(zoom, ovest, sud, est, nord)
 
-    tot_critico = LampioneNuovo.objects.filter(risk_score__gt=0.70).count()
-    tot_attenzione = LampioneNuovo.objects.filter(risk_score__gte=0.25, risk_score__lte=0.70).count()
-    tot_ottimo = LampioneNuovo.objects.filter(risk_score__lt=0.25).count()
+    return JsonResponse({"type": "FeatureCollection", "zoom": zoom, "features": features})
 
-    context = {
-        'chart_labels': labels,
-        'chart_data': data,
-        'chart_Intervento': [item['tci_descr'] for item in query_manutenzione],
-        'chart_Intervento_data': [item['numero_utilizzi'] for item in query_manutenzione],
-        'chart_Intervento_media': [0 for item in query_manutenzione],
-        'risk_data': [tot_ottimo, tot_attenzione, tot_critico]
+
+def api_lampione_popup(request, pk):
+    lampione = get_object_or_404(LampioneNuovo, pk=pk)
+    colore_icona, stato_salute = _fascia_rischio(lampione.risk_score)
+    rischio_perc = f"{round(lampione.risk_score * 100)}%" if lampione.risk_score is not None else "N/D"
+    return JsonResponse({
+        "arm_id": lampione.arm_id,
+        "stato": stato_salute,
+        "colore": colore_icona,
+        "rischio": rischio_perc,
+        "url_dettaglio": reverse('dettaglio_asset', args=[lampione.pk]),
+    })
+
+
+def _contesto_dashboard(manutenzioni, fasce):
+    return {
+        'chart_labels': [etichetta for etichetta, _ in manutenzioni['categorie']],
+        'chart_data': [totale for _, totale in manutenzioni['categorie']],
+        'chart_Intervento': [etichetta for etichetta, _ in manutenzioni['interventi']],
+        'chart_Intervento_data': [totale for _, totale in manutenzioni['interventi']],
+        'chart_Intervento_media': [0 for _ in manutenzioni['interventi']],
+        'risk_data': [fasce['ottimo'], fasce['attenzione'], fasce['critico']]
     }
 
-    return render(request, 'core/dashboard.html', context)
+
+@cache_vista('dashboard')
+async def dashboard(request):
+    # Una query per tabella, rifatta solo quando score_model o un import cambiano i dati.
+    # L'ORM async esegue le query una dopo l'altra sul suo unico thread: niente gather.
+    manutenzioni = await sync_to_async(statistiche_manutenzioni)()
+    fasce = await queries.aconteggi_per_fascia()
+    return render(request, 'core/dashboard.html', _contesto_dashboard(manutenzioni, fasce))
 
 
 def dettaglio_guasto(request, motivo_guasto):
     sort_by = request.GET.get('sort', 'sgn_data_inserimento')
     direction = request.GET.get('direction', 'desc')
 
-    ordering = sort_by
-    if direction == 'desc':
-        ordering = '-' + sort_by
-
     valid_fields = ['arm_id', 'sgn_data_inserimento', 'tci_descr', 'arm_altezza']
     if sort_by not in valid_fields:
-        ordering = '-sgn_data_inserimento'
+        sort_by, direction = 'sgn_data_inserimento', 'desc'
+    if direction != 'desc':
+        direction = 'asc'
 
-    lista_completa = LampioneManutenzione.objects.filter(
-        tcs_descr=motivo_guasto
-    ).order_by(ordering)
+    lista_completa = queries.guasti_per_categoria(motivo_guasto)
 
-    paginator = Paginator(lista_completa, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Paginazione keyset: niente OFFSET, la pagina N costa quanto la prima
+    page_obj = pagina_keyset(request, lista_completa, sort_by, direction)
 
     context = {
         'motivo': motivo_guasto,
@@ -169,135 +222,99 @@ def dettaglio_guasto(request, motivo_guasto):
     return render(request, 'core/dettaglio.html', context)
 
 
+def _usa_folium():
+    # MAPPA_ASSET = 'folium' ripristina la mappa Folium renderizzata dal server (in cache)
+    return getattr(settings, 'MAPPA_ASSET', 'leaflet') == 'folium'
+
+
+def _mappa_punto(lat, lon, colore, tooltip):
+    """Dati del widget _mappa_punto.html: la mappa la disegna il browser."""
+    return {'lat': lat, 'lon': lon, 'zoom': 19, 'colore': colore, 'tooltip': tooltip}
+
+
 def dettaglio_lampione(request, pk):
     lampione = get_object_or_404(LampioneManutenzione, pk=pk)
     codice_fisico = lampione.arm_id 
 
     lat = lampione.latitudine if lampione.latitudine else 44.647
     lon = lampione.longitudine if lampione.longitudine else 10.925
-    m = folium.Map(location=[lat, lon], zoom_start=19)
-    folium.Marker([lat, lon], tooltip=f"Lampione {codice_fisico}").add_to(m)
 
-    storico = LampioneManutenzione.objects.filter(arm_id=lampione.arm_id).exclude(pk=pk).order_by('-sgn_data_inserimento')
+    def disegna_mappa():
+        import folium
+        m = folium.Map(location=[lat, lon], zoom_start=19)
+        folium.Marker([lat, lon], tooltip=f"Lampione {codice_fisico}").add_to(m)
+        return m._repr_html_()
+
+    if _usa_folium():
+        # L'HTML di Folium è lo stesso per tutte le righe dello storico dello stesso punto
+        mappa, mappa_punto = in_cache(f'mappa_folium:{codice_fisico}:{lat}:{lon}', disegna_mappa), None
+    else:
+        mappa, mappa_punto = None, _mappa_punto(lat, lon, '#00f2ff', f"Lampione {codice_fisico}")
+
+    # Riepilogo (una riga) + una pagina dello storico alla volta, dal guasto più recente
+    storico = pagina_keyset(
+        request, queries.storico_lampione(lampione.arm_id, escludi_pk=pk),
+        'sgn_data_inserimento', 'desc', per_pagina=STORICO_PER_PAGINA,
+    )
 
     return render(request, 'core/lampione_singolo.html', {
         'lampione': lampione,
+        'riepilogo': riepilogo_asset(codice_fisico),
         'storico': storico,
-        'mappa': m._repr_html_()
+        'mappa': mappa,
+        'mappa_punto': mappa_punto,
     })
 
 
-def dettaglio_asset(request, pk):
-    lampNuovo=True
-    segnalazioni=""
-    if LampioneManutenzione.objects.filter(pk=pk).exists():
-        lampNuovo = False
-        lampione = LampioneManutenzione.objects.filter(pk=pk).first()
-    else:
-        lampNuovo = True
-        lampione = LampioneNuovo.objects.filter(pk=pk).first()
-        segnalazioni=Segnalazioni.objects.filter(arm_id=lampione.arm_id).order_by('-datetime')
-    # --- 1. PRIMO TENTATIVO: Dati specifici per combinazione Altezza / Potenza ---
-    sql_specific = """WITH base AS (
-      SELECT
-        COALESCE(NULLIF(TRIM(tcs_descr), ''), 'Senza categoria') AS tcs_descr
-      FROM core_lampionemanutenzione
-      WHERE arm_lmp_potenza_nominale = %s
-        AND arm_altezza = %s
-        AND tcs_descr IS NOT NULL
-    ),
-    tot AS (
-      SELECT CAST(COUNT(*) AS REAL) AS n_tot
-      FROM base
-    )
-    SELECT
-      b.tcs_descr,
-      (CAST(COUNT(*) AS REAL) / tot.n_tot) AS prob_guasto,
-      0 AS giorni_medi_rimasti,
-      COUNT(*) AS n_eventi
-    FROM base b
-    CROSS JOIN tot
-    GROUP BY b.tcs_descr, tot.n_tot
-    ORDER BY prob_guasto DESC;
-    """
-    
-    with connection.cursor() as cursor:
-        cursor.execute(sql_specific, [lampione.arm_lmp_potenza_nominale, lampione.arm_altezza])
-        rows = cursor.fetchall()
-        
-    tipo_statistica = "Dato basato su armature con la stessa altezza e potenza."
-
-    # --- 2. FALLBACK PIANO B: Statistica su base cittadina se la prima fallisce ---
-    if not rows:
-        sql_fallback = """WITH base AS (
-          SELECT
-            COALESCE(NULLIF(TRIM(tcs_descr), ''), 'Senza categoria') AS tcs_descr
-          FROM core_lampionemanutenzione
-          WHERE tcs_descr IS NOT NULL
-        ),
-        tot AS (
-          SELECT CAST(COUNT(*) AS REAL) AS n_tot
-          FROM base
-        )
-        SELECT
-          b.tcs_descr,
-          (CAST(COUNT(*) AS REAL) / tot.n_tot) AS prob_guasto,
-          0 AS giorni_medi_rimasti,
-          COUNT(*) AS n_eventi
-        FROM base b
-        CROSS JOIN tot
-        GROUP BY b.tcs_descr, tot.n_tot
-        ORDER BY prob_guasto DESC;
-        """
-        with connection.cursor() as cursor:
-            cursor.execute(sql_fallback)
-            rows = cursor.fetchall()
-        tipo_statistica = "Dati specifici assenti. Media calcolata sull'intera città."
+def _mappa_asset(lat, lon):
+    # Folium serve solo con MAPPA_ASSET = 'folium': importato solo allora
+    import folium
+    m = folium.Map(location=[lat, lon], zoom_start=19, tiles="cartodbpositron", width='100%', height='100%')
+    folium.Marker(
+        [lat, lon],
+        tooltip="Posizione Asset",
+        icon=folium.Icon(color="blue", icon="lightbulb-o", prefix="fa")
+    ).add_to(m)
+    return m._repr_html_()
 
-    eta_anni = 0
-    if lampione.arm_data_ini:
-        try:
-            eta_giorni = (datetime.now().date() - lampione.arm_data_ini).days
-            eta_anni = eta_giorni // 365
-        except TypeError:
-            data_ini_parsed = datetime.strptime(str(lampione.arm_data_ini), '%Y-%m-%d').date()
-            eta_giorni = (datetime.now().date() - data_ini_parsed).days
-            eta_anni = eta_giorni // 365
-
-    if getattr(lampione, 'risk_score', None) is not None:
+
+@cache_vista('dettaglio_asset')
+async def dettaglio_asset(request, pk):
+    # Una sola lettura per tabella invece di exists() + first() sulla stessa riga
+    lampione = await LampioneManutenzione.objects.filter(pk=pk).afirst()
+    lampNuovo = lampione is None
+    if lampNuovo:
+        lampione = await LampioneNuovo.objects.filter(pk=pk).afirst()
+    if lampione is None:
+        raise Http404("Lampione non trovato")
+
+    # Distribuzione dei guasti per combinazione Altezza / Potenza, con fallback
+    # cittadino se la combinazione non ha storico (tabella aggregata, una query indicizzata).
+    # Le letture vanno in sequenza: l'ORM async usa un solo thread per le query.
+    rows, dati_cittadini = await adistribuzione_guasti(lampione.arm_lmp_potenza_nominale, lampione.arm_altezza)
+    segnalazioni = ""
+    if lampNuovo:
+        segnalazioni = [segnalazione async for segnalazione in queries.segnalazioni_lampione(lampione.arm_id)]
+    riepilogo = await ariepilogo_asset(lampione.arm_id)
+    if dati_cittadini:
+        tipo_statistica = "Dati specifici assenti. Media calcolata sull'intera città."
+    else:
+        tipo_statistica = "Dato basato su armature con la stessa altezza e potenza."
+
+    # LampioneManutenzione non ha score
+    risk_score = getattr(lampione, 'risk_score', None)
+    colore, _ = _fascia_rischio(risk_score)
+    stato, colore_stato = _STATO_ASSET[colore]
+    motivazione = reports.motivazione({
+        'arm_data_ini': lampione.arm_data_ini,
+        'risk_score': risk_score,
+        'arm_lmp_potenza_nominale': lampione.arm_lmp_potenza_nominale,
+    })
+    if risk_score is not None:
         giorni_rimanenti = getattr(lampione, 'traQuantoSiRompe', "N/D")
-        
-        if lampione.risk_score > 0.70:
-            stato = "CRITICO"
-            colore_stato = "#ef4444" 
-            if eta_anni > 5:
-                motivazione = f"Forte usura temporale: l'asset è in funzione da oltre {eta_anni} anni, superando la vita utile media stimata."
-            elif lampione.arm_lmp_potenza_nominale and lampione.arm_lmp_potenza_nominale > 70:
-                motivazione = f"Stress termico/elettrico: l'elevata potenza ({lampione.arm_lmp_potenza_nominale}W) ha storicamente un alto tasso di guasto per questo modello."
-            else:
-                motivazione = "Il modello ha riscontrato un'alta incidenza di guasti storici per questa specifica combinazione di hardware."
-                
-        elif lampione.risk_score >= 0.25:
-            stato = "ATTENZIONE"
-            colore_stato = "#f59e0b"
-            if eta_anni > 3:
-                motivazione = f"L'asset è in servizio da circa {eta_anni} anni. Si consiglia un monitoraggio per normale decadimento fisiologico."
-            else:
-                motivazione = "Rilevata una vulnerabilità statistica media per questa classe di armature, indipendente dall'età."
-                
-        else:
-            stato = "OTTIMO"
-            colore_stato = "#10b981"
-            if eta_anni < 2:
-                motivazione = "Installazione recente. Bassissima probabilità di usura fisica o guasti a breve termine."
-            else:
-                motivazione = "L'hardware si sta dimostrando estremamente affidabile nel tempo rispetto alla media dell'impianto."
     else:
         giorni_rimanenti = "N/D"
-        stato = "SCONOSCIUTO"
-        colore_stato = "#6c757d"
-        motivazione = "In attesa della prima elaborazione dati da parte dell'Intelligenza Artificiale."
-            
+
     messaggio = "Previsione basata sull'intelligenza artificiale."
     
     try:
@@ -305,21 +322,22 @@ def dettaglio_asset(request, pk):
     except (ValueError, TypeError):
         data_rottura = "N/D"
 
-    # Mappa Folium 100%
-    if lampione.latitudine and lampione.longitudine:
-        m = folium.Map(location=[lampione.latitudine, lampione.longitudine], zoom_start=19, tiles="cartodbpositron", width='100%', height='100%')
-        folium.Marker(
-            [lampione.latitudine, lampione.longitudine], 
-            tooltip="Posizione Asset",
-            icon=folium.Icon(color="blue", icon="lightbulb-o", prefix="fa")
-        ).add_to(m)
-        mappa_html = m._repr_html_()
-    else:
-        mappa_html = None
+    lat, lon = lampione.latitudine, lampione.longitudine
+    mappa_html = mappa_punto = None
+    if lat and lon:
+        if _usa_folium():
+            # Il rendering Folium è solo CPU: in un thread per non fermare il loop, e solo alla prima richiesta
+            mappa_html = await ain_cache(
+                f'mappa_folium_asset:{pk}:{lat}:{lon}',
+                lambda: sync_to_async(_mappa_asset, thread_sensitive=False)(lat, lon),
+            )
+        else:
+            mappa_punto = _mappa_punto(lat, lon, colore_stato, "Posizione Asset")
 
     context = {
         'lampione': lampione,
         'mappa': mappa_html,
+        'mappa_punto': mappa_punto,
         'tipo_statistica': tipo_statistica,
         'ai_data': {
             'giorni': giorni_rimanenti,
@@ -330,7 +348,8 @@ def dettaglio_asset(request, pk):
             'motivazione': motivazione
         },
         "nGuasti": len(rows),
-        "segnalazioni": segnalazioni
+        "segnalazioni": segnalazioni,
+        "riepilogo": riepilogo,
     }
     if lampNuovo:
         return render(request, 'core/lampione_asset.html', context)
@@ -338,31 +357,20 @@ def dettaglio_asset(request, pk):
         return render(request, 'core/lampione_singolo.html', context)
 
 
-def dettaglio_rischio(request, livello):
+async def dettaglio_rischio(request, livello):
     sort_by = request.GET.get('sort', 'risk_score')
     direction = request.GET.get('direction', 'desc')
 
-    ordering = sort_by if direction == 'asc' else '-' + sort_by
-
     valid_fields = ['arm_id', 'risk_score', 'arm_altezza', 'risk_score_date', 'traQuantoSiRompe']
     if sort_by not in valid_fields:
-        ordering = '-risk_score'
-
-    if livello == 'critico':
-        qs = LampioneNuovo.objects.filter(risk_score__gt=0.70)
-        titolo = "Rischio Critico (> 70%)"
-    elif livello == 'attenzione':
-        qs = LampioneNuovo.objects.filter(risk_score__gte=0.25, risk_score__lte=0.70)
-        titolo = "In Osservazione (25% - 70%)"
-    else:
-        qs = LampioneNuovo.objects.filter(risk_score__lt=0.25)
-        titolo = "Stato Ottimo (< 25%)"
+        sort_by, direction = 'risk_score', 'desc'
+    if direction != 'asc':
+        direction = 'desc'
 
-    lista_completa = qs.order_by(ordering)
+    titolo, lista_completa = queries.lampioni_per_rischio(livello)
 
-    paginator = Paginator(lista_completa, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Paginazione keyset: niente OFFSET, la pagina N costa quanto la prima
+    page_obj = await apagina_keyset(request, lista_completa, sort_by, direction)
 
     context = {
         'motivo': titolo,
@@ -376,131 +384,64 @@ def dettaglio_rischio(request, livello):
 
 
 def scarica_pdf_asset(request, pk):
-    lampione = get_object_or_404(LampioneNuovo, pk=pk)
-    
-    eta_anni = 0
-    if lampione.arm_data_ini:
+    lampione = get_object_or_404(LampioneNuovo.objects.values(*reports.CAMPI_REPORT), pk=pk)
+    # Rigenerato solo quando cambia lo score (o la versione dei dati)
+    data_score = lampione['risk_score_date'].isoformat() if lampione['risk_score_date'] else ''
+    pdf = in_cache(f"pdf_asset:{pk}:{data_score}", lambda: reports.pdf_asset(lampione))
+    return FileResponse(io.BytesIO(pdf), as_attachment=True, filename=f"Report_Asset_{lampione['arm_id']}.pdf")
+
+
+def esporta_pdf(request):
+    """
+    Report di più asset insieme: ?livello=critico|attenzione|ottimo oppure
+    ?bbox=ovest,sud,est,nord (un quartiere). formato=zip (default, un PDF per asset
+    generati in parallelo e inviati man mano) oppure formato=pdf (un PDF multipagina).
+    """
+    if request.GET.get('livello') in queries.LIVELLI_RISCHIO:
+        livello = request.GET['livello']
+        lampioni = queries.lampioni_per_rischio(livello)[1]
+        nome = f"Report_{livello}"
+    elif request.GET.get('bbox'):
         try:
-            eta_giorni = (datetime.now().date() - lampione.arm_data_ini).days
-            eta_anni = eta_giorni // 365
-        except TypeError:
-            data_ini_parsed = datetime.strptime(str(lampione.arm_data_ini), '%Y-%m-%d').date()
-            eta_giorni = (datetime.now().date() - data_ini_parsed).days
-            eta_anni = eta_giorni // 365
-
-    motivazione = "In attesa della prima elaborazione dati da parte dell'Intelligenza Artificiale."
-    if getattr(lampione, 'risk_score', None) is not None:
-        if lampione.risk_score > 0.70:
-            if eta_anni > 5:
-                motivazione = f"Forte usura temporale: l'asset è in funzione da oltre {eta_anni} anni, superando la vita utile media stimata."
-            elif lampione.arm_lmp_potenza_nominale and lampione.arm_lmp_potenza_nominale > 70:
-                motivazione = f"Stress termico/elettrico: l'elevata potenza ({lampione.arm_lmp_potenza_nominale}W) ha storicamente un alto tasso di guasto per questo modello."
-            else:
-                motivazione = "Il modello ha riscontrato un'alta incidenza di guasti storici per questa specifica combinazione di hardware."
-        elif lampione.risk_score >= 0.25:
-            if eta_anni > 3:
-                motivazione = f"L'asset è in servizio da circa {eta_anni} anni. Si consiglia un monitoraggio per normale decadimento fisiologico."
-            else:
-                motivazione = "Rilevata una vulnerabilità statistica media per questa classe di armature, indipendente dall'età."
-        else:
-            if eta_anni < 2:
-                motivazione = "Installazione recente. Bassissima probabilità di usura fisica o guasti a breve termine."
-            else:
-                motivazione = "L'hardware si sta dimostrando estremamente affidabile nel tempo rispetto alla media dell'impianto."
-
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        name='TitleStyle', parent=styles['Heading1'],
-        textColor=colors.HexColor('#0f172a'), spaceAfter=20
-    )
-    subtitle_style = ParagraphStyle(
-        name='SubTitle', parent=styles['Heading2'],
-        textColor=colors.HexColor('#00f2ff'), spaceAfter=10
-    )
-    testo_normale = styles['Normal']
-    
-    elements.append(Paragraph(f"Report Tecnico di Manutenzione Predittiva", title_style))
-    elements.append(Paragraph(f"<b>ID Asset:</b> #{lampione.arm_id}", testo_normale))
-    elements.append(Paragraph(f"<b>Data Estrazione:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}", testo_normale))
-    elements.append(Spacer(1, 20))
-    
-    if lampione.latitudine and lampione.longitudine:
-        gmaps_url = f"https://www.google.com/maps/search/?api=1&query={lampione.latitudine},{lampione.longitudine}"
-        testo_coords = f"Apri in Google Maps ({lampione.latitudine}, {lampione.longitudine})"
+            ovest, sud, est, nord = (float(v) for v in request.GET['bbox'].split(','))
+        except ValueError:
+            return JsonResponse({"errore": "Parametro bbox non valido"}, status=400)
+        lampioni = queries.lampioni_nel_bbox(ovest, sud, est, nord)
+        nome = "Report_zona"
     else:
-        gmaps_url = None
-        testo_coords = "Coordinate non disponibili"
-
-    elements.append(Paragraph("Specifiche Hardware", subtitle_style))
-    data_tecnici = [
-        ['Altezza Armatura', f"{lampione.arm_altezza} m" if lampione.arm_altezza else "N/D"],
-        ['Potenza Nominale', f"{lampione.arm_lmp_potenza_nominale} W" if lampione.arm_lmp_potenza_nominale else "N/D"],
-        ['Modello/Tipologia', f"{lampione.tpo_descr}" if lampione.tpo_descr else "N/D"],
-        ['Geolocalizzazione', Paragraph(f'<a href="{gmaps_url}" color="blue">{testo_coords}</a>', testo_normale)]
-    ]
-    t = Table(data_tecnici, colWidths=[150, 300])
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (0,-1), colors.HexColor('#e2e8f0')),
-        ('TEXTCOLOR', (0,0), (-1,-1), colors.black),
-        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#cbd5e1')),
-        ('PADDING', (0,0), (-1,-1), 8),
-    ]))
-    elements.append(t)
-    elements.append(Spacer(1, 20))
-    
-    elements.append(Paragraph("Analisi Predittiva (Machine Learning)", subtitle_style))
-    risk_perc = f"{round(lampione.risk_score * 100)}%" if lampione.risk_score else "N/D"
-    giorni = getattr(lampione, 'traQuantoSiRompe', "N/D")
-    
-    data_ml = [
-        ['Rischio Sostituzione (60gg)', risk_perc],
-        ['Giorni Stimati alla Rottura', f"{giorni} gg" if giorni != "N/D" else "N/D"]
-    ]
-    t2 = Table(data_ml, colWidths=[200, 250])
-    t2.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (0,-1), colors.HexColor('#00f2ff')),
-        ('TEXTCOLOR', (0,0), (0,-1), colors.HexColor('#0f172a')),
-        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#cbd5e1')),
-        ('PADDING', (0,0), (-1,-1), 8),
-    ]))
-    elements.append(t2)
-    elements.append(Spacer(1, 15))
-    
-    elements.append(Paragraph("<b>Logica Decisionale (Explainable AI):</b>", testo_normale))
-    elements.append(Spacer(1, 5))
-    elements.append(Paragraph(motivazione, testo_normale))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return FileResponse(buffer, as_attachment=True, filename=f"Report_Asset_{lampione.arm_id}.pdf")
+        return JsonResponse({"errore": "Indicare livello o bbox"}, status=400)
+
+    lampioni = lampioni.order_by('arm_id').values(*reports.CAMPI_REPORT)
+
+    if request.GET.get('formato') == 'pdf':
+        if lampioni.count() > reports.MAX_MULTIPAGINA:
+            return JsonResponse({"errore": f"Più di {reports.MAX_MULTIPAGINA} asset: usare formato=zip"}, status=400)
+        pdf = reports.pdf_multipagina(lampioni)
+        return FileResponse(io.BytesIO(pdf), as_attachment=True, filename=f"{nome}.pdf")
+
+    workers = getattr(settings, 'REPORT_WORKERS', 2)
+    risposta = StreamingHttpResponse(
+        reports.zip_report(lampioni.iterator(chunk_size=500), workers), content_type='application/zip'
+    )
+    risposta['Content-Disposition'] = f'attachment; filename="{nome}.zip"'
+    return risposta
+
 
 def dettaglio_intervento(request, tipo_intervento):
     sort_by = request.GET.get('sort', 'sgn_data_inserimento')
     direction = request.GET.get('direction', 'desc')
 
-    ordering = sort_by
-    if direction == 'desc':
-        ordering = '-' + sort_by
-
     valid_fields = ['arm_id', 'sgn_data_inserimento', 'tci_descr', 'arm_altezza']
     if sort_by not in valid_fields:
-        ordering = '-sgn_data_inserimento'
+        sort_by, direction = 'sgn_data_inserimento', 'desc'
+    if direction != 'desc':
+        direction = 'asc'
 
     # Filtriamo per tipo di intervento (tci_descr)
-    lista_completa = LampioneManutenzione.objects.filter(
-        tci_descr=tipo_intervento
-    ).order_by(ordering)
+    lista_completa = queries.interventi_per_tipo(tipo_intervento)
 
-    paginator = Paginator(lista_completa, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Paginazione keyset: niente OFFSET, la pagina N costa quanto la prima
+    page_obj = pagina_keyset(request, lista_completa, sort_by, direction)
 
     context = {
         'motivo': tipo_intervento,  # Questo sarà il titolo nella pagina dettaglio.html
@@ -1,58 +1,34 @@
-import pandas as pd
-import numpy as np
+import os
+import sys
 from pathlib import Path
 
-INPUT_CSV = "..\\lampioni_attivi_coordinate.csv"
+# Parsing e feature in giorni condivisi con i comandi Django (core/ml/features.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from core.ml.features import aggiungi_giorni, carica_csv  # noqa: E402
+
+INPUT_CSV = os.path.join("..", "lampioni_attivi_coordinate.csv")
 OUTPUT_CSV = "datiPerPredict.csv"
 
 print("Carico dataset...")
-df = pd.read_csv(INPUT_CSV, dtype=str, low_memory=False)
-
-# pulizia base
-df = df.apply(lambda s: s.str.strip() if s.dtype == "object" else s)
-df.replace({"": np.nan, "NULL": np.nan, "null": np.nan, "NaN": np.nan, "nan": np.nan}, inplace=True)
-
-# =========================
-# PARSE DATE ROBUSTO
-# =========================
-def parse_date(s):
-    dt = pd.to_datetime(s, errors="coerce", format="%Y-%m-%d")
-    mask = dt.isna() & s.notna()
-    if mask.any():
-        dt2 = pd.to_datetime(s[mask], errors="coerce", dayfirst=True)
-        dt.loc[mask] = dt2
-    return dt
-
-df["arm_data_ini"] = parse_date(df["arm_data_ini"])
-df["sgn_data_inserimento"] = parse_date(df["sgn_data_inserimento"])
+# stringhe ripulite, valori nulli e date (formati espliciti) già gestiti; cache se il CSV non cambia
+df = carica_csv(INPUT_CSV)
 
 # =========================
 # CALCOLO DIFFERENZA GIORNI
 # =========================
-df["giorni_guasto"] = (
-    df["sgn_data_inserimento"] - df["arm_data_ini"]
-).dt.days
-
-
+df = aggiungi_giorni(df)
 
 # se non esiste segnalazione → 0
 df["giorni_guasto"] = df["giorni_guasto"].fillna(0)
 
-df["giorni_osservati_finora"] = np.where(
-    df["giorni_guasto"] == 0,
-    (pd.Timestamp.today()-df["arm_data_ini"]).dt.days,
-    df["giorni_guasto"]
-)
-
-
-# convertiamo in intero
-df["giorni_guasto"] = df["giorni_guasto"].astype(int)
-df=df[["arm_id","arm_altezza","arm_lmp_potenza_nominale","tmo_id","giorni_guasto","giorni_osservati_finora"]].copy()
+df = df[["arm_id","arm_altezza","arm_lmp_potenza_nominale","tmo_id","giorni_guasto","giorni_osservati_finora"]].copy()
 
 # =========================
 # SAVE
 # =========================
 df = df[df["giorni_guasto"] >= 0].copy()
+# convertiamo in intero
+df["giorni_guasto"] = df["giorni_guasto"].astype(int)
 df.to_csv(OUTPUT_CSV, index=False)
 
 print(f"\nFile creato: {Path(OUTPUT_CSV).resolve()}")
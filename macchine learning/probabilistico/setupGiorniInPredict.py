@@ -1,22 +1,20 @@
-import pandas as pd
-from datetime import datetime
+import os
+import sys
+
+# Parsing e feature in giorni condivisi con i comandi Django (core/ml/features.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from core.ml.features import aggiungi_giorni, carica_csv  # noqa: E402
 
 input_file = "lampioni_attivi_coordinate.csv"
 output_file = "dataset_con_vita.csv"
 
-# leggi csv
-df = pd.read_csv(input_file)
-
-# data odierna
-oggi = datetime.today()
-
-# conversione colonna data (formato italiano giorno/mese/anno)
-df["arm_data_ini"] = pd.to_datetime(df["arm_data_ini"], dayfirst=True, errors="coerce")
+# leggi csv (date in formato italiano giorno/mese/anno riconosciute con formato esplicito)
+df = carica_csv(input_file)
 
-# calcolo giorni vita attuale
-df["giorni_vita_attuale"] = (oggi - df["arm_data_ini"]).dt.days
+# calcolo giorni vita attuale (da arm_data_ini a oggi)
+df = aggiungi_giorni(df).drop(columns=["giorni_vita_fin", "giorni_guasto", "giorni_osservati_finora"], errors="ignore")
 
 # salva nuovo file
 df.to_csv(output_file, index=False)
 
-print("Creato file:", output_file)
\ No newline at end of file
+print("Creato file:", output_file)
@@ -1,5 +1,11 @@
+import argparse
+import contextlib
 import os
 import json
+import tempfile
+import time
+from collections import Counter
+
 import joblib
 import numpy as np
 import pandas as pd
@@ -12,6 +18,11 @@ from sklearn.preprocessing import OneHotEncoder
 
 import xgboost as xgb
 
+try:
+    import resource  # solo Unix: picco di memoria del processo
+except ImportError:
+    resource = None
+
 
 # ----------------------------
 # CONFIG
@@ -25,6 +36,10 @@ FEATURE_COLS = [
     "giorni_osservati_finora",
 ]
 TARGET_COL = "giorni_guasto"
+# Quota di righe tenute per la validazione (early stopping)
+VAL_FRACTION = 0.2
+# Righe in più tenute dal serbatoio per rispettare le quote degli strati
+MARGINE_SERBATOIO = 0.1
 
 MODEL_DIR = "model_lampioni_survival"
 os.makedirs(MODEL_DIR, exist_ok=True)
@@ -58,19 +73,238 @@ def build_preprocessor() -> ColumnTransformer:
     )
 
 
-def load_csv_sample(path: str, sample_rows: int = 600_000, chunksize: int = 200_000) -> pd.DataFrame:
+class StratifiedReservoir:
+    """
+    Campione casuale stratificato di `capacita` righe, costruito in una sola
+    passata a blocchi: ogni riga riceve una chiave casuale e il serbatoio tiene
+    le righe con le chiavi più piccole di tutto il file (bottom-k globale, con un
+    margine), che sono un campione uniforme qualunque sia l'ordine del file. Le
+    quote per strato si applicano alla fine su questo campione: la RAM resta
+    (1 + margine) * capacità righe, qualunque sia il numero di strati.
+    """
+
+    def __init__(self, capacita: int, colonne_strato, seed: int = RANDOM_STATE, margine: float = MARGINE_SERBATOIO):
+        self.capacita = capacita
+        self.limite = capacita + int(capacita * margine)
+        self.colonne_strato = list(colonne_strato)
+        self.rng = np.random.default_rng(seed)
+        self.righe = None
+        self.strati = {}
+        self.visti = Counter()
+
+    def chiavi_strato(self, df: pd.DataFrame) -> list:
+        """Per ogni colonna un flag "mancante" e il valore (NaN != NaN: ogni blocco creerebbe un nuovo strato)."""
+        chiavi = []
+        for colonna in self.colonne_strato:
+            mancante = df[colonna].isna()
+            chiavi += [mancante.rename(f"{colonna}_mancante"), df[colonna].where(~mancante, 0).rename(colonna)]
+        return chiavi
+
+    def aggiungi(self, df: pd.DataFrame) -> None:
+        df = df.assign(_chiave=self.rng.random(len(df)))
+        codici = np.empty(len(df), dtype=np.int64)
+        for strato, indici in df.groupby(self.chiavi_strato(df), sort=False).indices.items():
+            self.visti[strato] += len(indici)
+            codici[indici] = self.strati.setdefault(strato, len(self.strati))
+        df["_strato"] = codici
+
+        if self.righe is not None:
+            if len(self.righe) >= self.limite:
+                # serbatoio pieno: entrano solo le chiavi sotto la più grande tenuta
+                df = df[df["_chiave"] < self.righe["_chiave"].max()]
+            df = pd.concat([self.righe, df], ignore_index=True)
+        if len(df) > self.limite:
+            tenute = np.argpartition(df["_chiave"].to_numpy(), self.limite - 1)[:self.limite]
+            df = df.iloc[tenute].reset_index(drop=True)
+        self.righe = df
+
+    def quote(self, n: int) -> dict:
+        """Righe per strato proporzionali alle righe viste (metodo dei resti più grandi)."""
+        totale = sum(self.visti.values())
+        if totale <= n:
+            return dict(self.visti)
+        esatte = {strato: n * visti / totale for strato, visti in self.visti.items()}
+        quote = {strato: int(q) for strato, q in esatte.items()}
+        resti = sorted(esatte, key=lambda strato: esatte[strato] - quote[strato], reverse=True)
+        for strato in resti[:n - sum(quote.values())]:
+            quote[strato] += 1
+        return quote
+
+    def campione(self, n: int = None) -> pd.DataFrame:
+        """
+        Il campione stratificato di n righe (default: capacità), in ordine casuale.
+        Se il serbatoio ha meno righe della quota di uno strato, la differenza è
+        presa dalle chiavi più piccole degli altri strati.
+        """
+        n = self.capacita if n is None else min(n, self.capacita)
+        if self.righe is None or not n:
+            return pd.DataFrame()
+        righe = self.righe.sort_values("_chiave", ignore_index=True)
+        quote = self.quote(n)
+        quota_riga = righe["_strato"].map({self.strati[strato]: quota for strato, quota in quote.items()})
+        scelte = righe.groupby("_strato").cumcount() < quota_riga
+        mancanti = n - int(scelte.sum())
+        if mancanti > 0:
+            scelte |= (~scelte).cumsum().le(mancanti) & ~scelte
+        return righe[scelte].drop(columns=["_chiave", "_strato"]).reset_index(drop=True)
+
+
+def iter_clean_chunks(path: str, chunksize: int):
+    """(indice, righe lette, blocco pulito con bounds AFT) per ogni blocco del CSV, leggendo solo le colonne usate."""
+    colonne = set(FEATURE_COLS + [TARGET_COL])
+    for indice, chunk in enumerate(pd.read_csv(path, chunksize=chunksize, usecols=lambda c: c.strip() in colonne)):
+        yield indice, len(chunk), clean_and_make_aft_bounds(chunk)
+
+
+def validation_mask(indice: int, n: int) -> np.ndarray:
+    """Righe del blocco `indice` tenute per la validazione: sempre le stesse a ogni passata sul file."""
+    return np.random.default_rng([RANDOM_STATE, indice]).random(n) < VAL_FRACTION
+
+
+def sample_training_set(path: str, sample_rows: int = 600_000, chunksize: int = 200_000,
+                        stratify_tmo: bool = False) -> pd.DataFrame:
+    """
+    Campione di training (già pulito, con event e bounds AFT) rappresentativo di
+    tutto il CSV: una passata a blocchi, leggendo solo le colonne usate, con
+    campionamento a serbatoio stratificato per event (e per tmo_id se richiesto).
+    """
+    strati = ["event", "tmo_id"] if stratify_tmo else ["event"]
+    serbatoio = StratifiedReservoir(sample_rows, strati)
+
+    lette = 0
+    for _, n, chunk in iter_clean_chunks(path, chunksize):
+        lette += n
+        serbatoio.aggiungi(chunk)
+
+    df = serbatoio.campione()
+    validi = sum(serbatoio.visti.values())
+    guasti = int(df["event"].sum()) if len(df) else 0
+    print(f"Lette {lette:,} righe ({validi:,} valide): campione di {len(df):,} righe, {guasti:,} guasti, "
+          f"{len(serbatoio.visti)} strati.")
+    return df
+
+
+class AFTBatchIter(xgb.DataIter):
+    """
+    Blocchi di training già preprocessati, con i bounds AFT, per QuantileDMatrix
+    ed ExtMemQuantileDMatrix: XGBoost rilegge il CSV a ogni passata e in memoria
+    c'è un solo blocco grezzo alla volta. Le righe di validazione sono escluse.
+    """
+
+    def __init__(self, path: str, chunksize: int, preprocessor, cache_prefix: str = None):
+        self.path = path
+        self.chunksize = chunksize
+        self.preprocessor = preprocessor
+        self.blocchi = None
+        self.righe = 0
+        self.contate = False
+        super().__init__(cache_prefix=cache_prefix, release_data=True)
+
+    def reset(self) -> None:
+        self.blocchi = None
+
+    def next(self, input_data) -> bool:
+        if self.blocchi is None:
+            self.blocchi = iter_clean_chunks(self.path, self.chunksize)
+        for indice, _, df in self.blocchi:
+            df = df[~validation_mask(indice, len(df))]
+            if df.empty:
+                continue
+            if not self.contate:
+                self.righe += len(df)
+            input_data(
+                data=self.preprocessor.transform(df[FEATURE_COLS]),
+                label_lower_bound=df["label_lower_bound"].values.astype(np.float32),
+                label_upper_bound=df["label_upper_bound"].values.astype(np.float32),
+            )
+            return True
+        # le righe si contano solo alla prima passata completa
+        self.contate = True
+        return False
+
+
+def build_in_memory_dmatrix(csv_path: str, sample_rows: int, chunksize: int, stratify_tmo: bool):
+    """Training su un campione in RAM: (dtrain, dval, preprocessor, righe di training)."""
+    # Campione stratificato su tutto il file, con bounds già calcolati
+    df = sample_training_set(csv_path, sample_rows=sample_rows, chunksize=chunksize, stratify_tmo=stratify_tmo)
+
+    # Split train/val (stratify su event per bilanciare)
+    X = df[FEATURE_COLS]
+    yL = df["label_lower_bound"].values.astype(np.float32)
+    yU = df["label_upper_bound"].values.astype(np.float32)
+
+    X_train, X_val, yL_train, yL_val, yU_train, yU_val = train_test_split(
+        X, yL, yU,
+        test_size=VAL_FRACTION,
+        random_state=RANDOM_STATE,
+        stratify=df["event"]
+    )
+
+    # Preprocess
+    preprocessor = build_preprocessor()
+    Xtr = preprocessor.fit_transform(X_train)
+    Xva = preprocessor.transform(X_val)
+
+    # DMatrix con bounds
+    dtrain = xgb.DMatrix(Xtr)
+    dtrain.set_float_info("label_lower_bound", yL_train)
+    dtrain.set_float_info("label_upper_bound", yU_train)
+
+    dval = xgb.DMatrix(Xva)
+    dval.set_float_info("label_lower_bound", yL_val)
+    dval.set_float_info("label_upper_bound", yU_val)
+    return dtrain, dval, preprocessor, len(X_train)
+
+
+def build_out_of_core_dmatrix(csv_path: str, sample_rows: int, chunksize: int, stratify_tmo: bool,
+                              mode: str, cache_dir: str):
     """
-    Legge un campione dal CSV a chunk (ottimo con dataset enormi).
-    Aumenta sample_rows se vuoi più dati per training.
+    Training su tutto il file senza caricarlo: (dtrain, dval, preprocessor, righe di training).
+
+    Una prima passata estrae due campioni a serbatoio (stratificati come in
+    sample_training_set): quello di training serve a fittare il preprocessor,
+    quello di validazione (al più VAL_FRACTION * sample_rows righe) diventa la
+    DMatrix di validazione. Poi AFTBatchIter alimenta XGBoost con tutte le righe
+    di training a blocchi: QuantileDMatrix ("quantile") tiene in RAM solo la
+    matrice quantizzata, ExtMemQuantileDMatrix ("extmem") scrive le pagine in cache_dir.
     """
-    chunks = []
-    read = 0
-    for chunk in pd.read_csv(path, chunksize=chunksize):
-        chunks.append(chunk)
-        read += len(chunk)
-        if read >= sample_rows:
-            break
-    return pd.concat(chunks, ignore_index=True)
+    strati = ["event", "tmo_id"] if stratify_tmo else ["event"]
+    campione_train = StratifiedReservoir(sample_rows, strati)
+    campione_val = StratifiedReservoir(max(1, int(sample_rows * VAL_FRACTION)), strati)
+    for indice, _, df in iter_clean_chunks(csv_path, chunksize):
+        validazione = validation_mask(indice, len(df))
+        campione_train.aggiungi(df[~validazione])
+        campione_val.aggiungi(df[validazione])
+
+    preprocessor = build_preprocessor()
+    preprocessor.fit(campione_train.campione()[FEATURE_COLS])
+
+    iteratore = AFTBatchIter(
+        csv_path, chunksize, preprocessor,
+        cache_prefix=os.path.join(cache_dir, "aft") if mode == "extmem" else None,
+    )
+    if mode == "extmem":
+        dtrain = xgb.ExtMemQuantileDMatrix(iteratore)
+    else:
+        dtrain = xgb.QuantileDMatrix(iteratore)
+
+    val = campione_val.campione()
+    dval = xgb.QuantileDMatrix(
+        preprocessor.transform(val[FEATURE_COLS]), ref=dtrain,
+        label_lower_bound=val["label_lower_bound"].values.astype(np.float32),
+        label_upper_bound=val["label_upper_bound"].values.astype(np.float32),
+    )
+    print(f"Training out-of-core ({mode}): {iteratore.righe:,} righe di training, {len(val):,} di validazione.")
+    return dtrain, dval, preprocessor, iteratore.righe
+
+
+def peak_memory_mb():
+    """Picco di memoria residente del processo in MB (None dove resource non esiste, es. Windows)."""
+    if resource is None:
+        return None
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    return picco / (1024 * 1024) if os.uname().sysname == "Darwin" else picco / 1024
 
 
 def clean_and_make_aft_bounds(df: pd.DataFrame) -> pd.DataFrame:
@@ -128,39 +362,55 @@ def clean_and_make_aft_bounds(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def train_model(csv_path: str) -> None:
+def train_model(csv_path: str, sample_rows: int = 600_000, chunksize: int = 200_000,
+                stratify_tmo: bool = False, out_of_core: str = None, cache_dir: str = None,
+                num_boost_round: int = 5000) -> None:
     print(f"Using xgboost version: {xgb.__version__}")
-
-    # 1) Carico campione e preparo bounds
-    df = load_csv_sample(csv_path, sample_rows=600_000, chunksize=200_000)
-    df = clean_and_make_aft_bounds(df)
-
-    # 2) Split train/val (stratify su event per bilanciare)
-    X = df[FEATURE_COLS]
-    yL = df["label_lower_bound"].values.astype(np.float32)
-    yU = df["label_upper_bound"].values.astype(np.float32)
-
-    X_train, X_val, yL_train, yL_val, yU_train, yU_val = train_test_split(
-        X, yL, yU,
-        test_size=0.2,
-        random_state=RANDOM_STATE,
-        stratify=df["event"]
+    inizio = time.perf_counter()
+
+    # 1-4) DMatrix di training e validazione con i bounds AFT
+    cache = tempfile.TemporaryDirectory(dir=cache_dir) if out_of_core == "extmem" else contextlib.nullcontext()
+    with cache as cartella_cache:
+        if out_of_core:
+            dtrain, dval, preprocessor, righe = build_out_of_core_dmatrix(
+                csv_path, sample_rows, chunksize, stratify_tmo, out_of_core, cartella_cache
+            )
+        else:
+            dtrain, dval, preprocessor, righe = build_in_memory_dmatrix(csv_path, sample_rows, chunksize, stratify_tmo)
+        preparazione = time.perf_counter() - inizio
+        booster = _train_booster(dtrain, dval, num_boost_round)
+        # le pagine di ExtMemQuantileDMatrix restano aperte finché esiste la DMatrix
+        del dtrain, dval
+
+    durata = time.perf_counter() - inizio
+    picco = peak_memory_mb()
+    print(
+        f"\nModalità {out_of_core or 'in memoria'}: {righe:,} righe di training, "
+        f"preparazione {preparazione:.1f}s, totale {durata:.1f}s, "
+        f"picco RSS {'n/d' if picco is None else f'{picco:,.0f} MB'}."
     )
 
-    # 3) Preprocess
-    preprocessor = build_preprocessor()
-    Xtr = preprocessor.fit_transform(X_train)
-    Xva = preprocessor.transform(X_val)
+    # 6) Salvataggio artefatti
+    joblib.dump(preprocessor, os.path.join(MODEL_DIR, "preprocessor.joblib"))
+    booster.save_model(os.path.join(MODEL_DIR, "xgb_aft.json"))
 
-    # 4) DMatrix con bounds
-    dtrain = xgb.DMatrix(Xtr)
-    dtrain.set_float_info("label_lower_bound", yL_train)
-    dtrain.set_float_info("label_upper_bound", yU_train)
+    meta = {
+        "feature_cols": FEATURE_COLS,
+        "target_col": TARGET_COL,
+        "objective": "survival:aft",
+        "notes": "censored rows: lower=giorni_osservati_finora, upper=inf; failures: lower=upper=giorni_guasto",
+        "xgboost_version": xgb.__version__,
+    }
+    with open(os.path.join(MODEL_DIR, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    print(f"\n✅ Modello salvato in: {MODEL_DIR}")
+    print("   - preprocessor.joblib")
+    print("   - xgb_aft.json")
+    print("   - meta.json")
 
-    dval = xgb.DMatrix(Xva)
-    dval.set_float_info("label_lower_bound", yL_val)
-    dval.set_float_info("label_upper_bound", yU_val)
 
+def _train_booster(dtrain, dval, num_boost_round: int) -> xgb.Booster:
     # 5) Parametri modello AFT
     params = {
         "objective": "survival:aft",
@@ -179,38 +429,27 @@ def train_model(csv_path: str) -> None:
         "seed": 42,
     }
 
-
-    booster = xgb.train(
+    return xgb.train(
         params=params,
         dtrain=dtrain,
-        num_boost_round=5000,
+        num_boost_round=num_boost_round,
         evals=[(dtrain, "train"), (dval, "val")],
         early_stopping_rounds=200,
         verbose_eval=50,
     )
 
-    # 6) Salvataggio artefatti
-    joblib.dump(preprocessor, os.path.join(MODEL_DIR, "preprocessor.joblib"))
-    booster.save_model(os.path.join(MODEL_DIR, "xgb_aft.json"))
-
-    meta = {
-        "feature_cols": FEATURE_COLS,
-        "target_col": TARGET_COL,
-        "objective": "survival:aft",
-        "notes": "censored rows: lower=giorni_osservati_finora, upper=inf; failures: lower=upper=giorni_guasto",
-        "xgboost_version": xgb.__version__,
-    }
-    with open(os.path.join(MODEL_DIR, "meta.json"), "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
-
-    print(f"\n✅ Modello salvato in: {MODEL_DIR}")
-    print("   - preprocessor.joblib")
-    print("   - xgb_aft.json")
-    print("   - meta.json")
-
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) < 2:
-        raise SystemExit("Uso: python train_lampioni_survival.py /percorso/dataset.csv")
-    train_model(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Training del modello di sopravvivenza XGBoost AFT.")
+    parser.add_argument("csv", help="Percorso del dataset CSV.")
+    parser.add_argument("--sample-rows", type=int, default=600_000, help="Righe del campione di training (estratte da tutto il file).")
+    parser.add_argument("--chunksize", type=int, default=200_000, help="Righe lette dal CSV per ogni blocco.")
+    parser.add_argument("--strato-tmo", action="store_true", help="Stratifica il campione anche per tmo_id, oltre che per event.")
+    parser.add_argument("--out-of-core", choices=["quantile", "extmem"], default=None, help="Allena su tutte le righe del file a blocchi: QuantileDMatrix (matrice quantizzata in RAM) o ExtMemQuantileDMatrix (pagine su disco). Default: campione in memoria.")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Cartella delle pagine temporanee di --out-of-core extmem (default: cartella temporanea di sistema).")
+    parser.add_argument("--num-boost-round", type=int, default=5000, help="Round massimi di boosting (con early stopping sulla validazione).")
+    args = parser.parse_args()
+    train_model(
+        args.csv, sample_rows=args.sample_rows, chunksize=args.chunksize, stratify_tmo=args.strato_tmo,
+        out_of_core=args.out_of_core, cache_dir=args.cache_dir, num_boost_round=args.num_boost_round,
+    )
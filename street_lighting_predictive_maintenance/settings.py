@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -73,11 +74,88 @@ WSGI_APPLICATION = 'street_lighting_predictive_maintenance.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# Journal WAL: i lettori (pagine web) non si bloccano mentre un import o
+# score_model scrive, e continuano a vedere i dati precedenti fino al commit
+# (import_lampioneNuovo --swap). La modalità è persistente nel file del database.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode = WAL;',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Di default in memoria locale (una copia per processo). Con più processi web
+# impostare CACHE_BACKEND=file (cartella CACHE_LOCATION) oppure CACHE_BACKEND=db
+# (tabella CACHE_LOCATION, da creare con "python manage.py createcachetable").
+# Le chiavi contengono la versione dei dati (core.cache): i comandi di import e
+# score_model la incrementano e le pagine vengono ricalcolate.
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', BASE_DIR / 'cache'),
+        }
+    }
+elif CACHE_BACKEND == 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'core_cache'),
+        }
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 2000},
+        }
+    }
+
+
+# Coda write-behind delle segnalazioni (core.segnalazioni): un journal per processo
+
+SEGNALAZIONI_CODA_DIR = os.environ.get('SEGNALAZIONI_CODA_DIR', BASE_DIR / 'coda_segnalazioni')
+
+
+# Server dei modelli (comando model_server): i client ripiegano sui modelli locali se non risponde
+
+MODEL_SERVER_URL = os.environ.get('MODEL_SERVER_URL', 'http://127.0.0.1:8765')
+
+
+# Mappa delle schede dei lampioni: 'leaflet' (disegnata nel browser) oppure 'folium' (HTML dal server, in cache)
+
+MAPPA_ASSET = os.environ.get('MAPPA_ASSET', 'leaflet')
+
+
+# Processi del pool condiviso che genera i PDF degli export zip (uno per tutto il server web)
+
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+
+
+# Logging
+# https://docs.djangoproject.com/en/6.0/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'semplice': {'format': '{asctime} {levelname} {name}: {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'semplice'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': os.environ.get('CORE_LOG_LEVEL', 'INFO')},
+    },
 }
 
 